@@ -0,0 +1,272 @@
+#! /usr/bin/env python
+######################################################################
+#
+# Name: bookkeepingwriter.py
+#
+# Purpose: Python class BookkeepingWriter (used by project.py script).
+#          This class writes a set of bookkeeping files (files.list,
+#          events.list, bad.list, etc.) into a bookkeeping directory as
+#          a single batch.
+#
+#          Files are first written into a local staging directory.
+#          When the batch is committed, all files are copied into the
+#          bookkeeping directory under temporary names using a single
+#          bulk copy (larbatch_posix.copy_many), and are then renamed
+#          over the existing files (in parallel).  Readers never see a
+#          partially written file, and if the copy fails, the existing
+#          set of files is left untouched.
+#
+#          The last file of the batch (e.g. "checked") serves as a
+#          marker that the whole set is complete.  A unique batch token
+#          is appended to the marker.  Before any other file is renamed,
+#          the old marker is removed, and the new marker is renamed into
+#          place last.  Readers of the bookkeeping files use static
+#          method read_batch, which requires the marker to be present
+#          and unchanged while the files are read.  Therefore readers
+#          never act on a mix of old and new files, even if a batch is
+#          being published, or publishing was interrupted.
+#
+#          Where rename can't replace an existing file (uberftp), the
+#          existing files are removed (in parallel) before the new files
+#          are renamed into place.
+#
+#          Empty files in dCache are created using ifdh, so that they
+#          have layer two.  All empty files of a batch are created by
+#          a single "ifdh cp -f" command, instead of being fixed one at
+#          a time after being written (see project_utilities.addLayerTwo).
+#
+# Created: 18-Oct-2026
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os, re, uuid, time, tempfile, shutil
+import larbatch_posix
+import larbatch_utilities
+from project_modules.ifdherror import IFDHError
+
+# Bookkeeping writer class.
+
+class BookkeepingWriter:
+
+    # Pattern of temporary and backup file names (<name>.<token>.tmp or
+    # <name>.<token>.old).  Backup files were made by earlier versions.
+
+    tmp_pattern = re.compile(r'^(.*)\.[0-9a-f]{32}\.(tmp|old)$')
+
+    # Constructor.
+
+    def __init__(self, bookdir):
+
+        self.bookdir = bookdir         # Bookkeeping directory.
+        self.stagedir = ''             # Local staging directory.
+        self.names = []                # File names, in the order they were opened.
+        self.files = {}                # files[name] = open local file.
+        self.locals = {}               # locals[name] = local path.
+        self.overwrite = None          # Can rename replace existing files?
+
+    # Return path of file name in the bookkeeping directory.
+
+    def path(self, name):
+        return os.path.join(self.bookdir, name)
+
+    # Open a bookkeeping file (specified as a name relative to the
+    # bookkeeping directory) for writing.  Return a local file object.
+    # Opening a file that is already open returns the same file object.
+
+    def open(self, name):
+
+        if name in self.files:
+            return self.files[name]
+        if self.stagedir == '':
+            self.stagedir = tempfile.mkdtemp(prefix='bookkeeping_')
+        local = os.path.join(self.stagedir, '%d_%s' % (len(self.names), name))
+        self.files[name] = open(local, 'w')
+        self.locals[name] = local
+        self.names.append(name)
+        return self.files[name]
+
+    # Add an existing local file to the batch (published as name).
+    # The local file must not be deleted until the batch is committed.
+
+    def add(self, name, local):
+
+        if name in self.files:
+            self.files[name].close()
+            del self.files[name]
+            self.names.remove(name)
+        self.locals[name] = local
+        self.names.append(name)
+
+    # Close local files.
+
+    def close_files(self):
+
+        for name in list(self.files.keys()):
+            self.files[name].close()
+        self.files = {}
+
+    # Discard batch without publishing anything.
+
+    def abort(self):
+
+        self.close_files()
+        if self.stagedir != '' and os.path.isdir(self.stagedir):
+            shutil.rmtree(self.stagedir, ignore_errors=True)
+        self.stagedir = ''
+        self.names = []
+        self.locals = {}
+
+    # Delete leftover temporary and backup files of previous (interrupted)
+    # batches.
+
+    def remove_leftovers(self):
+
+        names = set(self.names)
+        leftovers = []
+        for name in larbatch_posix.listdir(self.bookdir):
+            m = BookkeepingWriter.tmp_pattern.match(name)
+            if m and m.group(1) in names:
+                leftovers.append((self.path(name),))
+        if len(leftovers) > 0:
+            larbatch_utilities.parallel_call(larbatch_posix.remove_if_exists, leftovers, 8)
+
+    # Publish all files of this batch in the bookkeeping directory.
+    # Raise IOError if any file could not be copied (in which case the
+    # existing bookkeeping files are not changed).
+
+    def commit(self):
+
+        self.close_files()
+        if len(self.names) == 0:
+            self.abort()
+            return
+        self.remove_leftovers()
+
+        # Append batch token to marker.
+
+        token = uuid.uuid4().hex
+        if len(self.names) > 1:
+            local = self.locals[self.names[-1]]
+            if os.path.dirname(local) == self.stagedir:
+                f = open(local, 'a')
+                f.write('%s\n' % token)
+                f.close()
+
+        # Copy files to temporary names.
+
+        tmps = {}
+        pairs = []
+        empties = []
+        for name in self.names:
+            tmps[name] = self.path('%s.%s.tmp' % (name, token))
+            if os.path.getsize(self.locals[name]) == 0 and tmps[name][0:6] == '/pnfs/' and \
+               larbatch_posix.get_backend(tmps[name]) == None:
+                empties.append(('/dev/null', tmps[name]))
+            else:
+                pairs.append((self.locals[name], tmps[name]))
+        errors = []
+        for src, dest, error in larbatch_posix.copy_many(pairs):
+            if error != None:
+                errors.append('%s: %s' % (dest, error))
+        if len(empties) > 0 and len(errors) == 0:
+            try:
+                larbatch_utilities.ifdh_cp_many(empties)
+            except Exception as e:
+                errors.append(str(e))
+            for src, dest in empties:
+                larbatch_posix.invalidate_cache(dest)
+        if len(errors) > 0:
+            larbatch_utilities.parallel_call(larbatch_posix.remove_if_exists,
+                                             [(tmps[name],) for name in self.names], 8)
+            self.abort()
+            raise IOError('Unable to write bookkeeping files in %s.\n%s' % (self.bookdir,
+                                                                            '\n'.join(errors)))
+
+        # Rename temporary files over existing files.
+        # The marker (last file) is removed first and renamed last.
+
+        try:
+            names = list(self.names)
+            marker = None
+            if len(names) > 1:
+                marker = names.pop()
+                larbatch_posix.remove_if_exists(self.path(marker))
+            self.rename_all(names, tmps)
+            if marker != None:
+                self.rename_all([marker], tmps)
+        except:
+            larbatch_utilities.parallel_call(larbatch_posix.remove_if_exists,
+                                             [(tmps[name],) for name in self.names], 8)
+            self.abort()
+            raise
+
+        # Done.
+
+        self.abort()
+
+    # Rename temporary files of the specified names into place (in parallel).
+    # The first rename of a batch determines whether rename can replace
+    # existing files.  If not (uberftp), existing files are removed first.
+
+    def rename_all(self, names, tmps):
+
+        names = list(names)
+        if len(names) > 0 and self.overwrite == None:
+            try:
+                larbatch_posix.rename(tmps[names[0]], self.path(names[0]))
+                self.overwrite = True
+                names = names[1:]
+            except:
+                if not larbatch_posix.exists(self.path(names[0])):
+                    raise
+                self.overwrite = False
+        if len(names) == 0:
+            return
+        if not self.overwrite:
+            existing = set(larbatch_posix.listdir(self.bookdir))
+            removes = [(self.path(name),) for name in names if name in existing]
+            if len(removes) > 0:
+                for result, error in larbatch_utilities.parallel_call(larbatch_posix.remove,
+                                                                      removes, 8):
+                    if error != None:
+                        raise error
+        renames = [(tmps[name], self.path(name)) for name in names]
+        for result, error in larbatch_utilities.parallel_call(larbatch_posix.rename, renames, 8):
+            if error != None:
+                raise error
+
+    # Read the files of a published batch.
+    # Argument names is a list of file names (relative to the bookkeeping
+    # directory), and marker is the marker file of the batch.
+    # Return value is a dictionary {name: list of lines}, where the value is
+    # None for files that don't exist.  Return None if there is no complete
+    # batch (no marker), or if the batch kept changing while it was read.
+
+    @staticmethod
+    def read_batch(bookdir, names, marker='checked', retries=3):
+
+        marker_path = os.path.join(bookdir, marker)
+        for attempt in range(retries):
+            if attempt > 0:
+                larbatch_posix.invalidate_cache(bookdir)
+                time.sleep(1)
+            try:
+                contents = set(larbatch_posix.listdir(bookdir))
+                if not marker in contents:
+                    return None
+                token = larbatch_posix.readlines(marker_path)
+                result = {}
+                for name in names:
+                    result[name] = None
+                    if name in contents:
+                        result[name] = larbatch_posix.readlines(os.path.join(bookdir, name))
+                if larbatch_posix.readlines(marker_path) == token:
+                    return result
+            except (IOError, OSError, IFDHError):
+                pass
+
+        # Done (batch not readable).
+
+        return None
@@ -0,0 +1,283 @@
+#! /usr/bin/env python
+######################################################################
+#
+# Name: dcachesimulator.py
+#
+# Purpose: Python class DCacheSimulator.  This class is an in-memory
+#          storage backend (see class StorageBackend) that simulates
+#          the performance characteristics of dCache.  It is intended
+#          for measuring the performance of larbatch_posix and its
+#          callers reproducibly, without access to /pnfs or grid tools.
+#
+#          Usage example:
+#
+#          sim = DCacheSimulator(latency=0.2, listing_cost=0.001, seed=1)
+#          sim.add_file('/pnfs/exp/scratch/a/files.list', b'...')
+#          larbatch_posix.register_backend('/pnfs/', sim)
+#          ...
+#          print(sim.calls)
+#
+#          Constructor arguments (all optional):
+#
+#          latency         - Latency (seconds) of each operation.  May be
+#                            a number (same for all operations), or a
+#                            dictionary {operation: latency}, where the
+#                            operations are the StorageBackend method names.
+#          hang_probability - Probability that any operation hangs.  A
+#                            hung operation sleeps for hang_time seconds,
+#                            then raises OSError (simulating a timeout).
+#          hang_time       - Duration (seconds) of simulated hangs.
+#          listing_cost    - Additional latency (seconds) of listdir for
+#                            each directory entry.
+#          seed            - Random number seed (for reproducible hangs).
+#
+#          Attributes:
+#
+#          calls - Dictionary {operation: number of calls}.
+#
+# Created: 18-Oct-2026
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os, io, time, random, threading
+import stat as statmod
+from project_modules.storagebackend import StorageBackend
+
+# Simulated dCache backend class.
+
+class DCacheSimulator(StorageBackend):
+
+    # Constructor.
+
+    def __init__(self, latency=0., hang_probability=0., hang_time=60.,
+                 listing_cost=0., seed=None):
+
+        StorageBackend.__init__(self)
+        self.latency = latency
+        self.hang_probability = hang_probability
+        self.hang_time = hang_time
+        self.listing_cost = listing_cost
+        self.random = random.Random(seed)
+        self.calls = {}
+        self.lock = threading.Lock()
+
+        # Simulated file system.
+
+        self.files = {}         # files[path] = contents (bytes).
+        self.dirs = {'/': {}}   # dirs[path] = {name: True (dir) or False (file)}.
+        self.modes = {}         # modes[path] = permission bits.
+        self.links = {}         # links[path] = symbolic link target.
+
+    # Simulate the cost of an operation.
+
+    def delay(self, op, nentries=0):
+        self.lock.acquire()
+        self.calls[op] = self.calls.get(op, 0) + 1
+        hang = self.random.random() < self.hang_probability
+        self.lock.release()
+        if type(self.latency) == type({}):
+            t = self.latency.get(op, 0.)
+        else:
+            t = self.latency
+        t += self.listing_cost * nentries
+        if hang:
+            time.sleep(self.hang_time)
+            raise OSError('Simulated dCache %s timed out.' % op)
+        if t > 0.:
+            time.sleep(t)
+
+    # Populate simulated file system (no simulated cost).
+
+    def add_file(self, path, data=b''):
+        path = os.path.normpath(path)
+        self.add_dir(os.path.dirname(path))
+        if type(data) != type(b''):
+            data = data.encode()
+        self.lock.acquire()
+        self.files[path] = data
+        self.dirs[os.path.dirname(path)][os.path.basename(path)] = False
+        self.lock.release()
+
+    def add_dir(self, path):
+        path = os.path.normpath(path)
+        self.lock.acquire()
+        missing = []
+        while path not in self.dirs:
+            missing.append(path)
+            path = os.path.dirname(path)
+        for path in reversed(missing):
+            self.dirs[path] = {}
+            self.dirs[os.path.dirname(path)][os.path.basename(path)] = True
+        self.lock.release()
+
+    # Make sure that path exists (and is or is not a directory).
+
+    def check(self, path, isdir=None):
+        if path not in self.files and path not in self.dirs:
+            raise OSError('No such file or directory: %s' % path)
+        if isdir == True and path not in self.dirs:
+            raise OSError('Not a directory: %s' % path)
+        if isdir == False and path in self.dirs:
+            raise OSError('Is a directory: %s' % path)
+
+    # Make sure that the parent directory of path exists.
+
+    def check_parent(self, path):
+        parent = os.path.dirname(path)
+        if parent not in self.dirs:
+            raise OSError('No such file or directory: %s' % parent)
+
+    # List directory.
+
+    def listdir(self, path):
+        path = os.path.normpath(path)
+        self.lock.acquire()
+        contents = dict(self.dirs.get(path, {}))
+        self.lock.release()
+        self.delay('listdir', len(contents))
+        self.check(path, True)
+        return sorted(contents.items())
+
+    # File status.
+
+    def stat(self, path):
+        self.delay('stat')
+        path = os.path.normpath(path)
+        self.check(path)
+        if path in self.dirs:
+            mode = statmod.S_IFDIR | self.modes.get(path, 0o755)
+            size = 512
+        elif path in self.links:
+            mode = statmod.S_IFLNK | 0o777
+            size = len(self.links[path])
+        else:
+            mode = statmod.S_IFREG | self.modes.get(path, 0o644)
+            size = len(self.files[path])
+        return os.stat_result((mode, 0, 0, 1, os.getuid(), os.getgid(), size, 0, 0, 0))
+
+    # Open file.
+    # Files opened for writing are stored when they are closed.
+
+    def open(self, path, mode='r', buf=-1):
+        self.delay('open')
+        path = os.path.normpath(path)
+        binary = mode.find('b') >= 0
+        if mode.find('r') >= 0 and mode.find('+') < 0:
+            self.check(path, False)
+            data = self.files[path]
+            if binary:
+                return io.BytesIO(data)
+            else:
+                return io.StringIO(data.decode())
+
+        # Write or append mode.
+
+        self.check_parent(path)
+        if path in self.dirs:
+            raise OSError('Is a directory: %s' % path)
+        if binary:
+            f = io.BytesIO()
+        else:
+            f = io.StringIO()
+        if (mode.find('a') >= 0 or mode.find('+') >= 0) and path in self.files:
+            if binary:
+                f.write(self.files[path])
+            else:
+                f.write(self.files[path].decode())
+            if mode.find('a') < 0:
+                f.seek(0)
+        original_close = f.close
+        def close():
+            if not f.closed:
+                data = f.getvalue()
+                if not binary:
+                    data = data.encode()
+                self.add_file(path, data)
+            original_close()
+        f.close = close
+        return f
+
+    # Copy file.
+
+    def copy(self, src, dest):
+        self.delay('copy')
+        src = os.path.normpath(src)
+        dest = os.path.normpath(dest)
+        self.check(src, False)
+        self.check_parent(dest)
+        self.add_file(dest, self.files[src])
+
+    # Delete file.
+
+    def remove(self, path):
+        self.delay('remove')
+        path = os.path.normpath(path)
+        self.check(path, False)
+        self.lock.acquire()
+        del self.files[path]
+        self.links.pop(path, None)
+        self.modes.pop(path, None)
+        del self.dirs[os.path.dirname(path)][os.path.basename(path)]
+        self.lock.release()
+
+    # Rename file or directory (including contents).
+
+    def rename(self, src, dest):
+        self.delay('rename')
+        src = os.path.normpath(src)
+        dest = os.path.normpath(dest)
+        self.check(src)
+        self.check_parent(dest)
+        prefix = os.path.join(src, '')
+        self.lock.acquire()
+        for table in (self.files, self.dirs, self.modes, self.links):
+            for path in list(table.keys()):
+                if path == src or path.startswith(prefix):
+                    table[dest + path[len(src):]] = table.pop(path)
+        isdir = self.dirs[os.path.dirname(src)].pop(os.path.basename(src))
+        self.dirs[os.path.dirname(dest)][os.path.basename(dest)] = isdir
+        self.lock.release()
+
+    # Make directory.
+
+    def mkdir(self, path, mode=0o777):
+        self.delay('mkdir')
+        path = os.path.normpath(path)
+        self.check_parent(path)
+        if path in self.dirs or path in self.files:
+            raise OSError('File exists: %s' % path)
+        self.add_dir(path)
+
+    # Delete empty directory.
+
+    def rmdir(self, path):
+        self.delay('rmdir')
+        path = os.path.normpath(path)
+        self.check(path, True)
+        self.lock.acquire()
+        if len(self.dirs[path]) > 0:
+            self.lock.release()
+            raise OSError('Directory not empty: %s' % path)
+        del self.dirs[path]
+        self.modes.pop(path, None)
+        del self.dirs[os.path.dirname(path)][os.path.basename(path)]
+        self.lock.release()
+
+    # Change mode.
+
+    def chmod(self, path, mode):
+        self.delay('chmod')
+        path = os.path.normpath(path)
+        self.check(path)
+        self.modes[path] = mode & 0o7777
+
+    # Make symbolic link.
+
+    def symlink(self, src, dest):
+        self.delay('symlink')
+        dest = os.path.normpath(dest)
+        self.check_parent(dest)
+        self.add_file(dest, b'')
+        self.links[dest] = src
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+######################################################################
+#
+# Name: ifdh_local.py
+#
+# Purpose: Python module ifdh_local.  This module is a local file system
+#          stand-in for the ifdh python binding.  It provides a class
+#          ifdh with the subset of binding methods used by ifdh_server.py
+#          (cp, mv, ls, ll, mkdir, rmdir, rm, chmod), with the same
+#          calling conventions and return values as the binding.  In
+#          particular, method ls returns an empty list for a missing path,
+#          and method ll writes its listing to standard output using C
+#          stdio (when available), as the binding does.
+#
+#          The stand-in is selected in the ifdh helper process by setting
+#          environment variable LARBATCH_IFDH_MODULE=ifdh_local.
+#
+#          When run as a script, this module tests the ifdh helper
+#          process using the stand-in in a scratch directory.
+#
+# Created: 18-Oct-2026
+#
+# Command line usage:
+#
+# ifdh_local.py [-h|--help] [--test]
+#
+# Options:
+#
+# -h, --help - Print help.
+# --test     - Test the ifdh helper process (ifdh_server.py) using this
+#              stand-in.
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+# Imports
+
+import sys, os, shutil, time, tempfile
+import stat as statmod
+try:
+    import ctypes, ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library('c'))
+except:
+    libc = None
+
+
+# Stand-in ifdh class.
+
+class ifdh:
+
+    # Constructor.
+
+    def __init__(self, *args):
+        pass
+
+    # Copy files.  Supports the "ifdh cp" argument forms
+    # <src> <dest>, -D <src1> <src2> ... <destdir>, and -f <listfile>.
+
+    def cp(self, args):
+        return self.transfer(args, shutil.copy)
+
+    # Move files.
+
+    def mv(self, args):
+        return self.transfer(args, shutil.move)
+
+    # List directory.  Directories are returned with a trailing '/'.
+    # Return value is a list of paths, which is empty if the path
+    # doesn't exist.
+
+    def ls(self, loc, depth, force=''):
+        result = []
+        for path, sr in self.tree(loc, depth):
+            if statmod.S_ISDIR(sr.st_mode):
+                result.append(os.path.join(path, ''))
+            else:
+                result.append(path)
+        return result
+
+    # Long listing, written to standard output.
+
+    def ll(self, loc, depth, force=''):
+        if not os.path.exists(loc):
+            self.error('No such file or directory: %s' % loc)
+            return 1
+        for path, sr in self.tree(loc, depth):
+            line = '%s %d %d %d %d %s %s\n' % (statmod.filemode(sr.st_mode),
+                                              sr.st_nlink, sr.st_uid, sr.st_gid,
+                                              sr.st_size,
+                                              time.strftime('%b %d %H:%M',
+                                                            time.localtime(sr.st_mtime)),
+                                              path)
+            if libc != None:
+                libc.printf(b'%s', line.encode())
+            else:
+                sys.stdout.write(line)
+        return 0
+
+    # Make directory.
+
+    def mkdir(self, loc, force=''):
+        return self.call(os.mkdir, loc)
+
+    # Remove directory.
+
+    def rmdir(self, loc, force=''):
+        return self.call(os.rmdir, loc)
+
+    # Remove file.
+
+    def rm(self, loc, force=''):
+        return self.call(os.remove, loc)
+
+    # Change mode.
+
+    def chmod(self, mode, loc, force=''):
+        return self.call(os.chmod, loc, int(mode, 8))
+
+    # Generate (path, os.stat_result) for a path and its contents, down
+    # to the specified depth.
+
+    def tree(self, loc, depth):
+        path = os.path.normpath(loc)
+        try:
+            sr = os.stat(path)
+        except OSError:
+            return
+        yield path, sr
+        if depth > 0 and statmod.S_ISDIR(sr.st_mode):
+            for name in sorted(os.listdir(path)):
+                for result in self.tree(os.path.join(path, name), depth - 1):
+                    yield result
+
+    # Do a copy or move.
+
+    def transfer(self, args, func):
+        words = [arg for arg in args if not arg.startswith('--')]
+        pairs = []
+        if len(words) > 0 and words[0] == '-f':
+            for line in open(words[1]).readlines():
+                pair = line.split()
+                if len(pair) == 2:
+                    pairs.append(pair)
+        elif len(words) > 0 and words[0] == '-D':
+            for src in words[1:-1]:
+                pairs.append((src, os.path.join(words[-1], os.path.basename(src))))
+        elif len(words) == 2:
+            pairs.append(words)
+        else:
+            self.error('Bad arguments: %s' % ' '.join(args))
+            return 1
+        for src, dest in pairs:
+            rc = self.call(func, src, dest)
+            if rc != 0:
+                return rc
+        return 0
+
+    # Call a file system function.
+    # Return value is zero for success, nonzero for error.
+
+    def call(self, func, *args):
+        try:
+            func(*args)
+        except (IOError, OSError) as e:
+            self.error(str(e))
+            return 1
+        return 0
+
+    # Report an error.
+
+    def error(self, msg):
+        sys.stderr.write('%s\n' % msg)
+        sys.stderr.flush()
+
+
+# Main procedure.
+
+def main(argv):
+
+    # Parse arguments.
+
+    args = argv[1:]
+    if len(args) == 0:
+        help()
+        return 0
+    while len(args) > 0:
+        if args[0] == '-h' or args[0] == '--help' :
+            help()
+            return 0
+        elif args[0] == '--test':
+            del args[0]
+        else:
+            print('Unknown option %s' % args[0])
+            return 1
+
+    return test()
+
+
+# Help function.
+
+def help():
+    filename = sys.argv[0]
+    file = open(filename, 'r')
+
+    doprint=0
+
+    for line in file.readlines():
+        if line[2:15] == 'ifdh_local.py':
+            doprint = 1
+        elif line[0:6] == '######' and doprint:
+            doprint = 0
+        if doprint:
+            if len(line) > 2:
+                print(line[2:], end=' ')
+            else:
+                print()
+
+
+# Test the ifdh helper process using this stand-in.
+# Return value is zero if all checks pass, otherwise one.
+
+def test():
+
+    # Use the stand-in, with normal (buffered) C stdio in the helper process.
+
+    os.environ['LARBATCH_IFDH_MODULE'] = 'ifdh_local'
+    if 'PYTHONUNBUFFERED' in os.environ:
+        del os.environ['PYTHONUNBUFFERED']
+    import larbatch_utilities
+    from project_modules.ifdherror import IFDHError
+    larbatch_utilities.use_ifdh_server(True)
+
+    failures = []
+    def check(ok, what):
+        print('%-50s %s' % (what, ok and 'ok' or 'FAILED'))
+        if not ok:
+            failures.append(what)
+
+    def command(*cmd):
+        return larbatch_utilities.ifdh_command(['ifdh'] + list(cmd), 60)
+
+    top = tempfile.mkdtemp()
+    try:
+        dir = os.path.join(top, 'dir')
+        src = os.path.join(top, 'src.txt')
+        dest = os.path.join(dir, 'dest.txt')
+        missing = os.path.join(top, 'missing')
+        open(src, 'w').write('hello\n')
+
+        command('mkdir', dir)
+        check(os.path.isdir(dir), 'mkdir')
+
+        command('cp', src, dest)
+        check(open(dest).read() == 'hello\n', 'cp')
+
+        lines = command('ls', dir, '1').splitlines()
+        check(lines == [os.path.join(dir, ''), dest], 'ls')
+
+        try:
+            command('ls', missing, '0')
+            check(False, 'ls of missing path fails')
+        except IFDHError:
+            check(True, 'ls of missing path fails')
+
+        for n in range(3):
+            lines = command('ll', dir, '1').splitlines()
+            check(len(lines) == 2 and lines[-1].split()[-1] == dest and \
+                  lines[-1].split()[4] == '6', 'll (request %d)' % (n + 1))
+
+        command('rm', dest)
+        check(not os.path.exists(dest), 'rm')
+
+        try:
+            command('rm', dest)
+            check(False, 'rm of missing file fails')
+        except IFDHError:
+            check(True, 'rm of missing file fails')
+
+        command('rmdir', dir)
+        check(not os.path.exists(dir), 'rmdir')
+
+    finally:
+        larbatch_utilities.stop_ifdh_servers()
+        shutil.rmtree(top)
+
+    # Done.
+
+    if failures:
+        print('%d check(s) failed.' % len(failures))
+        return 1
+    print('All checks passed.')
+    return 0
+
+
+# Command line.
+
+if __name__ == "__main__":
+    rc = main(sys.argv)
+    sys.exit(rc)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+######################################################################
+#
+# Name: ifdh_server.py
+#
+# Purpose: This script is a long-lived helper process that performs ifdh
+#          operations using the ifdh python binding.  It is started by
+#          module larbatch_utilities, which sends it a stream of
+#          operations over a pipe.  Using a single process (and a single
+#          ifdh object) for many operations avoids the cost of starting
+#          a new "ifdh" process, with its environment setup and proxy
+#          negotiation, for every operation.
+#
+#          Environment variable $EXPERIMENT must be defined to properly
+#          initialize ifdh.
+#
+# Created: 18-Oct-2026
+#
+# Command line usage:
+#
+# ifdh_server.py [-h|--help]
+#
+# Options:
+#
+# -h, --help - Print help.
+#
+# Protocol:
+#
+# Requests are read from standard input, and replies are written to
+# standard output, one json object per line.
+#
+# Request - {"cmd": ["<op>", <arg1>, ...]}
+#
+#           The command is the same as the equivalent "ifdh" command line,
+#           without the leading "ifdh."  The following operations are
+#           supported: cp, mv, ls, ll, mkdir, rmdir, rm, chmod.
+#
+# Reply   - {"rc": <status>, "out": "<output>", "err": "<error output>"}
+#
+#           Any output written by ifdh to file descriptors 1 and 2 while
+#           processing the request is returned in the reply.  Output of
+#           operation "ls" is returned one entry per line.  As with the
+#           "ifdh ls" command line, an empty listing (the binding's
+#           result for a missing path) is returned with nonzero status.
+#
+# The server exits when standard input is closed.
+#
+# Environment variables:
+#
+# LARBATCH_IFDH_MODULE - Name of python module to use in place of the
+#                        ifdh binding (for testing with a stand-in, such
+#                        as module ifdh_local).
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+# Imports
+
+import sys, os, json, tempfile, importlib
+try:
+    import ctypes, ctypes.util
+except ImportError:
+    ctypes = None
+
+# Initialize ifdh.
+
+ifdh = importlib.import_module(os.environ.get('LARBATCH_IFDH_MODULE', 'ifdh'))
+Ifdh = ifdh.ifdh()
+
+# C library, used to flush C stdio buffers.  The ifdh binding writes
+# some results (e.g. the output of "ll") using C stdio.
+
+libc = None
+if ctypes != None:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+    except:
+        libc = None
+
+# Main procedure.
+
+def main(argv):
+
+    # Parse arguments.
+
+    args = argv[1:]
+    while len(args) > 0:
+        if args[0] == '-h' or args[0] == '--help' :
+            help()
+            return 0
+        else:
+            print('Unknown option %s' % args[0])
+            return 1
+
+    # Keep private copies of the original standard input and output for
+    # communicating with the client.  Anything else written to file
+    # descriptor 1 (e.g. by ifdh) goes to standard error.
+
+    request_stream = os.fdopen(os.dup(0), 'r')
+    reply_stream = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+
+    # Request loop.
+
+    while True:
+        line = request_stream.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            reply = process(request['cmd'])
+        except Exception as e:
+            reply = {'rc': 1, 'out': '', 'err': 'Bad request: %s\n' % str(e)}
+        reply_stream.write(json.dumps(reply) + '\n')
+        reply_stream.flush()
+
+    # Done.
+
+    return 0
+
+
+# Help function.
+
+def help():
+    filename = sys.argv[0]
+    file = open(filename, 'r')
+
+    doprint=0
+
+    for line in file.readlines():
+        if line[2:16] == 'ifdh_server.py':
+            doprint = 1
+        elif line[0:6] == '######' and doprint:
+            doprint = 0
+        if doprint:
+            if len(line) > 2:
+                print(line[2:], end=' ')
+            else:
+                print()
+
+
+# Flush python and C stdio output buffers.
+
+def flush_output():
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if libc != None:
+        try:
+            libc.fflush(None)
+        except:
+            pass
+
+
+# Process one command.  Output written to file descriptors 1 and 2 while
+# the command is running is captured in temporary files.  All buffered
+# output is flushed before the original file descriptors are restored.
+# Return value is the reply dictionary.
+
+def process(cmd):
+
+    rc = 0
+    out = ''
+    err = ''
+
+    outfile = tempfile.TemporaryFile(mode='w+')
+    errfile = tempfile.TemporaryFile(mode='w+')
+    saved_out = os.dup(1)
+    saved_err = os.dup(2)
+    flush_output()
+    os.dup2(outfile.fileno(), 1)
+    os.dup2(errfile.fileno(), 2)
+    try:
+        rc, result = call_ifdh(cmd)
+    except Exception as e:
+        rc = 1
+        result = ''
+        sys.stderr.write('%s\n' % str(e))
+    finally:
+        flush_output()
+        os.dup2(saved_out, 1)
+        os.dup2(saved_err, 2)
+        os.close(saved_out)
+        os.close(saved_err)
+
+    outfile.seek(0)
+    errfile.seek(0)
+    out = result + outfile.read()
+    err = errfile.read()
+    outfile.close()
+    errfile.close()
+
+    # Done.
+
+    return {'rc': rc, 'out': out, 'err': err}
+
+
+# Call the ifdh binding for one command.
+# Return value is a 2-tuple (status, output).
+
+def call_ifdh(cmd):
+
+    op = cmd[0]
+    args = [str(arg) for arg in cmd[1:]]
+    result = ''
+    if op == 'cp':
+        rc = Ifdh.cp(args)
+    elif op == 'mv':
+        rc = Ifdh.mv(args)
+    elif op == 'ls':
+        contents = Ifdh.ls(args[0], int(args[1]))
+        if contents:
+            rc = 0
+            for content in contents:
+                result += '%s\n' % content
+        else:
+            rc = 1
+            sys.stderr.write('No such file or directory: %s\n' % args[0])
+    elif op == 'll':
+        rc = Ifdh.ll(args[0], int(args[1]))
+    elif op == 'mkdir':
+        rc = Ifdh.mkdir(args[0])
+    elif op == 'rmdir':
+        rc = Ifdh.rmdir(args[0])
+    elif op == 'rm':
+        rc = Ifdh.rm(args[0])
+    elif op == 'chmod':
+        rc = Ifdh.chmod(args[0], args[1])
+    else:
+        raise ValueError('Unsupported operation %s' % op)
+
+    # Some binding calls return None on success.
+
+    if rc == None:
+        rc = 0
+
+    # Done.
+
+    return int(rc), result
+
+
+# Command line.
+
+if __name__ == "__main__":
+    rc = main(sys.argv)
+    sys.exit(rc)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+######################################################################
+#
+# Name: job_summary.py
+#
+# Purpose: Make a consolidated summary of the results of one batch job
+#          (json file job_summary.json).  This script is run at the end
+#          of a batch job (see condor_lar.sh), after the data files and
+#          log files have been moved into the local out and log
+#          directories, and before the log directory is tarred up.
+#
+#          The summary contains the information that project.py needs
+#          to check the job, so that checking a job requires reading a
+#          single file.  The summary contains the following keys.
+#
+#          version         - Summary format version.
+#          status          - Overall exit status (same as lar.stat).
+#          stage_status    - List of exit statuses of each stage
+#                            (larStage<n>.stat).
+#          validate_status - Exit status of validate_in_job.py (or null).
+#          start_time      - Job start time (seconds since epoch).
+#          end_time        - Job end time (seconds since epoch).
+#          sam_project     - Sam project name (sam_project.txt).
+#          cpid            - Sam consumer process id (cpid.txt).
+#          outputs         - Dictionary of output data files, with the
+#                            following information for each file.
+#                            size     - File size.
+#                            events   - Number of events (or null).
+#                            stream   - Stream name.
+#                            parents  - List of parent files.
+#                            checksum - Enstore (adler32) checksum.
+#                            metadata - Json metadata (<file>.json).
+#          lists           - Dictionary of bookkeeping list files
+#                            (*.list in log directory), each as a list
+#                            of lines.  This includes the consumed
+#                            files list, transferred uris list, and the
+#                            list files made by validate_in_job.py.
+#
+# Created: 18-Oct-2026
+#
+# Command line usage:
+#
+# job_summary.py [options]
+#
+# Options:
+#
+# -h, --help                 - Print help.
+# --outdir <dir>             - Local directory containing output data files
+#                              (default "out").
+# --logdir <dir>             - Local directory containing log files
+#                              (default "log").
+# --output <file>            - Output file (default <logdir>/job_summary.json).
+# --nstages <n>              - Number of stages (default 1).
+# --start_time <t>           - Job start time (seconds since epoch).
+# --validate_status <n>      - Exit status of validation (default none).
+# --data_file_type <type>    - Data file type (repeatable, default "root").
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+# Import stuff.
+
+import sys, os, json, time, zlib
+
+# Summary format version.
+
+summary_version = 1
+
+# Block size for calculating checksums.
+
+checksum_block_size = 16*1024*1024
+
+# Calculate enstore (adler32) checksum of a local file.
+
+def enstore_checksum(path):
+    crc = 0
+    f = open(path, 'rb')
+    while True:
+        data = f.read(checksum_block_size)
+        if len(data) == 0:
+            break
+        crc = zlib.adler32(data, crc)
+    f.close()
+    crc = int(crc)
+    if crc < 0:
+        crc = (crc & 0x7FFFFFFF) | 0x80000000
+    return {'crc_value': str(crc), 'crc_type': 'adler 32 crc type'}
+
+# Read the first line of a file.  Return default if file doesn't exist.
+
+def first_line(path, default=''):
+    if not os.path.exists(path):
+        return default
+    f = open(path)
+    lines = f.readlines()
+    f.close()
+    if len(lines) == 0:
+        return default
+    return lines[0].strip()
+
+# Read integer status from a file.  Return None if there is no status.
+
+def read_status(path):
+    try:
+        return int(first_line(path, None))
+    except:
+        return None
+
+# Make summary.
+
+def make_summary(outdir, logdir, nstages, start_time, validate_status, data_file_types):
+
+    summary = {'version': summary_version,
+               'status': read_status(os.path.join(logdir, 'lar.stat')),
+               'stage_status': [],
+               'validate_status': validate_status,
+               'start_time': start_time,
+               'end_time': int(time.time()),
+               'sam_project': first_line(os.path.join(logdir, 'sam_project.txt')),
+               'cpid': first_line(os.path.join(logdir, 'cpid.txt')),
+               'outputs': {},
+               'lists': {}}
+
+    # Stage exit statuses.
+
+    for stage in range(nstages):
+        summary['stage_status'].append(read_status(os.path.join(logdir,
+                                                                'larStage%d.stat' % stage)))
+
+    # Output data files.
+
+    if os.path.isdir(outdir):
+        for name in sorted(os.listdir(outdir)):
+            path = os.path.join(outdir, name)
+            ext = os.path.splitext(name)[1]
+            if not os.path.isfile(path) or len(ext) == 0 or ext[1:] not in data_file_types:
+                continue
+            md = {}
+            json_path = os.path.join(logdir, name + '.json')
+            if os.path.exists(json_path):
+                try:
+                    f = open(json_path)
+                    md = json.load(f)
+                    f.close()
+                except:
+                    md = {}
+            output = {'size': os.path.getsize(path),
+                      'events': None,
+                      'stream': '',
+                      'parents': [],
+                      'checksum': enstore_checksum(path),
+                      'metadata': md}
+            if 'events' in md:
+                output['events'] = int(md['events'])
+            if 'data_stream' in md:
+                output['stream'] = md['data_stream']
+            if 'parents' in md:
+                output['parents'] = md['parents']
+            summary['outputs'][name] = output
+
+    # List files.
+
+    if os.path.isdir(logdir):
+        for name in sorted(os.listdir(logdir)):
+            if name.endswith('.list'):
+                f = open(os.path.join(logdir, name))
+                summary['lists'][name] = [line.rstrip('\n') for line in f.readlines()]
+                f.close()
+
+    return summary
+
+# Help function.
+
+def help():
+    filename = sys.argv[0]
+    file = open(filename, 'r')
+
+    doprint=0
+
+    for line in file.readlines():
+        if line[2:16] == 'job_summary.py':
+            doprint = 1
+        elif line[0:6] == '######' and doprint:
+            doprint = 0
+        if doprint:
+            if len(line) > 2:
+                print(line[2:], end=' ')
+            else:
+                print()
+
+# Main procedure.
+
+def main(argv):
+
+    outdir = 'out'
+    logdir = 'log'
+    output = ''
+    nstages = 1
+    start_time = None
+    validate_status = None
+    data_file_types = []
+
+    # Parse arguments.
+
+    args = argv[1:]
+    while len(args) > 0:
+        if args[0] == '-h' or args[0] == '--help':
+            help()
+            return 0
+        elif args[0] == '--outdir' and len(args) > 1:
+            outdir = args[1]
+            del args[0:2]
+        elif args[0] == '--logdir' and len(args) > 1:
+            logdir = args[1]
+            del args[0:2]
+        elif args[0] == '--output' and len(args) > 1:
+            output = args[1]
+            del args[0:2]
+        elif args[0] == '--nstages' and len(args) > 1:
+            nstages = int(args[1])
+            del args[0:2]
+        elif args[0] == '--start_time' and len(args) > 1:
+            start_time = int(args[1])
+            del args[0:2]
+        elif args[0] == '--validate_status' and len(args) > 1:
+            validate_status = int(args[1])
+            del args[0:2]
+        elif args[0] == '--data_file_type' and len(args) > 1:
+            data_file_types.append(args[1])
+            del args[0:2]
+        else:
+            print('Unknown option %s' % args[0])
+            return 1
+
+    if len(data_file_types) == 0:
+        data_file_types = ['root']
+    if output == '':
+        output = os.path.join(logdir, 'job_summary.json')
+
+    summary = make_summary(outdir, logdir, nstages, start_time, validate_status,
+                           data_file_types)
+    f = open(output, 'w')
+    json.dump(summary, f, sort_keys=True)
+    f.close()
+    return 0
+
+# Invoke main program.
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+######################################################################
+#
+# Name: larbatch_aio.py
+#
+# Purpose: Python module containing asyncio (coroutine) versions of the
+#          posix-like interfaces in module larbatch_posix.  Calls are
+#          executed by larbatch_posix in a thread pool, so the same
+#          dCache routing rules and timeouts apply.  Concurrency is
+#          limited separately for each storage endpoint, so that many
+#          requests may be outstanding at the same time without
+#          overloading any one storage system.
+#
+#          This module requires python 3.
+#
+# Created: 18-Oct-2026
+#
+# Coroutines:
+#
+# open - Open file using larbatch_posix.open.  The returned file object
+#        is a normal (blocking) file object.
+# readlines - Read lines from a file.
+# exists - Return True if path exists.
+# isdir - Return True if path is a directory.
+# listdir - List directory contents.
+# stat - Return status information about a file.
+# copy - Copy file.
+# remove - Delete file.
+# rmtree - Delete a directory tree.
+# walk - Walk directory tree (asynchronous generator).
+#
+# Utility functions:
+#
+# endpoint - Return the storage endpoint that handles a path.
+# set_limit - Set the concurrency limit for a storage endpoint (not
+#             allowed while calls are in progress).
+#
+# Storage endpoints:
+#
+# ifdh  - dCache paths (/pnfs/...) handled using grid tools.
+# pnfs  - dCache paths handled using posix tools with timeouts.
+# posix - All other paths.
+#
+# Usage example:
+#
+# async def count_files(dirs):
+#     results = await asyncio.gather(*[larbatch_aio.listdir(d) for d in dirs])
+#     return sum([len(r) for r in results])
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import asyncio
+import functools
+import threading
+import weakref
+import concurrent.futures
+import larbatch_posix
+
+# Maximum number of concurrent calls for each storage endpoint.
+
+endpoint_limits = {'ifdh': 32, 'pnfs': 16, 'posix': 64}
+
+# Thread pool for executing calls (created on first use).
+
+executor = None
+executor_lock = threading.Lock()
+
+# Number of calls in progress (protected by executor_lock).
+
+outstanding = 0
+
+# Semaphores that enforce the above limits.
+# semaphores[event loop][endpoint] = asyncio.Semaphore
+# Entries are discarded when their event loop is garbage collected.
+
+semaphores = weakref.WeakKeyDictionary()
+
+
+# Return the storage endpoint that handles a path.
+
+def endpoint(path):
+    if path.startswith('/pnfs/'):
+        if larbatch_posix.prefer_grid or not larbatch_posix.pnfs_is_mounted:
+            return 'ifdh'
+        return 'pnfs'
+    return 'posix'
+
+
+# Set the concurrency limit for a storage endpoint.
+# Raise RuntimeError if any calls are in progress.
+
+def set_limit(endpoint, limit):
+    global executor
+    executor_lock.acquire()
+    try:
+        if outstanding > 0:
+            raise RuntimeError('Can not change limit while %d calls are in progress.' %
+                               outstanding)
+        endpoint_limits[endpoint] = limit
+        semaphores.clear()
+        if executor != None:
+            executor.shutdown(wait=False)
+            executor = None
+    finally:
+        executor_lock.release()
+
+
+# Return the thread pool, creating it if necessary.
+
+def get_executor():
+    global executor
+    executor_lock.acquire()
+    if executor == None:
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=sum(endpoint_limits.values()))
+    executor_lock.release()
+    return executor
+
+
+# Return the semaphore for a storage endpoint in the current event loop.
+
+def get_semaphore(ep):
+    loop = asyncio.get_event_loop()
+    if loop not in semaphores:
+        semaphores[loop] = {}
+    if ep not in semaphores[loop]:
+        semaphores[loop][ep] = asyncio.Semaphore(endpoint_limits[ep])
+    return semaphores[loop][ep]
+
+
+# Count calls in progress.
+
+def count_call(n):
+    global outstanding
+    executor_lock.acquire()
+    outstanding += n
+    executor_lock.release()
+
+
+# Call a blocking function in the thread pool, subject to the concurrency
+# limit of the storage endpoint that handles path.
+
+async def run(path, func, *args):
+    count_call(1)
+    try:
+        async with get_semaphore(endpoint(path)):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(get_executor(), functools.partial(func, *args))
+    finally:
+        count_call(-1)
+
+
+# Coroutine versions of larbatch_posix functions.
+
+async def open(path, mode='r', buf=-1):
+    return await run(path, larbatch_posix.open, path, mode, buf)
+
+async def readlines(path):
+    return await run(path, larbatch_posix.readlines, path)
+
+async def exists(path):
+    return await run(path, larbatch_posix.exists, path)
+
+async def isdir(path):
+    return await run(path, larbatch_posix.isdir, path)
+
+async def listdir(path):
+    return await run(path, larbatch_posix.listdir, path)
+
+async def stat(path):
+    return await run(path, larbatch_posix.stat, path)
+
+async def remove(path):
+    return await run(path, larbatch_posix.remove, path)
+
+async def rmtree(path):
+    return await run(path, larbatch_posix.rmtree, path)
+
+# Copies count against the dCache endpoint, if either path is in dCache.
+
+async def copy(src, dest):
+    path = src
+    if dest.startswith('/pnfs/'):
+        path = dest
+    return await run(path, larbatch_posix.copy, src, dest)
+
+
+# Walk directory tree.  Like larbatch_posix.walk, this is an iterator over
+# 3-tuples (dir, subdirs, files), but it is an asynchronous generator:
+#
+# async for dir, subdirs, files in larbatch_aio.walk(top):
+#     ...
+#
+# Subdirectories are listed concurrently (subject to endpoint limits).
+# Results are returned in the same order as a serial walk.  In topdown
+# mode, the caller may prune the walk by removing names from subdirs.
+
+async def walk(top, topdown=True):
+
+    # Quit if top directory doesn't exist.
+
+    if not await exists(top):
+        return
+
+    # In ifdh mode, try to fetch the top of the tree with a single listing.
+
+    if endpoint(top) == 'ifdh' and larbatch_posix.cached_listing(top) == None:
+        try:
+            await run(top, larbatch_posix.snapshot, top)
+        except Exception:
+            pass
+
+    task = asyncio.ensure_future(run(top, larbatch_posix.walk_contents, top))
+    async for result in walk_tree(top, task, topdown):
+        yield result
+
+
+# Walk the tree below top.  Argument task is a future for the contents
+# of top.  Listings of all subdirectories are started before any results
+# for this directory are returned.
+
+async def walk_tree(top, task, topdown):
+
+    dirs, files = await task
+    children = []
+    for name in dirs:
+        path = os.path.join(top, name)
+        children.append((name, asyncio.ensure_future(
+            run(path, larbatch_posix.walk_contents, path))))
+
+    if topdown:
+        yield top, dirs, files
+
+    for name, child in children:
+        if topdown and name not in dirs:
+            child.cancel()
+            continue
+        async for result in walk_tree(os.path.join(top, name), child, topdown):
+            yield result
+
+    if not topdown:
+        yield top, dirs, files
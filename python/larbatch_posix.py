@@ -47,7 +47,9 @@
 #        paths) or built-in type File (in case of regular files).
 # readlines - Open in read mode using this module and call readlines().
 # copy - Similar as shutil.copy.  Copy file.
+# copy_many - Copy many files, in parallel and with retries.
 # listdir - Similar as os.listdir.  List directory contents.
+# list_contents - Like listdir, but also return entry types.
 # exists - Similar as os.path.exists.  Return True if path exists.
 # isdir - Simmilar as os.path.isdir.  Return True if path is a directory.
 # stat - Similar as os.stat.  Return status information about a file.
@@ -55,6 +57,7 @@
 # walk - Similar as os.walk.  Walk directory tree.
 # mkdir - Similar as os.mkdir.  Make directory.
 # makedirs - Similar as os.makedirs.  Make directory and parent directories.
+# makedirs_tree - Make several directories and their missing parents at once.
 # rename - Similar as os.rename.  Rename file.
 # remove - Similar as os.remove.  Delete file.
 # rmdir - Similar as os.rmdir.  Delete empty directory.
@@ -67,6 +70,19 @@
 # Utility functions:
 #
 # use_grid - Force (or not) the use of grid tools when possible.
+# set_cache_ttl - Set the lifetime of directory listing cache entries.
+# clear_cache - Discard all cached directory listings.
+# invalidate_cache - Discard cached directory listings affected by a path.
+# invalidate_stat - Discard cached status information about a path.
+# scandir - List a directory in a worker thread, with a timeout.
+# snapshot - Fetch a whole directory tree into the cache with one listing.
+# set_write_behind - Enable (or not) background uploads of dCache files.
+# flush_all - Wait for all background uploads to finish.
+# register_backend - Register a storage backend for a path prefix.
+# unregister_backend - Remove a storage backend.
+# get_backend - Return the storage backend for a path (or None).
+# reap - Delete a path in the background.
+# drain - Wait for background deletions to finish.
 #
 # Notes on the use of grid tools.
 #
@@ -117,6 +133,129 @@
 #     b) If LARBATCH_GRID is defined, then this module will be
 #        configured to prefer grid tools.
 #
+#     c) LARBATCH_DIRCACHE_TTL may be set to the lifetime (in seconds)
+#        of directory listing cache entries (default 60).  A value of
+#        zero disables the cache.  The cache only applies to dCache
+#        paths handled by grid tools or by a storage backend (see
+#        note 4).
+#
+#     d) LARBATCH_WALK_THREADS may be set to the default number of
+#        directories that walk lists concurrently (default 8).  A value
+#        of one gives a serial walk.
+#
+#     e) If LARBATCH_IFDH_SERVER is defined, ifdh operations are sent
+#        to long-lived ifdh helper processes (ifdh_server.py) instead
+#        of starting a new "ifdh" process for each operation.  See
+#        larbatch_utilities.use_ifdh_server.
+#
+#     f) If LARBATCH_NO_STREAM is defined, dCache files opened for
+#        reading are always copied in full before being read (see
+#        note 7).
+#
+#     g) If LARBATCH_WRITE_BEHIND is defined, dCache files written
+#        using this module are uploaded in the background (see note 8).
+#
+#     h) If LARBATCH_METRICS is defined, call counts and latencies of
+#        the functions in this module are collected (see note 10).
+#
+# 4.  Directory listing cache.
+#
+#     Functions listdir, exists, isdir, and walk remember the contents
+#     of directories that they have listed, and answer repeated queries
+#     about the same directory from memory, for up to the configured
+#     lifetime.  Only directories under "/pnfs/" that are handled using
+#     grid tools (or a storage backend) are cached.  Posix paths,
+#     including nfs-mounted /pnfs in posix mode, are never cached, so
+#     posix results are always current.  Functions in this module that modify the filesystem
+#     (open for writing, copy, mkdir, makedirs, rename, remove, rmdir,
+#     rmtree, chmod, symlink) automatically discard any affected cache
+#     entries.  Modifications made by other means (e.g. by external
+#     programs) should be followed by a call to invalidate_cache (or
+#     invalidate_stat, if only the size or mode of a file has changed).
+#
+#     In ifdh mode, functions stat, isdir, and access get information
+#     about a path from an "ifdh ll" listing of its parent directory.
+#     The status information of every entry in that listing is cached,
+#     so that any number of queries about paths in the same directory
+#     cost a single listing.
+#
+# 5.  Posix directory listings.
+#
+#     Directories are listed in-process using os.scandir on a small pool
+#     of long-lived worker threads, so that no subprocess is needed.
+#     A single shared watchdog thread abandons any listing that takes
+#     longer than scandir_timeout seconds (e.g. because of a hung nfs
+#     server), replaces the stuck worker thread, and reports the failure
+#     to the caller.  The entry types returned by os.scandir are saved,
+#     so that walk doesn't need to call isdir for each entry.  If
+#     os.scandir is not available (python 2), directories are listed
+#     using "ls" in a subprocess with a timeout.
+#
+# 6.  Directory tree snapshots.
+#
+#     In ifdh mode, function snapshot fetches an entire directory tree
+#     (up to a specified depth) using a single deep "ifdh ll" listing,
+#     and stores the names, modes, and sizes of all entries in the
+#     directory listing cache.  Functions walk, isdir, exists, stat,
+#     and rmtree can then answer from memory.  Functions walk and
+#     rmtree take a snapshot automatically (up to snapshot_depth
+#     levels) when the top directory isn't already cached.
+#
+# 7.  Streaming reads.
+#
+#     In ifdh mode, dCache files that are opened read-only are not
+#     copied to the local disk.  Small files (up to stream_buffer_size
+#     bytes) are read into memory using a single xrootd transfer.  Other
+#     files are read sequentially from an xrootd pipe.  Missing files, and
+#     read errors at the start of the stream, are raised when the file is
+#     opened.  If streaming isn't possible (e.g. xrdcp is not available),
+#     the file is copied as before.
+#
+# 8.  Write-behind uploads.
+#
+#     In ifdh mode, a dCache file opened for writing is written to a
+#     local copy, which is uploaded when the file is closed.  If
+#     write-behind is enabled (function set_write_behind or environment
+#     variable LARBATCH_WRITE_BEHIND), close returns immediately and the
+#     upload is done by a pool of background threads.  Functions in this
+#     module that access a path with a pending upload (open, exists,
+#     isdir, stat, access, copy, rename, remove, rmtree) first wait for
+#     that upload to finish, and raise any upload error.  Function
+#     flush_all waits for all pending uploads, and should be called
+#     before exiting.
+#
+# 9.  Storage backends.
+#
+#     A storage backend (an object implementing the interface defined
+#     by class StorageBackend in project_modules.storagebackend) may be
+#     registered for a path prefix using function register_backend.
+#     All paths starting with a registered prefix are handled by the
+#     backend, instead of by the methods described in note 2 (the
+#     longest matching prefix wins).  The directory listing cache is
+#     used as usual.  Class DCacheSimulator (project_modules.
+#     dcachesimulator) is a backend that simulates dCache in memory,
+#     with configurable latencies and hangs, for performance testing.
+#
+# 10. Metrics.
+#
+#     If metrics are enabled (larbatch_utilities.enable_metrics or
+#     environment variable LARBATCH_METRICS), the number of calls, total
+#     time, and a latency histogram are collected for each function in
+#     this module and for each ifdh interface function in module
+#     larbatch_utilities.  Calls are labeled by path prefix.  Use
+#     larbatch_utilities.print_metrics to print a summary.
+#
+# 11. Background deletions.
+#
+#     Functions remove and rmtree (posix mode) rename the target to a
+#     random name, then hand the renamed path to a background deletion
+#     thread (function reap).  The deletion thread deletes queued paths
+#     in batches, using one "rm" command per batch, so that many
+#     deletions don't start many processes.  The queue is bounded
+#     (reaper_queue_size), so callers wait if deletions fall behind.
+#     Function drain waits for queued deletions to finish.  Paths that
+#     are still queued when the program exits are deleted by a final
+#     detached "rm" command.
 #
 ######################################################################
 
@@ -131,6 +270,11 @@ try:
 except ImportError:
     import Queue as queue
 import uuid
+import time
+import io
+import sys
+import tempfile
+import atexit
 import larbatch_utilities
 from larbatch_utilities import convert_str
 from project_modules.ifdherror import IFDHError
@@ -142,7 +286,64 @@ prefer_grid = 'LARBATCH_GRID' in os.environ
 debug = 'LARBATCH_DEBUG' in os.environ
 if debug:
     print('*** Larbatch_posix: Debugging enabled.')
-    
+dircache_ttl = float(os.environ.get('LARBATCH_DIRCACHE_TTL', '60'))
+walk_max_parallel = int(os.environ.get('LARBATCH_WALK_THREADS', '8'))
+copy_max_parallel = 8        # Default number of concurrent copies.
+copy_retries = 2             # Default number of retries for each copy.
+stream_reads = 'LARBATCH_NO_STREAM' not in os.environ
+stream_buffer_size = 1048576 # Files up to this size are read into memory.
+write_behind = 'LARBATCH_WRITE_BEHIND' in os.environ
+write_behind_threads = 4     # Number of background upload threads.
+snapshot_depth = 4           # Default depth of automatic snapshots.
+rmtree_max_parallel = 16     # Number of concurrent deletions (ifdh rmtree).
+rmtree_progress_step = 100   # Progress reporting interval (ifdh rmtree).
+snapshot_timeout = 600       # Timeout (seconds) for snapshot listing.
+
+# Directory listing cache.
+#
+# dircache[dir] = (timestamp, names, types, stats)
+#
+# timestamp - Time when directory was listed.
+# names     - List of names in directory (as returned by listdir).
+# types     - Dictionary {name: isdir}, where isdir is True or False if
+#             known, or None if not known.
+# stats     - Dictionary {name: os.stat_result}, for entries where
+#             status information is known.
+
+dircache = {}
+dircache_lock = threading.Lock()
+
+# Storage backends.
+# backends = list of 2-tuples (prefix, backend), longest prefix first.
+
+backends = []
+
+# Background uploads (write-behind mode).
+# pending_uploads[path] = larbatch_utilities.pool_task
+# upload_errors[path] = exception of a failed upload that was superseded by
+#                       a later upload of the same path (not yet reported).
+
+upload_pool = None
+pending_uploads = {}
+upload_errors = {}
+upload_lock = threading.Lock()
+
+# Scandir worker pool.
+
+scandir_nworkers = 8         # Number of worker threads.
+scandir_timeout = 60.        # Timeout (seconds) for one directory listing.
+scandir_queue = None         # Queue of pending scandir_request objects.
+scandir_inflight = {}        # scandir_inflight[request] = start time.
+scandir_lock = threading.Lock()
+
+# Background deletions.
+
+reaper_queue_size = 1000     # Maximum number of queued deletions.
+reaper_batch_size = 100      # Maximum number of paths per "rm" command.
+reaper_timeout = 600         # Time (seconds) to wait for one "rm" command.
+reaper_queue = None          # Queue of paths to delete.
+reaper_pending = 0           # Number of queued or active deletions.
+reaper_cond = threading.Condition()
 
 
 # Force grid function.
@@ -151,6 +352,570 @@ def use_grid(force=True):
     prefer_grid = force
 
 
+# Set directory listing cache lifetime (seconds).
+# A lifetime of zero (or less) disables the cache.
+
+def set_cache_ttl(ttl):
+    global dircache_ttl
+    dircache_ttl = float(ttl)
+    if dircache_ttl <= 0.:
+        clear_cache()
+
+
+# Discard all cached directory listings.
+
+def clear_cache():
+    dircache_lock.acquire()
+    dircache.clear()
+    dircache_lock.release()
+
+
+# Discard cached directory listings affected by a change to the specified path.
+# This includes the listing of the path itself and of its parent directory.
+# If recursive is True, also discard listings of all directories below path.
+
+def invalidate_cache(path, recursive=False):
+    npath = os.path.normpath(path)
+    parent = os.path.dirname(npath)
+    if parent == '':
+        parent = '.'
+    dircache_lock.acquire()
+    if npath in dircache:
+        del dircache[npath]
+    if parent in dircache:
+        del dircache[parent]
+    if recursive:
+        prefix = os.path.join(npath, '')
+        for key in list(dircache.keys()):
+            if key.startswith(prefix):
+                del dircache[key]
+    dircache_lock.release()
+
+
+# Discard cached status information about path (that is, the cached listing
+# of its parent directory), for example because the file has been modified
+# by another program.  Any cached listing of path itself is kept.
+
+def invalidate_stat(path):
+    npath = os.path.normpath(path)
+    parent = os.path.dirname(npath)
+    if parent == '':
+        parent = '.'
+    dircache_lock.acquire()
+    if parent in dircache:
+        del dircache[parent]
+    dircache_lock.release()
+
+
+# Test whether the directory listing cache applies to path.
+# Only dCache paths that are handled using grid tools or a storage backend
+# are cached.
+
+def cache_enabled(path):
+    if dircache_ttl <= 0.:
+        return False
+    if get_backend(path) != None:
+        return True
+    return path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted)
+
+
+# Return cached contents of directory as a 2-tuple (names, types), or None
+# if the directory is not cached (or the cache entry has expired).
+
+def cached_listing(path):
+    if not cache_enabled(path):
+        return None
+    npath = os.path.normpath(path)
+    dircache_lock.acquire()
+    entry = dircache.get(npath)
+    if entry != None and time.time() - entry[0] > dircache_ttl:
+        del dircache[npath]
+        entry = None
+    dircache_lock.release()
+    if entry == None:
+        return None
+    if debug:
+        print('*** Larbatch_posix: Using cached listing of %s.' % path)
+    return entry[1], entry[2]
+
+
+# Store contents of directory in cache.
+# Argument types may be None if no type information is available.
+# Argument stats may be None if no status information is available.
+
+def cache_listing(path, names, types=None, stats=None):
+    if not cache_enabled(path):
+        return
+    if types == None:
+        types = {}
+        for name in names:
+            types[name] = None
+    if stats == None:
+        stats = {}
+    npath = os.path.normpath(path)
+    dircache_lock.acquire()
+    dircache[npath] = (time.time(), list(names), types, stats)
+    dircache_lock.release()
+
+
+# Return cached status information (os.stat_result) for path, or None
+# if not known.
+
+def cached_stat(path):
+    if not cache_enabled(path):
+        return None
+    npath = os.path.normpath(path)
+    dir = os.path.dirname(npath)
+    if dir == '':
+        dir = '.'
+    dircache_lock.acquire()
+    entry = dircache.get(dir)
+    dircache_lock.release()
+    if entry == None or time.time() - entry[0] > dircache_ttl:
+        return None
+    return entry[3].get(os.path.basename(npath))
+
+
+# Return cached status information about all entries of a directory, as a
+# dictionary {name: os.stat_result}, or None if the directory is not cached
+# with complete status information.
+
+def cached_stats(dir):
+    if not cache_enabled(dir):
+        return None
+    ndir = os.path.normpath(dir)
+    dircache_lock.acquire()
+    entry = dircache.get(ndir)
+    dircache_lock.release()
+    if entry == None or time.time() - entry[0] > dircache_ttl:
+        return None
+    if len(entry[3]) < len(entry[1]):
+        return None
+    return entry[3]
+
+
+# List directory using "ifdh ll", and store the names, types, and status
+# information of all entries in the directory listing cache.
+# Return value is a dictionary {name: os.stat_result}.
+
+def ll_listing(dir):
+    ndir = os.path.normpath(dir)
+    names = []
+    types = {}
+    stats = {}
+    lines = larbatch_utilities.ifdh_ll(ndir, 1)
+    for line in lines:
+        parsed = parse_ll_line(line)
+        if parsed == None:
+            continue
+        name, sr = parsed
+        if name.startswith('/'):
+            path = local_path(name, ndir)
+            if os.path.dirname(path) != ndir:
+                continue
+            name = os.path.basename(path)
+        if name in stats:
+            continue
+        names.append(name)
+        types[name] = statmod.S_ISDIR(sr.st_mode)
+        stats[name] = sr
+    cache_listing(ndir, names, types, stats)
+    return stats
+
+
+# Parse one line of "ifdh ll" output.
+# Return value is a 2-tuple (name, os.stat_result), or None if this line
+# doesn't describe a directory entry.  The name is the last word of the
+# line, which may be a simple name or a path.
+
+def parse_ll_line(line):
+    words = line.split()
+    if len(words) <= 5:
+        return None
+    try:
+        mode = larbatch_utilities.parse_mode(words[0])
+        nlinks = int(words[1])
+        size = int(words[4])
+    except (ValueError, IndexError):
+        return None
+    result = os.stat_result((mode,         # Mode
+                             0,            # Inode
+                             0,            # Device
+                             nlinks,       # Number of links
+                             os.getuid(),  # Uid
+                             os.getgid(),  # Gid
+                             size,         # Size
+                             0,            # Access time
+                             0,            # Mod time
+                             0))           # Creation time
+    return words[-1], result
+
+
+# Fetch a directory tree into the directory listing cache using a single
+# deep listing.  Only has an effect in ifdh mode.  Directories that are
+# fewer than depth levels below top are cached with complete contents.
+#
+# The deep listing is parsed according to the following rules, so as to
+# accept either flat or "ls -lR"-style output.
+#
+# 1.  A line consisting of a single word ending in ':' sets the current
+#     directory for following lines.
+#
+# 2.  Entry names that are absolute paths are used as is (dCache server
+#     paths "/pnfs/fnal.gov/usr/..." are converted to local paths).
+#
+# 3.  Other entry names are taken relative to the current directory
+#     (initially top).
+#
+# Return value is the number of directories cached.
+
+def snapshot(top, depth=0):
+
+    if get_backend(top) != None or \
+       not (top.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted)):
+        return 0
+    if depth <= 0:
+        depth = snapshot_depth
+    if debug:
+        print('*** Larbatch_posix: Snapshot directory tree %s using ifdh.' % top)
+
+    ntop = os.path.normpath(top)
+    tree = {ntop: ([], {}, {})}      # tree[dir] = (names, types, stats)
+    current = ntop
+    lines = larbatch_utilities.ifdh_ll(ntop, depth, timeout=snapshot_timeout)
+    for line in lines:
+        words = line.split()
+        if len(words) == 1 and words[0].endswith(':'):
+            current = local_path(words[0][:-1], ntop)
+            path = current
+            sr = None
+        else:
+            parsed = parse_ll_line(line)
+            if parsed == None:
+                continue
+            name, sr = parsed
+            if name.startswith('/'):
+                path = local_path(name, ntop)
+            else:
+                path = os.path.normpath(os.path.join(current, name))
+        if path == ntop or not path.startswith(os.path.join(ntop, '')):
+            continue
+
+        # Add this entry to its parent directory (and all missing ancestors).
+
+        while path != ntop:
+            dir = os.path.dirname(path)
+            base = os.path.basename(path)
+            if dir not in tree:
+                tree[dir] = ([], {}, {})
+            names, types, stats = tree[dir]
+            if base not in types:
+                names.append(base)
+            if sr != None:
+                types[base] = statmod.S_ISDIR(sr.st_mode)
+                stats[base] = sr
+            else:
+                types[base] = True
+            if types[base] and path not in tree:
+                tree[path] = ([], {}, {})
+            parent = os.path.dirname(dir)
+            if dir == ntop or (parent in tree and
+                               os.path.basename(dir) in tree[parent][1]):
+                break
+            path = dir
+            sr = None
+
+    # Store directories with complete contents.
+
+    ncached = 0
+    for dir in tree:
+        level = len(os.path.relpath(dir, ntop).split('/'))
+        if dir == ntop:
+            level = 0
+        if level < depth:
+            names, types, stats = tree[dir]
+            cache_listing(dir, names, types, stats)
+            ncached += 1
+
+    # Done.
+
+    return ncached
+
+
+# Convert a path returned by ifdh to a local normalized path.
+# Relative paths are taken relative to top.
+
+def local_path(path, top):
+    if path.startswith('/pnfs/fnal.gov/usr/'):
+        path = '/pnfs/' + path[19:]
+    return os.path.normpath(os.path.join(top, path))
+
+
+# Answer whether path exists and/or is a directory using only cached
+# listings.  Return value is a 2-tuple (exists, isdir), where either
+# element may be None if the answer isn't known.
+
+def cached_status(path):
+    npath = os.path.normpath(path)
+    if cached_listing(npath) != None:
+        return True, True
+    dir = os.path.dirname(npath)
+    if dir == '':
+        dir = '.'
+    listing = cached_listing(dir)
+    if listing == None:
+        return None, None
+    names, types = listing
+    name = os.path.basename(npath)
+    if name not in types:
+        return False, False
+    return True, types[name]
+
+
+# Register a storage backend for paths starting with prefix.
+# Any backend previously registered for the same prefix is replaced.
+
+def register_backend(prefix, backend):
+    unregister_backend(prefix)
+    backends.append((prefix, backend))
+    backends.sort(key=lambda entry: len(entry[0]), reverse=True)
+    clear_cache()
+
+
+# Remove the storage backend registered for prefix (if any).
+
+def unregister_backend(prefix):
+    for entry in list(backends):
+        if entry[0] == prefix:
+            backends.remove(entry)
+    clear_cache()
+
+
+# Return the storage backend that handles path, or None.
+
+def get_backend(path):
+    if len(backends) == 0:
+        return None
+    for prefix, backend in backends:
+        if path.startswith(prefix):
+            return backend
+    return None
+
+
+# Enable or disable write-behind mode.
+# When disabling, wait for any pending uploads.
+
+def set_write_behind(flag=True):
+    global write_behind
+    write_behind = flag
+    if not flag:
+        flush_all()
+
+
+# Upload local copy of a file to dCache, and delete the local copy.
+# This function is executed by the upload pool in write-behind mode.
+
+def upload_file(local_path, path):
+    try:
+        larbatch_utilities.ifdh_cp(local_path, path)
+    finally:
+        os.remove(local_path)
+        invalidate_cache(path)
+
+
+# Start a background upload.
+
+def start_upload(local_path, path):
+    global upload_pool
+    npath = os.path.normpath(path)
+    upload_lock.acquire()
+    if upload_pool == None:
+        upload_pool = larbatch_utilities.thread_pool(write_behind_threads)
+    previous = pending_uploads.get(npath)
+    upload_lock.release()
+
+    # Uploads of the same path are done in order.
+    # If the previous upload failed, the new upload is still done, and the
+    # error is reported later (by wait_pending or flush_all).
+
+    if previous != None:
+        try:
+            previous.wait()
+        except Exception as e:
+            upload_lock.acquire()
+            if not npath in upload_errors:
+                upload_errors[npath] = e
+            upload_lock.release()
+    if debug:
+        print('*** Larbatch_posix: Starting background upload of %s.' % path)
+    try:
+        task = upload_pool.submit(upload_file, (local_path, path))
+    except:
+        os.remove(local_path)
+        raise
+    upload_lock.acquire()
+    pending_uploads[npath] = task
+    upload_lock.release()
+
+
+# Wait for any pending upload of path (or, if recursive, of any path
+# below path) to finish.  Raise any exception raised by the upload.
+
+def wait_pending(path, recursive=False):
+    if len(pending_uploads) == 0 and len(upload_errors) == 0:
+        return
+    npath = os.path.normpath(path)
+    prefix = os.path.join(npath, '')
+    upload_lock.acquire()
+    tasks = []
+    for key in list(pending_uploads.keys()):
+        if key == npath or (recursive and key.startswith(prefix)):
+            tasks.append(pending_uploads[key])
+            del pending_uploads[key]
+    errors = []
+    for key in list(upload_errors.keys()):
+        if key == npath or (recursive and key.startswith(prefix)):
+            errors.append(upload_errors.pop(key))
+    upload_lock.release()
+    for task in tasks:
+        task.wait()
+    if len(errors) > 0:
+        raise errors[0]
+
+
+# Wait for all pending uploads to finish.
+# Then stop idle ifdh helper processes (they are restarted if needed).
+# If any uploads failed, print the errors, and raise the first error.
+
+def flush_all():
+    upload_lock.acquire()
+    tasks = list(pending_uploads.items())
+    pending_uploads.clear()
+    errors = list(upload_errors.items())
+    upload_errors.clear()
+    upload_lock.release()
+    first_error = None
+    for path, error in errors:
+        print('*** Larbatch_posix: Upload of %s failed.' % path)
+        print(str(error))
+        if first_error == None:
+            first_error = error
+    for path, task in tasks:
+        task.done.wait()
+        if task.error != None:
+            print('*** Larbatch_posix: Upload of %s failed.' % path)
+            print(str(task.error))
+            if first_error == None:
+                first_error = task.error
+    larbatch_utilities.stop_ifdh_servers()
+    if first_error != None:
+        raise first_error
+
+
+# At exit, make sure all uploads have finished (errors have been printed).
+
+def flush_at_exit():
+    try:
+        flush_all()
+    except:
+        pass
+
+atexit.register(flush_at_exit)
+
+
+# Delete a path (file or directory tree) in the background.
+# This function returns as soon as the path is queued, but waits if the
+# queue is full.  Errors are ignored.
+
+def reap(path):
+    global reaper_queue
+    global reaper_pending
+    reaper_cond.acquire()
+    if reaper_queue == None:
+        reaper_queue = queue.Queue(reaper_queue_size)
+        start_thread(reaper_worker)
+    reaper_pending += 1
+    reaper_cond.release()
+    reaper_queue.put(path)
+
+
+# Background deletion thread.
+# Delete queued paths in batches of up to reaper_batch_size paths.
+# An "rm" command that doesn't finish within reaper_timeout seconds
+# (e.g. because of a hung nfs server) is abandoned.
+
+def reaper_worker():
+    global reaper_pending
+    while True:
+        batch = [reaper_queue.get()]
+        while len(batch) < reaper_batch_size:
+            try:
+                batch.append(reaper_queue.get_nowait())
+            except queue.Empty:
+                break
+        if debug:
+            print('*** Larbatch_posix: Deleting %d paths in the background.' % len(batch))
+        try:
+            devnull = io.open(os.devnull, 'w')
+            proc = subprocess.Popen(['rm', '-rf', '--'] + batch, stdout=devnull, stderr=devnull)
+            devnull.close()
+            deadline = time.time() + reaper_timeout
+            while proc.poll() == None and time.time() < deadline:
+                time.sleep(0.1)
+        except OSError:
+            pass
+        reaper_cond.acquire()
+        reaper_pending -= len(batch)
+        reaper_cond.notify_all()
+        reaper_cond.release()
+
+
+# Wait for background deletions to finish.
+# Wait for at most timeout seconds (forever, if timeout is None).
+# Return value is True if all deletions have finished.
+
+def drain(timeout=None):
+    if timeout != None:
+        deadline = time.time() + timeout
+    reaper_cond.acquire()
+    while reaper_pending > 0:
+        if timeout == None:
+            reaper_cond.wait()
+        else:
+            remaining = deadline - time.time()
+            if remaining <= 0.:
+                break
+            reaper_cond.wait(remaining)
+    result = (reaper_pending == 0)
+    reaper_cond.release()
+    return result
+
+
+# At exit, hand any paths that haven't been deleted yet to a detached
+# "rm" command.
+
+def reap_at_exit():
+    if reaper_queue == None:
+        return
+    paths = []
+    while True:
+        try:
+            paths.append(reaper_queue.get_nowait())
+        except queue.Empty:
+            break
+    while len(paths) > 0:
+        batch = paths[:reaper_batch_size]
+        del paths[:reaper_batch_size]
+        try:
+            devnull = io.open(os.devnull, 'w')
+            subprocess.Popen(['rm', '-rf', '--'] + batch, stdout=devnull, stderr=devnull)
+            devnull.close()
+        except OSError:
+            pass
+
+atexit.register(reap_at_exit)
+
+
 # File-like class for dCache files.
 
 class dcache_file:
@@ -162,6 +927,9 @@ class dcache_file:
         self.mode = ''            # File mode.
         self.local_path = ''      # Path of local copy of file.
         self.local_file = None    # Open File object of local copy of file.
+        self.stream = None        # Streaming subprocess (stream mode).
+        self.stream_err = None    # Standard error of streaming subprocess.
+        self.eof = False          # Has end of stream been read (stream mode)?
 
     # Initializing constructor.
 
@@ -169,10 +937,26 @@ class dcache_file:
 
         self.path = path
         self.mode = mode
+        self.local_path = path
+        self.local_file = None
+        self.stream = None
+        self.stream_err = None
+        self.eof = False
+
+        # Read-only dCache files are streamed, rather than copied, if possible.
+
+        if path.startswith('/pnfs/') and stream_reads and mode.find('r') >= 0 and \
+           mode.find('+') < 0:
+            sr = stat(path)     # Raise error here if file doesn't exist.
+            try:
+                self.open_stream(sr, buf)
+                return
+            except (OSError, IFDHError):
+                if debug:
+                    print('*** Larbatch_posix: Streaming %s failed, using local copy.' % path)
+
         if path.startswith('/pnfs/'):
             self.local_path = str(uuid.uuid4()) + os.path.basename(path)
-        else:
-            self.local_path = path
 
         # Fetch copy of file from dCache, if necessary.
 
@@ -183,10 +967,62 @@ class dcache_file:
 
         self.local_file = __builtins__['open'](self.local_path, mode, buf)
 
+    # Open file for streaming reads (no local copy).
+    # Argument sr is the stat result of the file.
+    # Small files (stream_buffer_size) are read into memory all at once.
+    # Other files are read sequentially from a pipe.  The first block is
+    # read before returning, so that read errors are raised here.
+    # Raise OSError or IFDHError if streaming isn't possible.
+
+    def open_stream(self, sr, buf):
+
+        if sr.st_size <= stream_buffer_size:
+
+            # Read entire file into memory.
+
+            if debug:
+                print('*** Larbatch_posix: Reading %s into memory.' % self.path)
+            data = larbatch_utilities.xrootd_read(self.path)
+            if self.mode.find('b') >= 0:
+                self.local_file = io.BytesIO(data)
+            else:
+                self.local_file = io.StringIO(convert_str(data))
+
+        else:
+
+            # Read from pipe.
+
+            if debug:
+                print('*** Larbatch_posix: Streaming %s.' % self.path)
+            self.stream_err = tempfile.TemporaryFile()
+            self.stream = larbatch_utilities.xrootd_stream(self.path, self.stream_err)
+
+            # Wait for the first block.  If the stream ended without any data,
+            # check the exit status of the subprocess.
+
+            if hasattr(self.stream.stdout, 'peek') and len(self.stream.stdout.peek(1)) == 0:
+                rc = self.stream.wait()
+                if rc != 0:
+                    self.stream.stdout.close()
+                    self.stream = None
+                    self.stream_err.seek(0)
+                    err = convert_str(self.stream_err.read())
+                    self.stream_err.close()
+                    raise IFDHError(['xrdcp', self.path], rc, '', err)
+            if self.mode.find('b') >= 0 or sys.version_info[0] < 3:
+                self.local_file = self.stream.stdout
+            else:
+                self.local_file = io.TextIOWrapper(self.stream.stdout)
+
     # Destructor.
+    # Errors can't be raised from here, so files should be closed explicitly.
 
     def __del__(self):
-        self.close()
+        try:
+            self.close()
+        except Exception as e:
+            print('*** Larbatch_posix: Error closing %s.' % self.path)
+            print(str(e))
 
     # Close file.
 
@@ -194,18 +1030,53 @@ class dcache_file:
 
         if self.local_file and not self.local_file.closed:
 
+            # In stream mode, see whether the subprocess has already finished.
+
+            finished = None
+            if self.stream != None:
+                finished = self.stream.poll()
+
             # Close local copy of file.
 
             self.local_file.close()
 
+            # In stream mode, make sure the subprocess is finished, and check
+            # its exit status.  If the whole stream was read, wait for the
+            # subprocess and check its real exit status.  If the file is
+            # closed before the end of the stream, stop the subprocess (its
+            # exit status is only an error if it failed on its own).
+
+            if self.stream != None:
+                stream = self.stream
+                self.stream = None
+                if self.eof:
+                    rc = stream.wait()
+                elif finished != None:
+                    rc = finished
+                else:
+                    stream.terminate()
+                    stream.wait()
+                    rc = 0
+                self.stream_err.seek(0)
+                err = convert_str(self.stream_err.read())
+                self.stream_err.close()
+                if rc != 0:
+                    raise IFDHError(['xrdcp', self.path], rc, '', err)
+
             # If the local path and real path are different, do some cleanups.
 
             if self.path != self.local_path:
 
                 # If file was opend for writing, transfer local copy to dCache.
+                # In write-behind mode, the transfer is done in the background,
+                # and the local copy is deleted after the transfer.
 
                 if self.mode.find('w') >= 0 or self.mode.find('a') >= 0 or self.mode.find('+') >= 0:
+                    if write_behind:
+                        start_upload(self.local_path, self.path)
+                        return
                     larbatch_utilities.ifdh_cp(self.local_path, self.path)
+                    invalidate_cache(self.path)
 
                 # Delete the local copy regardless of whether the file was open for
                 # reading or writing.
@@ -225,22 +1096,34 @@ class dcache_file:
     # Iterator.
 
     def __next__(self):
-        return next(self.local_file)
+        try:
+            return next(self.local_file)
+        except StopIteration:
+            self.eof = True
+            raise
 
     # Read the specified number of bytes.
 
     def read(self, size=-1):
-        return self.local_file.read(size)
+        data = self.local_file.read(size)
+        if size == None or size < 0 or len(data) < size:
+            self.eof = True
+        return data
 
     # Read one line, up to specified number of bytes.
 
     def readline(self, size=-1):
-        return self.local_file.readline(size)
+        line = self.local_file.readline(size)
+        if len(line) == 0:
+            self.eof = True
+        return line
 
     # Read multiple lines.
 
     def readlines(self, sizehint=-1):
-        return self.local_file.readlines()
+        lines = self.local_file.readlines()
+        self.eof = True
+        return lines
 
     # Return file position.
 
@@ -267,12 +1150,118 @@ class dcache_file:
     def writelines(self, strs):
         self.local_file.writelines(strs)
 
+# Class representing one request to the scandir worker pool.
+
+class scandir_request:
+
+    def __init__(self, path):
+        self.path = path                  # Directory to list.
+        self.result = None                # List of 2-tuples (name, isdir).
+        self.error = None                 # Exception, if listing failed.
+        self.abandoned = False            # Set by watchdog.
+        self.done = threading.Event()     # Set when result or error is available.
+
+
+# Scandir worker thread function.
+
+def scandir_worker():
+    while True:
+        request = scandir_queue.get()
+        scandir_lock.acquire()
+        scandir_inflight[request] = time.time()
+        scandir_lock.release()
+        result = []
+        error = None
+        try:
+            for entry in os.scandir(request.path):
+                result.append((entry.name, entry.is_dir()))
+        except Exception as e:
+            error = e
+        scandir_lock.acquire()
+        if request in scandir_inflight:
+            del scandir_inflight[request]
+        abandoned = request.abandoned
+        scandir_lock.release()
+
+        # If this request was abandoned by the watchdog, a replacement thread
+        # has already been started, so quit.
+
+        if abandoned:
+            return
+        request.result = result
+        request.error = error
+        request.done.set()
+
+
+# Scandir watchdog thread function.
+
+def scandir_watchdog():
+    while True:
+        time.sleep(1.)
+        now = time.time()
+        stuck = []
+        scandir_lock.acquire()
+        for request in list(scandir_inflight.keys()):
+            if now - scandir_inflight[request] > scandir_timeout:
+                request.abandoned = True
+                del scandir_inflight[request]
+                stuck.append(request)
+        scandir_lock.release()
+        for request in stuck:
+            print('*** Larbatch_posix: Abandoning hung listing of directory %s.' % request.path)
+            request.error = OSError('Timed out listing directory %s.' % request.path)
+            request.done.set()
+            start_thread(scandir_worker)
+
+
+# Start a daemon thread.
+
+def start_thread(target, args=[]):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+# List directory using the scandir worker pool.
+# Return value is a list of 2-tuples (name, isdir).
+# Raise OSError if the directory could not be listed.
+
+def scandir(path):
+    global scandir_queue
+
+    # Start worker pool and watchdog, if not already done.
+
+    scandir_lock.acquire()
+    if scandir_queue == None:
+        scandir_queue = queue.Queue()
+        for n in range(scandir_nworkers):
+            start_thread(scandir_worker)
+        start_thread(scandir_watchdog)
+    scandir_lock.release()
+
+    # Submit request and wait for result.
+
+    request = scandir_request(path)
+    scandir_queue.put(request)
+    request.done.wait()
+    if request.error != None:
+        raise request.error
+    return request.result
+
+
 # Global functions.
 
 
 # Open file
 
 def open(path, mode='r', buf=-1):
+    wait_pending(path)
+    if mode.find('w') >= 0 or mode.find('a') >= 0 or mode.find('+') >= 0:
+        invalidate_cache(path)
+    backend = get_backend(path)
+    if backend != None:
+        return backend.open(path, mode, buf)
     if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Opening dcache_file %s using mode %s.' % (path, mode))
@@ -286,15 +1275,33 @@ def open(path, mode='r', buf=-1):
 # Read lines from a file.
 
 def readlines(path):
-    return open(path).readlines()
+    f = open(path)
+    lines = f.readlines()
+    f.close()
+    return lines
 
 
 # Copy file.
 
 def copy(src, dest):
+    wait_pending(src)
+    wait_pending(dest)
     if exists(dest):
         remove(dest)
-    if (src.startswith('/pnfs/') or dest.startswith('/pnfs/')):
+    src_backend = get_backend(src)
+    dest_backend = get_backend(dest)
+    if src_backend != None and src_backend is dest_backend:
+        src_backend.copy(src, dest)
+    elif src_backend != None or dest_backend != None:
+
+        # Copy between different backends.
+
+        fin = open(src, 'rb')
+        fout = open(dest, 'wb')
+        shutil.copyfileobj(fin, fout)
+        fin.close()
+        fout.close()
+    elif (src.startswith('/pnfs/') or dest.startswith('/pnfs/')):
         if prefer_grid or not pnfs_is_mounted:
             if debug:
                 print('*** Larbatch_posix: Copy %s to %s using ifdh.' % (src, dest))
@@ -307,19 +1314,144 @@ def copy(src, dest):
         if debug:
             print('*** Larbatch_posix: Copy %s to %s using posix.' % (src, dest))
         shutil.copy(src, dest)
+    invalidate_cache(dest)
 
     # Done
 
     return
 
 
+# Copy many files.
+# Argument pairs is a list of 2-tuples (source, destination).
+#
+# If there are several dCache transfers that should be done using ifdh,
+# these are done first as a batch using a single "ifdh cp -f" command.
+# Remaining files (and files of a failed batch whose destination doesn't
+# exist) are copied individually by up to max_parallel threads (default copy_max_parallel),
+# each being retried up to retries times.
+#
+# Return value is a list of 3-tuples (source, destination, error), in the
+# same order as pairs, where error is None if the copy succeeded, or the
+# exception raised by the last attempt.
+
+def copy_many(pairs, max_parallel=0, retries=-1):
+
+    pairs = list(pairs)
+    if max_parallel <= 0:
+        max_parallel = copy_max_parallel
+    if retries < 0:
+        retries = copy_retries
+    errors = [None] * len(pairs)
+    pending = list(range(len(pairs)))
+
+    # Batch ifdh transfers.
+
+    batch = []
+    for n in pending:
+        src, dest = pairs[n]
+        if (src.startswith('/pnfs/') or dest.startswith('/pnfs/')) and \
+           (prefer_grid or not pnfs_is_mounted) and \
+           get_backend(src) == None and get_backend(dest) == None:
+            batch.append(n)
+    if len(batch) > 1:
+        if debug:
+            print('*** Larbatch_posix: Copy %d files using ifdh.' % len(batch))
+        larbatch_utilities.parallel_call(remove_if_exists,
+                                         [(pairs[n][1],) for n in batch],
+                                         max_parallel)
+        copied = None
+        try:
+            larbatch_utilities.ifdh_cp_many([pairs[n] for n in batch])
+            copied = set(batch)
+        except IFDHError:
+            pass
+        for n in batch:
+            invalidate_cache(pairs[n][1])
+
+        # The batch may have failed partway.  Only retry files whose
+        # destination doesn't exist.
+
+        if copied == None:
+            if debug:
+                print('*** Larbatch_posix: Batch copy failed, copying missing files one at a time.')
+            results = larbatch_utilities.parallel_call(exists,
+                                                       [(pairs[n][1],) for n in batch],
+                                                       max_parallel)
+            copied = set([n for n, result in zip(batch, results) if result[0]])
+        pending = [n for n in pending if n not in copied]
+
+    # Copy remaining files individually.
+
+    if len(pending) > 0:
+        results = larbatch_utilities.parallel_call(
+            copy_with_retry,
+            [(pairs[n][0], pairs[n][1], retries) for n in pending],
+            max_parallel)
+        for n, result in zip(pending, results):
+            errors[n] = result[1]
+
+    # Done.
+
+    return [(pairs[n][0], pairs[n][1], errors[n]) for n in range(len(pairs))]
+
+
+# Copy one file, retrying up to retries times.
+# Reraise the last exception if all attempts fail.
+
+def copy_with_retry(src, dest, retries):
+    ntry = 0
+    while True:
+        try:
+            copy(src, dest)
+            return
+        except Exception:
+            ntry += 1
+            if ntry > retries:
+                raise
+            if debug:
+                print('*** Larbatch_posix: Retrying copy of %s to %s.' % (src, dest))
+
+
+# Delete file if it exists.
+
+def remove_if_exists(path):
+    if exists(path):
+        remove(path)
+
+
 # List directory contents.
 
 def listdir(path):
+    return list(list_contents(path)[0])
+
+
+# List directory contents, including type information.
+# Return value is a 2-tuple (names, types), where names is a list of names
+# in the directory, and types is a dictionary {name: isdir}, where isdir
+# is True or False if known, or None if not known.
+
+def list_contents(path):
+
+    # Check cache.
+
+    listing = cached_listing(path)
+    if listing != None:
+        return listing
+
+    backend = get_backend(path)
+    if backend != None:
+        result = []
+        types = {}
+        for name, entry_isdir in sorted(backend.listdir(path)):
+            result.append(name)
+            types[name] = entry_isdir
+        cache_listing(path, result, types)
+        return result, types
 
     if not isdir(path):
         raise OSError('%s is not a directory.' % path)
     result = []
+    types = {}
     if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Listdir %s using ifdh.' % path)
@@ -340,7 +1472,34 @@ def listdir(path):
         for c in contents:
             nc = os.path.normpath(c.strip())
             if not nc.endswith(tail):
-                result.append(os.path.basename(nc))
+                name = os.path.basename(nc)
+                result.append(name)
+
+                # Ifdh flags directories by appending '/'.
+
+                if c.strip().endswith('/'):
+                    types[name] = True
+                else:
+                    types[name] = None
+        cache_listing(path, result, types)
+
+    elif hasattr(os, 'scandir'):
+        if debug:
+            print('*** Larbatch_posix: Listdir %s using scandir.' % path)
+
+        # To reduce hang risk, read contents of directory in a worker thread
+        # with a timeout.
+        # For compatibility with "ls", skip hidden files.
+
+        try:
+            for name, isdir_flag in sorted(scandir(path)):
+                if not name.startswith('.'):
+                    result.append(name)
+                    types[name] = isdir_flag
+            cache_listing(path, result, types)
+        except OSError:
+            result = []
+            types = {}
 
     else:
         if debug:
@@ -368,18 +1527,34 @@ def listdir(path):
         if rc == 0:
             for word in jobout.split():
                 result.append(word)
+                types[word] = None
+            cache_listing(path, result, types)
 
     # Done.
 
-    return result
+    return result, types
 
 
 # Test existence.  Works for files and directories.
 
 def exists(path):
+    wait_pending(path)
+
+    # Check cache.
+
+    cached_exists, cached_isdir = cached_status(path)
+    if cached_exists != None:
+        return cached_exists
 
     result = False
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    backend = get_backend(path)
+    if backend != None:
+        try:
+            backend.stat(path)
+            result = True
+        except OSError:
+            result = False
+    elif path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Check existence of %s using ifdh.' % path)
 
@@ -418,6 +1593,7 @@ def exists(path):
 # Test existence if directory.
 
 def isdir(path):
+    wait_pending(path)
 
     result = False
 
@@ -434,27 +1610,40 @@ def isdir(path):
             path[-5:] == '.stat':
         return False
 
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
-        if debug:
-            print('*** Larbatch_posix: Check existence of directory %s using ifdh.' % path)
-
-        # Make sure path exists before trying to determine if it is a directory.
+    # Check cache.
 
-        if exists(path):
+    cached_exists, cached_isdir = cached_status(path)
+    if cached_exists == False or cached_isdir != None:
+        return cached_isdir
 
-            # The only reliable way to get information about a directory is 
-            # to get a listing of the parent directory.
+    backend = get_backend(path)
+    if backend != None:
+        try:
+            result = statmod.S_ISDIR(backend.stat(path).st_mode)
+        except OSError:
+            result = False
+    elif path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+        if debug:
+            print('*** Larbatch_posix: Check existence of directory %s using ifdh.' % path)
 
-            npath = os.path.normpath(path)      # Strip trailing '/'
-            name = os.path.basename(npath)
-            dir = os.path.dirname(npath)
-            lines = larbatch_utilities.ifdh_ll(dir, 1)
-            for line in lines:
-                words = line.split()
-                if len(words) > 5 and words[-1] == name:
-                    if words[0][0] == 'd':
-                        result = True
+        # The only reliable way to get information about a directory is 
+        # to get a listing of the parent directory.
+        # If the parent directory can't be listed, path doesn't exist.
 
+        npath = os.path.normpath(path)      # Strip trailing '/'
+        name = os.path.basename(npath)
+        dir = os.path.dirname(npath)
+        sr = cached_stat(npath)
+        if sr == None:
+            stats = cached_stats(dir)
+            if stats == None:
+                try:
+                    stats = ll_listing(dir)
+                except:
+                    stats = {}
+            sr = stats.get(name)
+        if sr != None and statmod.S_ISDIR(sr.st_mode):
+            result = True
 
     else:
         if debug:
@@ -480,43 +1669,31 @@ def isdir(path):
 # size  - Object size.
 
 def stat(path):
+    wait_pending(path)
 
     result = None
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    backend = get_backend(path)
+    if backend != None:
+        result = backend.stat(path)
+    elif path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Stat %s using ifdh.' % path)
 
         # The only reliable way to get information about a directory is 
         # to get a listing of the parent directory.
 
+        # Use a cached listing (e.g. from a snapshot), if available.
+        # Otherwise, list and cache the whole parent directory.
+
         npath = os.path.normpath(path)      # Strip trailing '/'
         name = os.path.basename(npath)
         dir = os.path.dirname(npath)
-        lines = larbatch_utilities.ifdh_ll(dir, 1)
-        for line in lines:
-            words = line.split()
-            if len(words) >5 and words[-1] == name:
-
-                # Found thie path.  Fill result.
-
-                # Interpret mode string.
-
-                mode = larbatch_utilities.parse_mode(words[0])
-
-                # Get remaining fields.
-                    
-                nlinks = int(words[1])
-                size = int(words[4])
-                result = os.stat_result((mode,         # Mode
-                                         0,            # Inode
-                                         0,            # Device
-                                         nlinks,       # Number of links
-                                         os.getuid(),  # Uid
-                                         os.getgid(),  # Gid
-                                         size,         # Size
-                                         0,            # Access time
-                                         0,            # Mod time
-                                         0))           # Creation time
+        result = cached_stat(npath)
+        if result == None:
+            stats = cached_stats(dir)
+            if stats == None:
+                stats = ll_listing(dir)
+            result = stats.get(name)
 
     else:
         if debug:
@@ -534,11 +1711,14 @@ def stat(path):
 # Test file access.
 # This implementation only tests access to dCache files via the
 # user permission, which is a limitation of grid tools.
+# In ifdh mode, status information comes from the (cached) parent
+# directory listing (see stat).
 
 def access(path, mode):
 
     result = False
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    if get_backend(path) != None or \
+       (path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted)):
         if debug:
             print('*** Larbatch_posix: Check access for %s using ifdh.' % path)
         sr = stat(path)
@@ -581,57 +1761,198 @@ def access(path, mode):
 # In case of posix mode, this function includes its own implementation
 # of the walking algorithm so that we can take advantage of optimzations
 # contained in this module's implementation of isdir.
+#
+# Directories are listed concurrently using up to max_parallel threads
+# (default walk_max_parallel).  Sibling directories are listed at the same
+# time, in both posix and ifdh mode.
+#
+# If ordered is True (the default), results are returned in the same order
+# as a serial walk.  If ordered is False, results are returned as soon as
+# they are available.  Unordered mode is only supported for topdown walks.
+#
+# As with os.walk, in topdown mode the caller may prune the walk by removing
+# names from the list of directories.
 
-def walk(top, topdown=True):
+def walk(top, topdown=True, max_parallel=0, ordered=True):
 
     # Quit if top directory doesn't exist.
 
     if not exists(top):
         return
 
-    # Get contents of top directory using either ifdh or posix.
+    if max_parallel <= 0:
+        max_parallel = walk_max_parallel
+
+    # In ifdh mode, try to fetch the top of the tree with a single listing.
+    # If the snapshot fails, fall back on listing one directory at a time.
+
+    if top.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted) and \
+       cached_listing(top) == None:
+        try:
+            snapshot(top)
+        except:
+            pass
+
+    # Serial walk.
+
+    if max_parallel <= 1:
+        for result in walk_serial(top, topdown):
+            yield result
+        return
+
+    # Parallel walk.
+
+    pool = larbatch_utilities.thread_pool(max_parallel)
+    try:
+        if ordered or not topdown:
+            task = pool.submit(walk_contents, (top,))
+            for result in walk_ordered(pool, top, task, topdown):
+                yield result
+        else:
+            for result in walk_unordered(pool, top):
+                yield result
+    finally:
+        pool.shutdown(cancel=True)
+
+    # Done.
+
+    return
+
+
+# Serial walk.
+
+def walk_serial(top, topdown):
+
+    dirs, files = walk_contents(top)
+
+    if topdown:
+        yield top, dirs, files
+
+    # Recursively descend into subdirectories.
+
+    for dir in dirs:
+        for result in walk_serial(os.path.join(top, dir), topdown):
+            yield result
+
+    if not topdown:
+        yield top, dirs, files
+
+
+# Ordered parallel walk.
+# Argument task is a pool task that returns the contents of directory top.
+# The contents of all subdirectories of top are requested before descending
+# into any of them.  In topdown mode, subdirectories are requested after
+# top has been yielded, so that the caller may prune dirs.
+
+def walk_ordered(pool, top, task, topdown):
+
+    dirs, files = task.wait()
+
+    if topdown:
+        yield top, dirs, files
+
+    # Prefetch contents of subdirectories.
+
+    subtasks = {}
+    for dir in dirs:
+        subtasks[dir] = pool.submit(walk_contents, (os.path.join(top, dir),))
+
+    # Descend into subdirectories.
+
+    for dir in dirs:
+        path = os.path.join(top, dir)
+        if dir in subtasks:
+            subtask = subtasks[dir]
+        else:
+            subtask = pool.submit(walk_contents, (path,))
+        for result in walk_ordered(pool, path, subtask, topdown):
+            yield result
+
+    if not topdown:
+        yield top, dirs, files
+
+
+# Unordered parallel walk (topdown only).
+
+def walk_unordered(pool, top):
+
+    done = queue.Queue()
+    paths = {}
+    task = pool.submit(walk_contents, (top,), done)
+    paths[task] = top
+    while len(paths) > 0:
+        task = done.get()
+        path = paths.pop(task)
+        dirs, files = task.wait()
+        yield path, dirs, files
+
+        # Request subdirectories (after yielding, so that the caller may prune).
+
+        for dir in dirs:
+            subpath = os.path.join(path, dir)
+            subtask = pool.submit(walk_contents, (subpath,), done)
+            paths[subtask] = subpath
+
+
+# Get contents of one directory for walk using either ifdh or posix.
+# Return value is a 2-tuple (dirs, files).
+
+def walk_contents(top):
 
     dirs = []
     files = []
-    if top.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    listing = cached_listing(top)
+    if listing != None and None not in list(listing[1].values()):
+
+        # Use cached contents, if type information is complete.
+
+        names, types = listing
+        for name in names:
+            if types[name]:
+                dirs.append(name)
+            else:
+                files.append(name)
+
+    elif get_backend(top) == None and \
+         top.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Walk directory tree for %s using ifdh.' % top)
 
         # Retrieve the contents of this directory using ifdh.
 
+        names = []
+        types = {}
+        stats = {}
         lines = larbatch_utilities.ifdh_ll(top, 1)
         for line in lines:
-            words = line.split()
-            if len(words) > 5:
-                if words[0][0] == 'd':
-                    dirs.append(words[-1])
+            parsed = parse_ll_line(line)
+            if parsed != None:
+                name, sr = parsed
+                names.append(name)
+                stats[name] = sr
+                types[name] = statmod.S_ISDIR(sr.st_mode)
+                if types[name]:
+                    dirs.append(name)
                 else:
-                    files.append(words[-1])
+                    files.append(name)
+        cache_listing(top, names, types, stats)
     else:
         if debug:
             print('*** Larbatch_posix: Walk directory tree for %s using posix.' % top)
-        contents = listdir(top)
+        contents, types = list_contents(top)
+        types = dict(types)
         for obj in contents:
-            if isdir(os.path.join(top, obj)):
+            if types[obj] == None:
+                types[obj] = isdir(os.path.join(top, obj))
+            if types[obj]:
                 dirs.append(obj)
             else:
                 files.append(obj)
-
-    if topdown:
-        yield top, dirs, files
-
-    # Recursively descend into subdirectories.
-
-    for dir in dirs:
-        for result in walk(os.path.join(top, dir), topdown):
-            yield result
-
-    if not topdown:
-        yield top, dirs, files
+        cache_listing(top, contents, types)
 
     # Done.
 
-    return
+    return dirs, files
 
 
 # Make directory (parent directory must exist).
@@ -639,7 +1960,10 @@ def walk(top, topdown=True):
 # for non-dCache files.
 
 def mkdir(path, mode=0o777):
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    backend = get_backend(path)
+    if backend != None:
+        backend.mkdir(path, mode)
+    elif path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Make directory for %s using ifdh.' % path)
         larbatch_utilities.ifdh_mkdir(path)
@@ -647,6 +1971,7 @@ def mkdir(path, mode=0o777):
         if debug:
             print('*** Larbatch_posix: Make directory for %s using posix.' % path)
         os.mkdir(path, mode)
+    invalidate_cache(path)
 
 
 # Make directory and parents.
@@ -655,31 +1980,134 @@ def mkdir(path, mode=0o777):
 # "ifdh mkdir_p" is buggy, so we do the recursion locally.
 
 def makedirs(path, mode=0o777):
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    if get_backend(path) != None or \
+       (path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted)):
         if debug:
             print('*** Larbatch_posix: Make directory recursively for %s using ifdh.' % path)
 
-        # Make sure parent directory exists.
-
-        np = os.path.normpath(path)    # Stip trailing '/', if present.
-        parent = os.path.dirname(np)
-        if not isdir(parent):
-            makedirs(parent, mode)
-
-        # Now make directory itself.
+        # Make directory and any missing parent directories.
 
-        larbatch_utilities.ifdh_mkdir(path)
+        makedirs_tree([path], mode)
     else:
         if debug:
             print('*** Larbatch_posix: Make directory recursively for %s using posix.' % path)
         os.makedirs(path, mode)
 
+    # Parent directories may also have been created.
+
+    np = os.path.normpath(path)
+    while np != os.path.dirname(np):
+        invalidate_cache(np)
+        np = os.path.dirname(np)
+
+
+# Make a set of directories, including any missing parent directories.
+# It is not an error if any of the directories already exist.
+#
+# Targets are grouped by storage area (the first three components of
+# the path, e.g. "/pnfs/uboone/scratch").  For each group, the deepest
+# existing common ancestor is found, and its subtree is fetched into the
+# directory listing cache with a single listing (in ifdh mode, see
+# snapshot).  Missing directories are then determined from the cache,
+# and created one level at a time, with the directories at each level
+# created in parallel (up to max_parallel at a time).
+
+def makedirs_tree(dirs, mode=0o777, max_parallel=0):
+
+    if max_parallel <= 0:
+        max_parallel = walk_max_parallel
+
+    # Group targets by storage area.
+
+    groups = {}
+    for dir in dirs:
+        ndir = os.path.normpath(dir)
+        key = '/'.join(ndir.split('/')[:4])
+        if key not in groups:
+            groups[key] = []
+        if ndir not in groups[key]:
+            groups[key].append(ndir)
+
+    # Find missing directories.
+
+    missing = set()
+    for key in groups:
+        group = groups[key]
+
+        # Find deepest existing common ancestor.
+
+        top = os.path.dirname(os.path.commonprefix([dir + '/' for dir in group]))
+        if top == '':
+            top = '.'
+        while not isdir(top) and top != os.path.dirname(top):
+            top = os.path.dirname(top)
+            if top == '':
+                top = '.'
+
+        # Fetch the part of the tree that we need with a single listing.
+
+        depth = 0
+        for dir in group:
+            rel = os.path.relpath(dir, top)
+            if rel != '.':
+                depth = max(depth, len(rel.split('/')))
+        if depth > 0 and cached_listing(top) == None:
+            try:
+                snapshot(top, min(depth, snapshot_depth))
+            except:
+                pass
+
+        # Check each target, from the top down.
+
+        for dir in group:
+            rel = os.path.relpath(dir, top)
+            if rel == '.':
+                continue
+            path = top
+            parent_missing = False
+            for name in rel.split('/'):
+                path = os.path.join(path, name)
+                if parent_missing or path in missing or not isdir(path):
+                    missing.add(path)
+                    parent_missing = True
+
+    # Make missing directories, one level at a time.
+
+    levels = {}
+    for path in missing:
+        depth = path.count('/')
+        if depth not in levels:
+            levels[depth] = []
+        levels[depth].append(path)
+    for depth in sorted(levels.keys()):
+        paths = sorted(levels[depth])
+        if debug:
+            print('*** Larbatch_posix: Making %d directories at depth %d.' % (len(paths), depth))
+        results = larbatch_utilities.parallel_call(mkdir, [(path, mode) for path in paths],
+                                                   max_parallel)
+        for path, result in zip(paths, results):
+
+            # Ignore errors if the directory exists anyway (e.g. made by
+            # another process).
+
+            if result[1] != None and not isdir(path):
+                raise result[1]
+
+    # Done.
+
+    return
+
 
 # Rename file.
 # "ifdh mv" seems to be buggy, so use uberftp.
 
 def rename(src, dest):
-    if (src.startswith('/pnfs/') or
+    wait_pending(src, recursive=True)
+    wait_pending(dest, recursive=True)
+    backend = get_backend(src)
+    if backend != None and backend is get_backend(dest):
+        backend.rename(src, dest)
+    elif (src.startswith('/pnfs/') or
         dest.startswith('/pnfs/')) and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Rename %s to %s using ifdh.' % (src, dest))
@@ -707,12 +2135,19 @@ def rename(src, dest):
         if debug:
             print('*** Larbatch_posix: Rename %s to %s using posix.' % (src, dest))
         os.rename(src, dest)
+    invalidate_cache(src, recursive=True)
+    invalidate_cache(dest, recursive=True)
 
 
 # Delete file.
 
 def remove(path):
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    wait_pending(path)
+    invalidate_cache(path)
+    backend = get_backend(path)
+    if backend != None:
+        backend.remove(path)
+    elif path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Delete file %s using ifdh.' % path)
         larbatch_utilities.ifdh_rm(path)
@@ -726,14 +2161,14 @@ def remove(path):
         # 1.  Rename file to a random name (this can usually be done, even
         #     for undeletable files).
         #
-        # 2.  Delete renamed file in a subprocess.  No need to wait for
-        #     subprocess to finish, or check its exit status.
+        # 2.  Delete renamed file in the background (see reap).  No need to
+        #     wait for deletion to finish, or check its exit status.
 
         #os.remove(path)
         newpath = path + '_' + str(uuid.uuid4())
         try:
             os.rename(path, newpath)
-            os.system('rm -f %s &' % newpath)
+            reap(newpath)
             return
         except:
             pass
@@ -742,7 +2177,11 @@ def remove(path):
 # Delete empty directory.
 
 def rmdir(path):
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    invalidate_cache(path)
+    backend = get_backend(path)
+    if backend != None:
+        backend.rmdir(path)
+    elif path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Delete directoroy %s using ifdh.' % path)
         larbatch_utilities.ifdh_rmdir(path)
@@ -753,26 +2192,78 @@ def rmdir(path):
 
 
 # Delete directory tree.
+# In ifdh mode, the whole tree is listed once, then files are deleted in
+# parallel, then directories are deleted, deepest first.  All paths that
+# could not be deleted are reported, then the first error is raised.
 
 def rmtree(path):
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    wait_pending(path, recursive=True)
+    invalidate_cache(path, recursive=True)
+    if get_backend(path) != None or \
+       (path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted)):
         if debug:
             print('*** Larbatch_posix: Delete directoroy tree %s using ifdh.' % path)
 
-        # Delete contents recursively.
-
-        lines = larbatch_utilities.ifdh_ll(path, 1)
-        for line in lines:
-            words = line.split()
-            if len(words) > 5:
-                if words[0][0] == 'd':
-                    rmtree(os.path.join(path, words[-1]))
-                else:
-                    remove(os.path.join(path, words[-1]))
-
-        # Directory should be empty when we get to here.
-
-        rmdir(path)
+        # Make sure the top directory exists.
+
+        if not exists(path):
+            raise OSError('No such directory: %s' % path)
+
+        # Get the contents of the whole tree (walk takes a snapshot).
+
+        tree = list(walk(path, topdown=False))
+
+        # Delete files in parallel.
+
+        files = []
+        for dir, subdirs, names in tree:
+            for name in names:
+                files.append(os.path.join(dir, name))
+        failures = delete_parallel(remove, files, 'files')
+
+        # List the tree again, and delete any files that were created after
+        # the snapshot was taken.
+
+        invalidate_cache(path, recursive=True)
+        tree = list(walk(path, topdown=False))
+        files = []
+        for dir, subdirs, names in tree:
+            for name in names:
+                file = os.path.join(dir, name)
+                if not file in failures:
+                    files.append(file)
+        if len(files) > 0:
+            failures.update(delete_parallel(remove, files, 'files'))
+
+        # Delete directories, deepest first.  Directories at the same depth
+        # are deleted in parallel.  Skip directories that contain paths
+        # that could not be deleted.
+
+        levels = {}
+        for dir, subdirs, names in tree:
+            depth = os.path.normpath(dir).count('/')
+            if depth not in levels:
+                levels[depth] = []
+            levels[depth].append(dir)
+        for depth in sorted(levels.keys(), reverse=True):
+            dirs = []
+            for dir in levels[depth]:
+                prefix = os.path.join(dir, '')
+                blocked = False
+                for failure in failures:
+                    if failure.startswith(prefix):
+                        blocked = True
+                        break
+                if not blocked:
+                    dirs.append(dir)
+            failures.update(delete_parallel(rmdir, dirs, 'directories'))
+
+        # Report failures.
+
+        if len(failures) > 0:
+            for failure in sorted(failures.keys()):
+                print('*** Larbatch_posix: Failed to delete %s' % failure)
+            raise failures[sorted(failures.keys())[0]]
 
     else:
         if debug:
@@ -784,24 +2275,65 @@ def rmtree(path):
         # 1.  Rename directory to a random name (this can usually be done, even
         #     for undeletable directories).
         #
-        # 2.  Delete renamed directory in a subprocess.  No need to wait for
-        #     subprocess to finish, or check its exit status.
+        # 2.  Delete renamed directory in the background (see reap).  No need
+        #     to wait for deletion to finish, or check its exit status.
 
         #shutil.rmtree(path)
         npath = os.path.normpath(path)              # Strip trailing '/'
         newpath = npath + '_' + str(uuid.uuid4())
         os.rename(npath, newpath)
-        os.system('rm -rf %s &' % newpath)
+        reap(newpath)
 
     # Done
 
     return
 
 
+# Delete a list of paths in parallel, using the specified function (e.g.
+# remove or rmdir), with up to rmtree_max_parallel concurrent deletions.
+# Progress is reported for long lists.  Argument what describes the kind
+# of path, for progress messages.
+# Return value is a dictionary {path: exception} of failed deletions.
+
+def delete_parallel(func, paths, what):
+
+    failures = {}
+    if len(paths) == 0:
+        return failures
+
+    notify = queue.Queue()
+    pool = larbatch_utilities.thread_pool(min(rmtree_max_parallel, len(paths)))
+    tasks = {}
+    for path in paths:
+        tasks[pool.submit(func, (path,), notify)] = path
+    pool.shutdown()
+
+    # Collect results.
+
+    ndone = 0
+    step = max(rmtree_progress_step, len(paths) // 10)
+    while ndone < len(paths):
+        task = notify.get()
+        ndone += 1
+        if task.error != None:
+            failures[tasks[task]] = task.error
+        if len(paths) >= rmtree_progress_step and \
+           (ndone % step == 0 or ndone == len(paths)):
+            print('Deleted %d of %d %s.' % (ndone - len(failures), len(paths), what))
+
+    # Done.
+
+    return failures
+
+
 # Change mode.
 
 def chmod(path, mode):
-    if path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
+    invalidate_cache(path)
+    backend = get_backend(path)
+    if backend != None:
+        backend.chmod(path, mode)
+    elif path.startswith('/pnfs/') and (prefer_grid or not pnfs_is_mounted):
         if debug:
             print('*** Larbatch_posix: Change mode for %s using ifdh.' % path)
         larbatch_utilities.ifdh_chmod(path, mode)
@@ -815,10 +2347,15 @@ def chmod(path, mode):
 # Use nfs.
 
 def symlink(src, dest):
+    invalidate_cache(dest)
+
+    backend = get_backend(dest)
+    if backend != None:
+        backend.symlink(src, dest)
 
     # Make sure we have a kerberos ticket.
 
-    if src.startswith('/pnfs/') and not pnfs_is_mounted:
+    elif src.startswith('/pnfs/') and not pnfs_is_mounted:
         if debug:
             print('*** Larbatch_posix: Make symbolic link from %s to %s using nfs server.' % (src, dest))
         larbatch_utilities.test_ticket()
@@ -905,3 +2442,31 @@ def root_stream(path):
         if debug:
             print('*** Larbatch_posix: Stream path %s as normal file.' % path)
     return stream
+
+
+# Collect metrics (when enabled) for posix-like functions.
+# See larbatch_utilities.metered.
+
+open = larbatch_utilities.metered('open', open)
+readlines = larbatch_utilities.metered('readlines', readlines)
+copy = larbatch_utilities.metered('copy', copy)
+copy_many = larbatch_utilities.metered('copy_many', copy_many)
+listdir = larbatch_utilities.metered('listdir', listdir)
+list_contents = larbatch_utilities.metered('list_contents', list_contents)
+exists = larbatch_utilities.metered('exists', exists)
+isdir = larbatch_utilities.metered('isdir', isdir)
+stat = larbatch_utilities.metered('stat', stat)
+access = larbatch_utilities.metered('access', access)
+walk_contents = larbatch_utilities.metered('walk_contents', walk_contents)
+mkdir = larbatch_utilities.metered('mkdir', mkdir)
+makedirs = larbatch_utilities.metered('makedirs', makedirs)
+makedirs_tree = larbatch_utilities.metered('makedirs_tree', makedirs_tree)
+rename = larbatch_utilities.metered('rename', rename)
+remove = larbatch_utilities.metered('remove', remove)
+rmdir = larbatch_utilities.metered('rmdir', rmdir)
+rmtree = larbatch_utilities.metered('rmtree', rmtree)
+chmod = larbatch_utilities.metered('chmod', chmod)
+symlink = larbatch_utilities.metered('symlink', symlink)
+readlink = larbatch_utilities.metered('readlink', readlink)
+snapshot = larbatch_utilities.metered('snapshot', snapshot)
+scandir = larbatch_utilities.metered('scandir', scandir)
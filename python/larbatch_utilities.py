@@ -13,6 +13,7 @@
 # other protections.
 #
 # ifdh_cp - Interface for "ifdh cp."
+# ifdh_cp_many - Interface for "ifdh cp -f" (copy many files).
 # ifdh_ls - Interface for "ifdh ls."
 # ifdh_ll - Interface for "ifdh ll."
 # ifdh_mkdir - Interface for "ifdh mkdir."
@@ -20,12 +21,20 @@
 # ifdh_mv - Interface for "ifdh mv."
 # ifdh_rm - Interface for "ifdh rm."
 # ifdh_chmod - Interface for "ifdh chmod."
+# ifdh_env - Environment for running ifdh commands.
+# ifdh_command - Run an ifdh command, with timeout.
+# use_ifdh_server - Enable (or not) the persistent ifdh helper process.
 #
 # The following functions are provided as interfaces to posix tools
 # with additional protections or timeouts.
 #
 # posix_cp - Copy file with timeout.
 #
+# The following functions are provided as interfaces to xrootd tools.
+#
+# xrootd_read - Read entire contents of a dCache file, with timeout.
+# xrootd_stream - Start a subprocess that streams a dCache file.
+#
 # Authentication functions.
 #
 # test_ticket - Raise an exception of user does not have a valid kerberos ticket.
@@ -46,11 +55,22 @@
 # get_dcache_server - Sam fictitious server for dCache.
 # get_dropbox - Return dropbox based on sam metadata.
 #
+# Metrics functions.
+#
+# enable_metrics - Enable (or not) collection of per-operation metrics.
+# set_metrics_prefixes - Set path prefixes used to label metrics.
+# metered - Wrap a function so that calls are counted and timed.
+# record_metric - Record one call of an operation.
+# clear_metrics - Discard all collected metrics.
+# get_metrics - Return a copy of the collected metrics.
+# print_metrics - Print a summary of the collected metrics.
+#
 # Other functions.
 #
 # get_ups_products - Top level ups products.
 # get_setup_script_path - Full path of experiment setup script.
 # wait_for_subprocess - For use with subprocesses with timeouts.
+# parallel_call - Call a function for each of a list of arguments in parallel.
 # dcache_server - Return dCache server.
 # dcache_path - Convert dCache local path to path on server.
 # xrootd_server_port - Return xrootd server and port (as <server>:<port>).
@@ -64,13 +84,23 @@
 # convert_bytes - Accepting unicode or bytes as input, convert to bytes.
 # test_jobsub - Test whether jobsub_client is set up.
 #
+# Classes:
+#
+# pool_task - A function call that has been submitted to a thread_pool.
+# thread_pool - A bounded pool of daemon worker threads.
+#
 ######################################################################
 
 from __future__ import absolute_import
 from __future__ import print_function
 import sys, os
 import stat
+import time
+import math
 import subprocess
+import json
+import atexit
+import tempfile
 import getpass
 import threading
 try:
@@ -86,33 +116,184 @@ kca_ok = False
 proxy_ok = False
 kca_user = ''
 jobsub_ok = False
+proxy_lock = threading.Lock()
 
-# Copy file using ifdh, with timeout.
+# Persistent ifdh helper processes (see ifdh_server.py).
+# If environment variable LARBATCH_IFDH_SERVER is defined, ifdh commands
+# are sent to helper processes instead of running a separate "ifdh"
+# process for each command.  One helper process is started for each
+# concurrent caller.  Idle helper processes are kept for reuse.
 
-def ifdh_cp(source, destination):
+ifdh_server_enabled = 'LARBATCH_IFDH_SERVER' in os.environ
+ifdh_servers = []
+ifdh_server_lock = threading.Lock()
 
-    # Get proxy.
+# Per-operation metrics (see function metered).
+# If environment variable LARBATCH_METRICS is defined, metrics collection
+# is enabled from the start.
+#
+# metrics[(operation, label)] = [calls, total time, histogram]
+#
+# The histogram is a list of call counts in logarithmic latency bins.
+# Bin 0 counts calls up to 1 ms, bin n counts calls from 2**(n-1) ms to
+# 2**n ms, and the last bin counts all longer calls.
+
+metrics_enabled = 'LARBATCH_METRICS' in os.environ
+metrics_prefixes = []
+metrics_label_depth = 3
+metrics_nbins = 20
+metrics = {}
+metrics_lock = threading.Lock()
+
+# Return a copy of the environment suitable for running ifdh commands.
+# Environment variables X509_USER_CERT and X509_USER_KEY are removed
+# (they confuse ifdh, or rather the underlying tools).  The process
+# environment itself is not modified, so that ifdh commands may safely be
+# run from multiple threads at the same time.
+
+def ifdh_env():
+    env = dict(os.environ)
+    for var in ('X509_USER_CERT', 'X509_USER_KEY'):
+        if var in env:
+            del env[var]
+    return env
 
-    test_proxy()
 
-    # Make sure environment variables X509_USER_CERT and X509_USER_KEY
-    # are not defined (they confuse ifdh, or rather the underlying tools).
+# Enable or disable metrics collection.
 
-    save_vars = {}
-    for var in ('X509_USER_CERT', 'X509_USER_KEY'):
-        if var in os.environ:
-            save_vars[var] = os.environ[var]
-            del os.environ[var]
+def enable_metrics(flag=True):
+    global metrics_enabled
+    metrics_enabled = flag
 
-    # Do copy.
 
-    cmd = ['ifdh', 'cp', source, destination]
-    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+# Set path prefixes used to label metrics.  Calls on paths that start with
+# one of these prefixes are labeled with the longest matching prefix.
+# Other calls are unlabeled.  If no prefixes are set, calls on absolute
+# paths are labeled with the first metrics_label_depth components of the
+# path (e.g. "/pnfs/uboone/scratch").
+
+def set_metrics_prefixes(prefixes):
+    global metrics_prefixes
+    metrics_prefixes = sorted(prefixes, key=len, reverse=True)
+
+
+# Wrap a function so that calls are counted and timed (when metrics are
+# enabled) as operation op.  If the first argument of the function is a
+# string, it is used as a path to label the call.  Times of nested
+# metered calls are included in the time of the outer call.
+#
+# Usage:
+#
+# def exists(path):
+#     ...
+# exists = metered('exists', exists)
+
+def metered(op, func):
+    def wrapper(*args, **kwargs):
+        if not metrics_enabled:
+            return func(*args, **kwargs)
+        path = ''
+        if len(args) > 0 and isinstance(args[0], str):
+            path = args[0]
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record_metric(op, time.time() - start, path)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+# Record one call of operation op that took elapsed seconds.
+
+def record_metric(op, elapsed, path=''):
+    label = ''
+    if len(metrics_prefixes) > 0:
+        for prefix in metrics_prefixes:
+            if path.startswith(prefix):
+                label = prefix
+                break
+    elif path.startswith('/'):
+        label = '/'.join(path.split('/')[:metrics_label_depth+1])
+    bin = 0
+    if elapsed > 0.001:
+        bin = min(int(math.ceil(math.log(elapsed / 0.001, 2))), metrics_nbins - 1)
+    key = (op, label)
+    metrics_lock.acquire()
+    if key not in metrics:
+        metrics[key] = [0, 0., [0] * metrics_nbins]
+    entry = metrics[key]
+    entry[0] += 1
+    entry[1] += elapsed
+    entry[2][bin] += 1
+    metrics_lock.release()
+
+
+# Discard all collected metrics.
+
+def clear_metrics():
+    metrics_lock.acquire()
+    metrics.clear()
+    metrics_lock.release()
+
+
+# Return a copy of the collected metrics, as a dictionary
+# {(operation, label): (calls, total time, histogram)}.
+
+def get_metrics():
+    result = {}
+    metrics_lock.acquire()
+    for key in metrics:
+        entry = metrics[key]
+        result[key] = (entry[0], entry[1], list(entry[2]))
+    metrics_lock.release()
+    return result
+
+
+# Print a summary of the collected metrics, most expensive operations first.
+
+def print_metrics(file=None):
+    if file == None:
+        file = sys.stdout
+    data = get_metrics()
+    if len(data) == 0:
+        return
+    keys = sorted(data.keys(), key=lambda key: data[key][1], reverse=True)
+    print('\nLarbatch metrics (times include nested calls):\n', file=file)
+    print('%-20s %-30s %8s %10s %10s  %s' % ('Operation', 'Label', 'Calls', 'Total (s)',
+                                            'Mean (ms)', 'Latency histogram'), file=file)
+    for key in keys:
+        calls, total, histogram = data[key]
+        bins = []
+        for n in range(len(histogram)):
+            if histogram[n] > 0:
+                if n == len(histogram) - 1:
+                    bins.append('>%dms:%d' % (2**(n-1), histogram[n]))
+                else:
+                    bins.append('<%dms:%d' % (2**n, histogram[n]))
+        print('%-20s %-30s %8d %10.3f %10.3f  %s' % (key[0], key[1], calls, total,
+                                                    1000. * total / calls, ' '.join(bins)),
+              file=file)
+
+
+# Run an ifdh command, with timeout.
+# Argument cmd is the full "ifdh" command line, as a list of words.
+# Return value is standard output of the command.
+# Raise IFDHError if the command fails or times out.
+
+def ifdh_command(cmd, timeout):
+
+    if ifdh_server_enabled:
+        return ifdh_server_command(cmd, timeout)
+
+    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               env=ifdh_env())
 
     q = queue.Queue()
     thread = threading.Thread(target=wait_for_subprocess, args=[jobinfo, q])
     thread.start()
-    thread.join(timeout=31000000)
+    thread.join(timeout=timeout)
     if thread.is_alive():
         print('Terminating subprocess.')
         jobinfo.terminate()
@@ -121,156 +302,214 @@ def ifdh_cp(source, destination):
     jobout = convert_str(q.get())
     joberr = convert_str(q.get())
     if rc != 0:
-        for var in list(save_vars.keys()):
-            os.environ[var] = save_vars[var]
         raise IFDHError(cmd, rc, jobout, joberr)
 
-    # Restore environment variables.
+    # Done.
 
-    for var in list(save_vars.keys()):
-        os.environ[var] = save_vars[var]
+    return jobout
 
 
-# Ifdh ls, with timeout.
-# Return value is list of lines returned by "ifdh ls" command.
+# Enable or disable the persistent ifdh helper process.
 
-def ifdh_ls(path, depth):
+def use_ifdh_server(flag=True):
+    global ifdh_server_enabled
+    ifdh_server_enabled = flag
+    if not flag:
+        stop_ifdh_servers()
 
-    # Get proxy.
 
-    test_proxy()
+# Start an ifdh helper process.
+# Prefer the script in the same directory as this module, otherwise
+# look for it on the execution path.
+
+def start_ifdh_server():
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ifdh_server.py')
+    if os.path.exists(script):
+        cmd = [sys.executable, script]
+    else:
+        cmd = ['ifdh_server.py']
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            env=ifdh_env(), universal_newlines=True)
 
-    # Make sure environment variables X509_USER_CERT and X509_USER_KEY
-    # are not defined (they confuse ifdh, or rather the underlying tools).
 
-    save_vars = {}
-    for var in ('X509_USER_CERT', 'X509_USER_KEY'):
-        if var in os.environ:
-            save_vars[var] = os.environ[var]
-            del os.environ[var]
+# Stop all idle ifdh helper processes (they exit when their input is closed).
+# This is called by larbatch_posix.flush_all, after background transfers
+# have finished, and again at exit.
 
-    # Do listing.
+def stop_ifdh_servers():
+    ifdh_server_lock.acquire()
+    servers = list(ifdh_servers)
+    del ifdh_servers[:]
+    ifdh_server_lock.release()
+    for server in servers:
+        try:
+            server.stdin.close()
+            server.wait()
+        except:
+            pass
 
-    cmd = ['ifdh', 'ls', path, '%d' % depth]
-    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+atexit.register(stop_ifdh_servers)
+
+
+# Send one request to an ifdh helper process and wait for the reply.
+# The reply (a dictionary), or None if the helper process died, is put
+# into queue q.
 
+def ifdh_server_exchange(server, request, q):
+    reply = None
+    try:
+        server.stdin.write(request + '\n')
+        server.stdin.flush()
+        line = server.stdout.readline()
+        if line:
+            reply = json.loads(line)
+    except:
+        reply = None
+    q.put(reply)
+
+
+# Run an ifdh command using a helper process, with timeout.
+# A helper process that times out is killed and not reused.
+
+def ifdh_server_command(cmd, timeout):
+
+    # Get an idle helper process, or start a new one.
+
+    server = None
+    ifdh_server_lock.acquire()
+    while len(ifdh_servers) > 0 and server == None:
+        server = ifdh_servers.pop()
+        if server.poll() != None:
+            server = None
+    ifdh_server_lock.release()
+    if server == None:
+        server = start_ifdh_server()
+
+    # Send request.
+
+    request = json.dumps({'cmd': cmd[1:]})
     q = queue.Queue()
-    thread = threading.Thread(target=wait_for_subprocess, args=[jobinfo, q])
+    thread = threading.Thread(target=ifdh_server_exchange, args=[server, request, q])
+    thread.daemon = True
     thread.start()
-    thread.join(timeout=600)
+    thread.join(timeout=timeout)
     if thread.is_alive():
         print('Terminating subprocess.')
-        jobinfo.terminate()
+        server.kill()
         thread.join()
-    rc = q.get()
-    jobout = convert_str(q.get())
-    joberr = convert_str(q.get())
-    if rc != 0:
-        for var in list(save_vars.keys()):
-            os.environ[var] = save_vars[var]
-        raise IFDHError(cmd, rc, jobout, joberr)
+    reply = q.get()
+
+    # Check result.
+
+    if reply == None:
+        server.kill()
+        rc = server.wait()
+        if rc == 0:
+            rc = 1
+        raise IFDHError(cmd, rc, '', 'Ifdh helper process failed.')
+    ifdh_server_lock.acquire()
+    ifdh_servers.append(server)
+    ifdh_server_lock.release()
+    if reply['rc'] != 0:
+        raise IFDHError(cmd, reply['rc'], convert_str(reply['out']), convert_str(reply['err']))
 
-    # Restore environment variables.
+    # Done.
 
-    for var in list(save_vars.keys()):
-        os.environ[var] = save_vars[var]
+    return convert_str(reply['out'])
 
-    # Done.
 
-    return jobout.splitlines()
+# Copy file using ifdh, with timeout.
 
+def ifdh_cp(source, destination):
 
-# Ifdh ll, with timeout.
-# Return value is list of lines returned by "ifdh ls" command.
+    # Get proxy.
+
+    test_proxy()
 
-def ifdh_ll(path, depth):
+    # Do copy.
+
+    cmd = ['ifdh', 'cp', source, destination]
+    ifdh_command(cmd, 31000000)
+
+
+# Copy many files using a single ifdh command, with timeout.
+# Argument pairs is a list of 2-tuples (source, destination).
+# The list of files is passed to "ifdh cp" in a temporary file.
+
+def ifdh_cp_many(pairs):
 
     # Get proxy.
 
     test_proxy()
 
-    # Make sure environment variables X509_USER_CERT and X509_USER_KEY
-    # are not defined (they confuse ifdh, or rather the underlying tools).
+    # Write list file.
 
-    save_vars = {}
-    for var in ('X509_USER_CERT', 'X509_USER_KEY'):
-        if var in os.environ:
-            save_vars[var] = os.environ[var]
-            del os.environ[var]
+    fd, listfile = tempfile.mkstemp(prefix='ifdh_cp_', suffix='.list')
+    f = os.fdopen(fd, 'w')
+    for source, destination in pairs:
+        f.write('%s %s\n' % (source, destination))
+    f.close()
 
-    # Do listing.
+    # Do copy.
 
-    cmd = ['ifdh', 'll', path, '%d' % depth]
-    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    cmd = ['ifdh', 'cp', '-f', listfile]
+    try:
+        ifdh_command(cmd, 31000000)
+    finally:
+        os.remove(listfile)
 
-    q = queue.Queue()
-    thread = threading.Thread(target=wait_for_subprocess, args=[jobinfo, q])
-    thread.start()
-    thread.join(timeout=60)
-    if thread.is_alive():
-        print('Terminating subprocess.')
-        jobinfo.terminate()
-        thread.join()
-    rc = q.get()
-    jobout = convert_str(q.get())
-    joberr = convert_str(q.get())
-    if rc != 0:
-        for var in list(save_vars.keys()):
-            os.environ[var] = save_vars[var]
-        raise IFDHError(cmd, rc, jobout, joberr)
 
-    # Restore environment variables.
+# Ifdh ls, with timeout.
+# Return value is list of lines returned by "ifdh ls" command.
+
+def ifdh_ls(path, depth):
+
+    # Get proxy.
+
+    test_proxy()
+
+    # Do listing.
 
-    for var in list(save_vars.keys()):
-        os.environ[var] = save_vars[var]
+    cmd = ['ifdh', 'ls', path, '%d' % depth]
+    jobout = ifdh_command(cmd, 600)
 
     # Done.
 
     return jobout.splitlines()
 
 
-# Ifdh mkdir, with timeout.
+# Ifdh ll, with timeout.
+# Return value is list of lines returned by "ifdh ll" command.
+# Deep listings (depth > 1) may need a longer timeout than the default.
 
-def ifdh_mkdir(path):
+def ifdh_ll(path, depth, timeout=60):
 
     # Get proxy.
 
     test_proxy()
 
-    # Make sure environment variables X509_USER_CERT and X509_USER_KEY
-    # are not defined (they confuse ifdh, or rather the underlying tools).
+    # Do listing.
 
-    save_vars = {}
-    for var in ('X509_USER_CERT', 'X509_USER_KEY'):
-        if var in os.environ:
-            save_vars[var] = os.environ[var]
-            del os.environ[var]
+    cmd = ['ifdh', 'll', path, '%d' % depth]
+    jobout = ifdh_command(cmd, timeout)
 
-    # Do mkdir.
+    # Done.
 
-    cmd = ['ifdh', 'mkdir', path]
-    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return jobout.splitlines()
 
-    q = queue.Queue()
-    thread = threading.Thread(target=wait_for_subprocess, args=[jobinfo, q])
-    thread.start()
-    thread.join(timeout=60)
-    if thread.is_alive():
-        print('Terminating subprocess.')
-        jobinfo.terminate()
-        thread.join()
-    rc = q.get()
-    jobout = convert_str(q.get())
-    joberr = convert_str(q.get())
-    if rc != 0:
-        for var in list(save_vars.keys()):
-            os.environ[var] = save_vars[var]
-        raise IFDHError(cmd, rc, jobout, joberr)
 
-    # Restore environment variables.
+# Ifdh mkdir, with timeout.
+
+def ifdh_mkdir(path):
+
+    # Get proxy.
+
+    test_proxy()
+
+    # Do mkdir.
 
-    for var in list(save_vars.keys()):
-        os.environ[var] = save_vars[var]
+    cmd = ['ifdh', 'mkdir', path]
+    ifdh_command(cmd, 60)
 
     # Done.
 
@@ -285,40 +524,10 @@ def ifdh_rmdir(path):
 
     test_proxy()
 
-    # Make sure environment variables X509_USER_CERT and X509_USER_KEY
-    # are not defined (they confuse ifdh, or rather the underlying tools).
-
-    save_vars = {}
-    for var in ('X509_USER_CERT', 'X509_USER_KEY'):
-        if var in os.environ:
-            save_vars[var] = os.environ[var]
-            del os.environ[var]
-
     # Do rmdir.
 
     cmd = ['ifdh', 'rmdir', path]
-    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    q = queue.Queue()
-    thread = threading.Thread(target=wait_for_subprocess, args=[jobinfo, q])
-    thread.start()
-    thread.join(timeout=60)
-    if thread.is_alive():
-        print('Terminating subprocess.')
-        jobinfo.terminate()
-        thread.join()
-    rc = q.get()
-    jobout = convert_str(q.get())
-    joberr = convert_str(q.get())
-    if rc != 0:
-        for var in list(save_vars.keys()):
-            os.environ[var] = save_vars[var]
-        raise IFDHError(cmd, rc, jobout, joberr)
-
-    # Restore environment variables.
-
-    for var in list(save_vars.keys()):
-        os.environ[var] = save_vars[var]
+    ifdh_command(cmd, 60)
 
     # Done.
 
@@ -333,40 +542,10 @@ def ifdh_chmod(path, mode):
 
     test_proxy()
 
-    # Make sure environment variables X509_USER_CERT and X509_USER_KEY
-    # are not defined (they confuse ifdh, or rather the underlying tools).
-
-    save_vars = {}
-    for var in ('X509_USER_CERT', 'X509_USER_KEY'):
-        if var in os.environ:
-            save_vars[var] = os.environ[var]
-            del os.environ[var]
-
     # Do chmod.
 
     cmd = ['ifdh', 'chmod', '%o' % mode, path]
-    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    q = queue.Queue()
-    thread = threading.Thread(target=wait_for_subprocess, args=[jobinfo, q])
-    thread.start()
-    thread.join(timeout=60)
-    if thread.is_alive():
-        print('Terminating subprocess.')
-        jobinfo.terminate()
-        thread.join()
-    rc = q.get()
-    jobout = convert_str(q.get())
-    joberr = convert_str(q.get())
-    if rc != 0:
-        for var in list(save_vars.keys()):
-            os.environ[var] = save_vars[var]
-        raise IFDHError(cmd, rc, jobout, joberr)
-
-    # Restore environment variables.
-
-    for var in list(save_vars.keys()):
-        os.environ[var] = save_vars[var]
+    ifdh_command(cmd, 60)
 
     # Done.
 
@@ -381,40 +560,10 @@ def ifdh_mv(src, dest):
 
     test_proxy()
 
-    # Make sure environment variables X509_USER_CERT and X509_USER_KEY
-    # are not defined (they confuse ifdh, or rather the underlying tools).
-
-    save_vars = {}
-    for var in ('X509_USER_CERT', 'X509_USER_KEY'):
-        if var in os.environ:
-            save_vars[var] = os.environ[var]
-            del os.environ[var]
-
     # Do rename.
 
     cmd = ['ifdh', 'mv', src, dest]
-    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    q = queue.Queue()
-    thread = threading.Thread(target=wait_for_subprocess, args=[jobinfo, q])
-    thread.start()
-    thread.join(timeout=60)
-    if thread.is_alive():
-        print('Terminating subprocess.')
-        jobinfo.terminate()
-        thread.join()
-    rc = q.get()
-    jobout = convert_str(q.get())
-    joberr = convert_str(q.get())
-    if rc != 0:
-        for var in list(save_vars.keys()):
-            os.environ[var] = save_vars[var]
-        raise IFDHError(cmd, rc, jobout, joberr)
-
-    # Restore environment variables.
-
-    for var in list(save_vars.keys()):
-        os.environ[var] = save_vars[var]
+    ifdh_command(cmd, 60)
 
     # Done.
 
@@ -429,40 +578,10 @@ def ifdh_rm(path):
 
     test_proxy()
 
-    # Make sure environment variables X509_USER_CERT and X509_USER_KEY
-    # are not defined (they confuse ifdh, or rather the underlying tools).
-
-    save_vars = {}
-    for var in ('X509_USER_CERT', 'X509_USER_KEY'):
-        if var in os.environ:
-            save_vars[var] = os.environ[var]
-            del os.environ[var]
-
     # Do delete.
 
     cmd = ['ifdh', 'rm', path]
-    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    q = queue.Queue()
-    thread = threading.Thread(target=wait_for_subprocess, args=[jobinfo, q])
-    thread.start()
-    thread.join(timeout=60)
-    if thread.is_alive():
-        print('Terminating subprocess.')
-        jobinfo.terminate()
-        thread.join()
-    rc = q.get()
-    jobout = convert_str(q.get())
-    joberr = convert_str(q.get())
-    if rc != 0:
-        for var in list(save_vars.keys()):
-            os.environ[var] = save_vars[var]
-        raise IFDHError(cmd, rc, jobout, joberr)
-
-    # Restore environment variables.
-
-    for var in list(save_vars.keys()):
-        os.environ[var] = save_vars[var]
+    ifdh_command(cmd, 60)
 
     # Done.
 
@@ -523,6 +642,60 @@ def posix_cp(source, destination):
     return
 
 
+# Read the entire contents of a dCache file using xrootd, with timeout.
+# Return value is the contents of the file (as bytes).
+
+def xrootd_read(path, timeout=600):
+
+    # Get proxy.
+
+    test_proxy()
+
+    # Do read.
+
+    cmd = ['xrdcp', '--silent', xrootd_uri(path), '-']
+    jobinfo = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               env=ifdh_env())
+
+    q = queue.Queue()
+    thread = threading.Thread(target=wait_for_subprocess, args=[jobinfo, q])
+    thread.start()
+    thread.join(timeout=timeout)
+    if thread.is_alive():
+        print('Terminating subprocess.')
+        jobinfo.terminate()
+        thread.join()
+    rc = q.get()
+    jobout = q.get()
+    joberr = convert_str(q.get())
+    if rc != 0:
+        raise IFDHError(cmd, rc, '', joberr)
+
+    # Done.
+
+    return jobout
+
+
+# Start a subprocess that streams the contents of a dCache file to its
+# standard output using xrootd.  Standard error of the subprocess is
+# sent to the specified file object (or discarded if None).
+# Return value is the subprocess.Popen object.
+
+def xrootd_stream(path, errfile=None):
+
+    # Get proxy.
+
+    test_proxy()
+
+    # Start subprocess.
+
+    cmd = ['xrdcp', '--silent', xrootd_uri(path), '-']
+    if errfile == None:
+        errfile = open(os.devnull, 'w')
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errfile,
+                            env=ifdh_env())
+
+
 # Function to wait for a subprocess to finish and fetch return code,
 # standard output, and standard error.
 # Call this function like this:
@@ -544,6 +717,112 @@ def wait_for_subprocess(jobinfo, q, input=None):
     return
 
 
+# Class representing a function call submitted to a thread_pool.
+# Call method wait to wait for the call to finish and get its return value.
+# Any exception raised by the function is reraised by method wait.
+
+class pool_task:
+
+    def __init__(self, func, args, notify=None):
+        self.func = func                  # Function.
+        self.args = args                  # Argument list.
+        self.notify = notify              # Queue to receive this task when done (or None).
+        self.result = None                # Return value of function.
+        self.error = None                 # Exception raised by function.
+        self.done = threading.Event()     # Set when function has finished.
+
+    # Execute function (called by worker thread).
+    # The task is always finished, whatever the function raises.
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.finish()
+
+    # Mark task as finished, and notify queue, if any.
+
+    def finish(self):
+        self.done.set()
+        if self.notify != None:
+            self.notify.put(self)
+
+    # Wait for function to finish.
+
+    def wait(self):
+        self.done.wait()
+        if self.error != None:
+            raise self.error
+        return self.result
+
+
+# Bounded pool of daemon worker threads.
+# Tasks are executed in the order they are submitted.
+
+class thread_pool:
+
+    def __init__(self, nthreads):
+        self.queue = queue.Queue()
+        self.cancelled = False
+        self.threads = []
+        for n in range(max(nthreads, 1)):
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    # Worker thread function.
+
+    def worker(self):
+        while True:
+            task = self.queue.get()
+            if task == None:
+                return
+            if self.cancelled:
+                task.error = RuntimeError('Task cancelled.')
+                task.finish()
+            else:
+                task.run()
+
+    # Submit function call.  Return pool_task object.
+    # If notify is not None, the task is put in this queue when it has finished.
+
+    def submit(self, func, args=(), notify=None):
+        task = pool_task(func, args, notify)
+        self.queue.put(task)
+        return task
+
+    # Stop worker threads after all submitted tasks have finished.
+    # If cancel is True, tasks that haven't started are not executed.
+
+    def shutdown(self, cancel=False):
+        if cancel:
+            self.cancelled = True
+        for thread in self.threads:
+            self.queue.put(None)
+
+
+# Call function func once for each argument tuple in arglist, using up to
+# max_parallel threads.  Return a list of 2-tuples (result, error), in the
+# same order as arglist, where error is the exception raised by the call
+# (or None).
+
+def parallel_call(func, arglist, max_parallel):
+    arglist = list(arglist)
+    pool = thread_pool(min(max_parallel, len(arglist)))
+    tasks = []
+    for args in arglist:
+        tasks.append(pool.submit(func, args))
+    pool.shutdown()
+    result = []
+    for task in tasks:
+        task.done.wait()
+        result.append((task.result, task.error))
+    return result
+
+
 # Test whether user has a valid kerberos ticket.  Raise exception if no.
 
 def test_ticket():
@@ -683,28 +962,37 @@ def test_kca():
 
 def test_proxy():
     global proxy_ok
-    if not proxy_ok:
-        try:
-            subprocess.check_call(['voms-proxy-info', '-exists'], stdout=-1, stderr=-1)
-            subprocess.check_call(['voms-proxy-info', '-exists', '-acissuer'], stdout=-1, stderr=-1)
-            proxy_ok = True
-        except:
-            pass
+    if proxy_ok:
+        return proxy_ok
 
-    # If at this point we don't have a grid proxy, try to get one.
+    # Serialize proxy checks, which may be requested by several threads at once.
 
-    if not proxy_ok:
-        get_proxy()
+    proxy_lock.acquire()
+    try:
+        if not proxy_ok:
+            try:
+                subprocess.check_call(['voms-proxy-info', '-exists'], stdout=-1, stderr=-1)
+                subprocess.check_call(['voms-proxy-info', '-exists', '-acissuer'], stdout=-1, stderr=-1)
+                proxy_ok = True
+            except:
+                pass
 
-    # Final checkout.
+        # If at this point we don't have a grid proxy, try to get one.
 
-    if not proxy_ok:
-        try:
-            subprocess.check_call(['voms-proxy-info', '-exists'], stdout=-1, stderr=-1)
-            subprocess.check_call(['voms-proxy-info', '-exists', '-acissuer'], stdout=-1, stderr=-1)
-            proxy_ok = True
-        except:
-            raise RuntimeError('Please get a grid proxy.')
+        if not proxy_ok:
+            get_proxy()
+
+        # Final checkout.
+
+        if not proxy_ok:
+            try:
+                subprocess.check_call(['voms-proxy-info', '-exists'], stdout=-1, stderr=-1)
+                subprocess.check_call(['voms-proxy-info', '-exists', '-acissuer'], stdout=-1, stderr=-1)
+                proxy_ok = True
+            except:
+                raise RuntimeError('Please get a grid proxy.')
+    finally:
+        proxy_lock.release()
     return proxy_ok
 
 # Test whether jobsub_client has been set up.
@@ -1237,3 +1525,18 @@ def convert_bytes(s):
 # override any function or symbol defined above, or add new ones.
 
 from experiment_utilities import *
+
+
+# Collect metrics (when enabled) for interface functions.
+
+ifdh_cp = metered('ifdh_cp', ifdh_cp)
+ifdh_cp_many = metered('ifdh_cp_many', ifdh_cp_many)
+ifdh_ls = metered('ifdh_ls', ifdh_ls)
+ifdh_ll = metered('ifdh_ll', ifdh_ll)
+ifdh_mkdir = metered('ifdh_mkdir', ifdh_mkdir)
+ifdh_rmdir = metered('ifdh_rmdir', ifdh_rmdir)
+ifdh_mv = metered('ifdh_mv', ifdh_mv)
+ifdh_rm = metered('ifdh_rm', ifdh_rm)
+ifdh_chmod = metered('ifdh_chmod', ifdh_chmod)
+posix_cp = metered('posix_cp', posix_cp)
+xrootd_read = metered('xrootd_read', xrootd_read)
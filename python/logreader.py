@@ -0,0 +1,197 @@
+#! /usr/bin/env python
+######################################################################
+#
+# Name: logreader.py
+#
+# Purpose: Python class LogReader (used by project.py script).
+#          This class provides read access to the log files of one
+#          worker subdirectory of the bookkeeping directory,
+#          regardless of whether the worker log tarball(s) have been
+#          extracted into this subdirectory, or only indexed (see
+#          class LogTarball).  Extracted files take precedence over
+#          tarball members with the same name.
+#
+#          If the worker made a job summary (job_summary.json, see
+#          job_summary.py), the files that are contained in the summary
+#          (lar.stat, sam_project.txt, cpid.txt, json metadata of output
+#          files, and *.list files) are read from the summary, so that
+#          only one file needs to be read.  Other files, and files of
+#          workers without a job summary, are read individually.
+#
+#          File names are relative to the subdirectory.
+#
+# Created: 18-Oct-2026
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os, json
+import larbatch_posix
+from project_modules.logtarball import LogTarball
+
+# Log subdirectory reader class.
+
+class LogReader:
+
+    # Supported job summary format version.
+
+    summary_version = 1
+
+    # Constructor.
+    # Argument files is the list of files in subdirectory path, if known.
+
+    def __init__(self, path, files=None):
+
+        self.path = path               # Log subdirectory.
+        self.entries = []              # Directory entries of this subdirectory.
+        self.files = set()             # Extracted files in this subdirectory.
+        self.members = {}              # members[name] = LogTarball object.
+        self.summary = None            # Job summary (dictionary), if any.
+        self.summary_stat = (0, 0)     # Size and modification time of job summary.
+        self.contents = {}             # contents[name] = file contents from job summary.
+        self.loaded = False            # Have tarball indexes and job summary been read?
+
+        if files == None:
+            files = []
+            if larbatch_posix.isdir(path):
+                files = larbatch_posix.listdir(path)
+        self.entries = list(files)
+        for name in files:
+            if not name.endswith('.tar.index'):
+                self.files.add(name)
+
+    # Read tarball indexes and job summary, if not already done.
+    # This is deferred until file information is first needed, so that
+    # a LogReader can be used to get directory information only (see
+    # method entry_stats).
+
+    def load(self):
+
+        if self.loaded:
+            return
+        self.loaded = True
+        for name in self.entries:
+            if name.endswith('.tar.index'):
+                tarball = LogTarball(os.path.join(self.path, name))
+                try:
+                    tarball.load()
+                except:
+                    continue
+                for member in tarball.names():
+                    self.members[member] = tarball
+
+        # Read job summary, if any.
+
+        if self.exists('job_summary.json'):
+            try:
+                summary = json.loads(''.join(self.readlines('job_summary.json')))
+                if summary['version'] == LogReader.summary_version:
+                    self.summary = summary
+                    self.summary_stat = self.stat('job_summary.json')
+            except:
+                self.summary = None
+        if self.summary != None:
+            self.unpack_summary()
+
+    # Return size and modification time of directory entries whose names
+    # match any of the specified suffixes, as a sorted list of 3-tuples
+    # (name, size, mtime).  This uses only directory information (no
+    # file contents are read).  Size -1 means the entry couldn't be stat'ed.
+
+    def entry_stats(self, suffixes):
+        result = []
+        for name in self.entries:
+            for suffix in suffixes:
+                if name.endswith(suffix):
+                    try:
+                        sr = larbatch_posix.stat(os.path.join(self.path, name))
+                        result.append((name, sr.st_size, sr.st_mtime))
+                    except:
+                        result.append((name, -1, 0))
+                    break
+        result.sort()
+        return result
+
+    # Fill dictionary contents from job summary.
+
+    def unpack_summary(self):
+
+        summary = self.summary
+        if summary['status'] != None:
+            self.contents['lar.stat'] = '%d\n' % summary['status']
+        if summary['sam_project'] != '':
+            self.contents['sam_project.txt'] = '%s\n' % summary['sam_project']
+        if summary['cpid'] != '':
+            self.contents['cpid.txt'] = '%s\n' % summary['cpid']
+        for name in summary['outputs']:
+            md = summary['outputs'][name]['metadata']
+            if len(md) > 0:
+                self.contents[name + '.json'] = json.dumps(md)
+        for name in summary['lists']:
+            lines = summary['lists'][name]
+            self.contents[name] = ''.join(['%s\n' % line for line in lines])
+
+    # Return list of file names (top level only).
+
+    def listdir(self):
+        self.load()
+        result = set(self.files)
+        result.update(self.contents.keys())
+        for name in self.members:
+            if name.find('/') < 0:
+                result.add(name)
+        return sorted(result)
+
+    # Test whether file exists.
+
+    def exists(self, name):
+        self.load()
+        if name in self.contents or name in self.files or name in self.members:
+            return True
+        return name.find('/') >= 0 and larbatch_posix.exists(os.path.join(self.path, name))
+
+    # Read lines from file.  Raise IOError if file doesn't exist.
+
+    def readlines(self, name):
+        self.load()
+        if name in self.contents:
+            return self.contents[name].splitlines(True)
+        if name in self.files or not name in self.members:
+            return larbatch_posix.readlines(os.path.join(self.path, name))
+        return self.members[name].read(name).splitlines(True)
+
+    # Return size and modification time of file, as a 2-tuple.
+
+    def stat(self, name):
+        self.load()
+        if name in self.contents:
+            return (len(self.contents[name]), self.summary_stat[1])
+        if name in self.files or not name in self.members:
+            sr = larbatch_posix.stat(os.path.join(self.path, name))
+            return (sr.st_size, sr.st_mtime)
+        return self.members[name].stat(name)
+
+    # Return checksum of output file name from job summary, or None if not known.
+
+    def checksum(self, name):
+        self.load()
+        if self.summary != None and name in self.summary['outputs']:
+            return self.summary['outputs'][name]['checksum']
+        return None
+
+    # Rename file.
+
+    def rename(self, name, newname):
+        self.load()
+        in_contents = name in self.contents
+        if in_contents:
+            self.contents[newname] = self.contents.pop(name)
+        if name in self.members and not name in self.files:
+            tarball = self.members.pop(name)
+            tarball.rename(name, newname)
+            self.members[newname] = tarball
+        elif name in self.files or not in_contents:
+            larbatch_posix.rename(os.path.join(self.path, name), os.path.join(self.path, newname))
+            self.files.discard(name)
+            self.files.add(newname)
@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+######################################################################
+#
+# Name: logtarball.py
+#
+# Purpose: Python class LogTarball (used by project.py script).
+#          This class manages the sidecar index of a worker log
+#          tarball (log*.tar), which allows single members of the
+#          tarball to be read without extracting the tarball.
+#
+#          The index is a json file (<tarball>.index) that is stored in
+#          the bookkeeping subdirectory of the worker.  It contains the
+#          path of the tarball, and for each regular file member, the
+#          member name, data offset, size, modification time, and
+#          original name in the tarball.
+#
+#          Members of uncompressed tarballs are read by seeking to
+#          their offset in the tarball.  Compressed tarballs (which is
+#          what batch workers normally make) can't be read at an
+#          offset, so the contents of members that match a list of
+#          patterns (normally the small files that are needed for
+#          checking) are also saved in the index.  Other members of
+#          compressed tarballs are read by streaming the tarball.
+#
+#          The index is built by reading the tarball once.
+#
+# Created: 18-Oct-2026
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os, json, tarfile, fnmatch
+import larbatch_posix
+from larbatch_utilities import convert_str
+
+# Log tarball index class.
+
+class LogTarball:
+
+    # Index format version.
+
+    version = 1
+
+    # Constructor.
+
+    def __init__(self, index_path):
+
+        self.index_path = index_path   # Path of index file.
+        self.tarball = ''              # Path of tarball.
+        self.compressed = False        # Is tarball compressed?
+        self.members = {}              # members[name] = [offset, size, mtime, tarname]
+        self.data = {}                 # data[name] = contents of member.
+
+    # Build index by reading tarball src.
+    # Contents of members that match any of patterns (matched against
+    # base name) are saved in the index, if tarball is compressed.
+
+    def build(self, src, patterns):
+
+        self.tarball = src
+        self.compressed = False
+        self.members = {}
+        self.data = {}
+        f = larbatch_posix.open(src, 'rb')
+        magic = f.read(3)
+        f.close()
+        if magic[:2] == b'\x1f\x8b' or magic == b'BZh' or magic[:2] == b'\xfd7':
+            self.compressed = True
+
+        f = larbatch_posix.open(src, 'rb')
+        tf = tarfile.open(fileobj=f, mode='r|*')
+        for member in tf:
+            if not member.isfile():
+                continue
+            name = os.path.normpath(member.name)
+            if name.startswith('/') or name.startswith('..'):
+                continue
+            self.members[name] = [member.offset_data, member.size, member.mtime, name]
+            if self.compressed:
+                for pattern in patterns:
+                    if fnmatch.fnmatch(os.path.basename(name), pattern):
+                        self.data[name] = convert_str(tf.extractfile(member).read())
+                        break
+        tf.close()
+        f.close()
+
+    # Load index.
+
+    def load(self):
+
+        f = larbatch_posix.open(self.index_path)
+        index = json.loads(f.read())
+        f.close()
+        if index['version'] != LogTarball.version:
+            raise IOError('Unsupported version of log tarball index %s.' % self.index_path)
+        self.tarball = index['tarball']
+        self.compressed = index['compressed']
+        self.members = index['members']
+        self.data = index['data']
+
+    # Save index.
+
+    def save(self):
+
+        index = {'version': LogTarball.version,
+                 'tarball': self.tarball,
+                 'compressed': self.compressed,
+                 'members': self.members,
+                 'data': self.data}
+        f = larbatch_posix.open(self.index_path, 'w')
+        f.write(json.dumps(index, sort_keys=True))
+        f.close()
+
+    # Return list of member names.
+
+    def names(self):
+        return list(self.members.keys())
+
+    # Return size and modification time of member as a 2-tuple.
+
+    def stat(self, name):
+        return tuple(self.members[name][1:3])
+
+    # Read contents of member (as a string).
+
+    def read(self, name):
+
+        if name in self.data:
+            return self.data[name]
+        if not name in self.members:
+            raise IOError('No member %s in log tarball %s.' % (name, self.tarball))
+        offset, size, mtime, tarname = self.members[name]
+
+        if not self.compressed:
+
+            # Read member at offset.
+
+            f = larbatch_posix.open(self.tarball, 'rb')
+            try:
+                f.seek(offset)
+            except AttributeError:
+                while offset > 0:
+                    n = len(f.read(min(offset, 1048576)))
+                    if n == 0:
+                        break
+                    offset -= n
+            contents = f.read(size)
+            f.close()
+            return convert_str(contents)
+
+        # Stream compressed tarball to find member.
+
+        contents = ''
+        f = larbatch_posix.open(self.tarball, 'rb')
+        tf = tarfile.open(fileobj=f, mode='r|*')
+        for member in tf:
+            if member.isfile() and os.path.normpath(member.name) == tarname:
+                contents = convert_str(tf.extractfile(member).read())
+                break
+        tf.close()
+        f.close()
+        return contents
+
+    # Rename member (in the index only).
+
+    def rename(self, name, newname):
+
+        self.members[newname] = self.members.pop(name)
+        if name in self.data:
+            self.data[newname] = self.data.pop(name)
+        self.save()
@@ -10,6 +10,12 @@
 #          similarly to the shell command "mkdir -p", except everything
 #          is done using ifdh commands.
 #
+#          Any number of directories may be specified.  Each parent
+#          directory is listed at most once, and directories at the same
+#          depth are created in parallel.  Since the ifdh python binding
+#          isn't known to be thread safe, parallel directories are created
+#          using "ifdh mkdir" subprocesses.
+#
 #          Environment variable $EXPERIMENT must be defined to properly 
 #          initialize ifdh.
 #
@@ -17,12 +23,13 @@
 #
 # Command line usage:
 #
-# mkdir.py [-h|--help] <dir>
+# mkdir.py [-h|--help] [-v] [-j <n>] <dir> [<dir> ...]
 #
 # Options:
 #
 # -h, --help - Print help.
 # -v         - Verbose.
+# -j <n>     - Maximum number of parallel ifdh mkdir commands (default 8).
 #
 # Arguments:
 #
@@ -35,18 +42,24 @@ from __future__ import print_function
 
 # Imports
 
-import sys, os, ifdh
+import sys, os, ifdh, threading, subprocess
 
 # Initialize ifdh.
 
 Ifdh = ifdh.ifdh()
 
+# Cache of parent directory listings.
+# listings[parent] = set of subdirectory names (or None if listing failed).
+
+listings = {}
+
 # Main procedure.
 
 def main(argv):
 
     verbose = 0
-    dir = ''
+    max_parallel = 8
+    dirs = []
 
     # Parse arguments.
 
@@ -61,18 +74,21 @@ def main(argv):
         elif args[0] == '-v':
             verbose = 1
             del args[0]
+        elif args[0] == '-j' and len(args) > 1:
+            max_parallel = int(args[1])
+            del args[0:2]
         elif args[0][0] == '-':
             print('Unknown option %s' % args[0])
             return 1
         else:
-            if dir != '':
-                print('Too many arguments.')
-                return 1
-            dir = args[0]
+            dirs.append(args[0])
             del args[0]
 
-    mkdir(dir, verbose)
-    return
+    if len(dirs) == 1:
+        rc = mkdir(dirs[0], verbose)
+    else:
+        rc = mkdirs(dirs, verbose, max_parallel)
+    return rc
 
 # Help function.
 
@@ -95,9 +111,87 @@ def help():
     return
 
 
+# This function safely creates several directories and their parent
+# directories if they don't exist.
+#
+# First, all missing directories are found (parent directories that are
+# known to be missing are not listed).  Then missing directories are
+# created one level at a time, with directories at the same level made
+# in parallel threads.
+#
+# Return value is 0 for success, 1 for error.
+
+def mkdirs(dirs, verbose, max_parallel):
+
+    # Find missing directories.
+
+    missing = set()
+    for dir in dirs:
+        while len(dir) > 1 and dir[-1] == '/':
+            dir = dir[:-1]
+        while dir != '/' and dir not in missing:
+            if os.path.dirname(dir) not in missing and existdir(dir, verbose):
+                if verbose:
+                    print('Directory %s already exists.' % dir)
+                break
+            if verbose:
+                print('Directory %s doesn\'t exist.' % dir)
+            missing.add(dir)
+            dir = os.path.dirname(dir)
+
+    # Group missing directories by depth.
+
+    levels = {}
+    for dir in missing:
+        depth = dir.count('/')
+        if depth not in levels:
+            levels[depth] = []
+        levels[depth].append(dir)
+
+    # Make directories, one level at a time.
+
+    failed = []
+    for depth in sorted(levels.keys()):
+        todo = sorted(levels[depth])
+        while len(todo) > 0:
+            threads = []
+            for dir in todo[:max_parallel]:
+                thread = threading.Thread(target=makedir, args=(dir, verbose, failed))
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            del todo[:max_parallel]
+        if len(failed) > 0:
+            return 1
+
+    # Done (success).
+
+    return 0
+
+
+# Make one directory (parent directory must exist) using an "ifdh mkdir"
+# subprocess.  This function is called from parallel threads, so it
+# doesn't use the ifdh python binding.
+# Append the directory to list failed in case of error.
+
+def makedir(dir, verbose, failed):
+    if verbose:
+        print('Making directory %s' % dir)
+    try:
+        rc = subprocess.call(['ifdh', 'mkdir', dir])
+    except OSError:
+        rc = 1
+    if rc != 0:
+        print('Error from ifdh mkdir for directory %s.' % dir)
+        failed.append(dir)
+
+
 # This function safely creates the specified directory and parent directories
 # if they don't exist.  It is not an error if the specified directory already
 # exists.
+#
+# Return value is 0 for success, 1 for error.
 
 def mkdir(dir, verbose):
 
@@ -111,7 +205,7 @@ def mkdir(dir, verbose):
     if dir == '/':
         if verbose:
             print('mkdir asked to make directory \'/\'.')
-        return
+        return 0
 
     # Test whether target directory already exists.
 
@@ -122,7 +216,7 @@ def mkdir(dir, verbose):
 
         if verbose:
             print('Directory %s already exists.' % dir)
-        return
+        return 0
 
     else:
 
@@ -134,10 +228,12 @@ def mkdir(dir, verbose):
         # Make sure that the parent directory exists by calling this function recursively.
 
         parent = os.path.dirname(dir)
-        mkdir(parent, verbose)
+        rc = mkdir(parent, verbose)
+        if rc != 0:
+            return rc
 
         # Make the directory.
-        # Catch errors and exit with error status in that case.
+        # Catch errors and return error status in that case.
 
         ok = False
         try:
@@ -149,11 +245,11 @@ def mkdir(dir, verbose):
             print('Caught exception from Ifdh.mkdir for directory %s.' % dir)
             ok = False
         if not ok:
-            sys.exit(1)
+            return 1
 
         # Done (success).
 
-        return
+        return 0
 
 
 # This function tests whether the specified directory exists.
@@ -175,32 +271,38 @@ def existdir(dir, verbose):
     # Note that ifdh may print out various alarming but harmless
     # message at this point.
 
+    # Parent directory listings are cached, so that each parent directory
+    # is listed at most once.
+
     parent = os.path.dirname(dir)
     base = os.path.basename(dir)
-    contents = []
-    try:
-        contents = Ifdh.ls(parent, 1)
-    except:
+    subdirs = listings.get(parent)
+    if subdirs == None:
         contents = []
+        try:
+            contents = Ifdh.ls(parent, 1)
+        except:
+            contents = []
 
-    # Loop over parent directory contents.
-    # Only compare the base part of the path, since the mountpoint may differ.
+        # Loop over parent directory contents.
+        # Only compare the base part of the path, since the mountpoint may differ.
 
-    for content in contents:
+        subdirs = set()
+        for content in contents:
 
-        # Is this a directory (ifdh signals by adding '/' at end)?
+            # Is this a directory (ifdh signals by adding '/' at end)?
 
-        if len(content) > 1 and content[-1] == '/':
+            if len(content) > 1 and content[-1] == '/':
+                subdirs.add(os.path.basename(content[:-1]))
 
-            # Does base match?
+        # Don't cache failed or empty listings.
 
-            if os.path.basename(content[:-1]) == base:
-                return True
+        if len(subdirs) > 0:
+            listings[parent] = subdirs
 
-    # If we fall out of the loopp, that means we didn't find this directory 
-    # in the parent directory.
+    # Does base match?
 
-    return False
+    return base in subdirs
 
 # Command line.
 
@@ -582,6 +582,7 @@ def addLayerTwo(path, recreate=True):
         rc = q.get()
         jobout = convert_str(q.get())
         joberr = convert_str(q.get())
+        larbatch_posix.invalidate_cache(path)
         if rc != 0:
             for var in list(save_vars.keys()):
                 os.environ[var] = save_vars[var]
@@ -6,6 +6,7 @@ from __future__ import print_function
 # Import stuff.
 
 import sys, os, subprocess, json, stream
+import mmap, zlib, multiprocessing
 import larbatch_posix
 import larbatch_utilities
 from larbatch_utilities import convert_str
@@ -28,6 +29,11 @@ sys.argv = myargv
 import warnings
 warnings.filterwarnings('ignore', category = RuntimeWarning, message = 'creating converter.*')
 
+# Checksum settings.
+
+checksum_max_parallel = 4               # Number of files checksummed at the same time.
+checksum_block_size = 64 * 1024 * 1024  # Block size for checksumming mapped files.
+
 # Convert adler32-1 (used by dcache) to adler32-0 (used by sam).
 
 def convert_1_adler32_to_0_adler32(crc, filesize):
@@ -60,6 +66,167 @@ def enstoreChecksum(fileobj):
         crc  = (crc & 0x7FFFFFFF) | 0x80000000
     return { "crc_value" : str(crc), "crc_type" : "adler 32 crc type" }
 
+def enstoreCrc(crc):
+    """Convert adler32 value to enstore compatible CRC dictionary"""
+    crc = int(crc)
+    if crc < 0:
+        # Return 32 bit unsigned value
+        crc  = (crc & 0x7FFFFFFF) | 0x80000000
+    return { "crc_value" : str(crc), "crc_type" : "adler 32 crc type" }
+
+def mmapEnstoreChecksum(path):
+    """Calculate enstore compatible CRC value of a local file using mmap.
+    The file is checksummed directly from the page cache, without copying
+    it through python read buffers."""
+
+    f = open(path, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return enstoreCrc(0)
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            crc = 0
+            view = memoryview(m)
+            try:
+                for offset in range(0, size, checksum_block_size):
+                    crc = zlib.adler32(view[offset:offset+checksum_block_size], crc)
+            finally:
+                view.release()
+        finally:
+            m.close()
+    finally:
+        f.close()
+    return enstoreCrc(crc)
+
+def localEnstoreChecksum(path):
+    """Calculate enstore compatible CRC value of a non-dCache file"""
+
+    # Use mmap if possible (e.g. not for python 2, where memoryview doesn't
+    # support mmap), otherwise read the file in blocks.
+
+    try:
+        return mmapEnstoreChecksum(path)
+    except (IOError, OSError, TypeError, ValueError, AttributeError):
+        pass
+    f = larbatch_posix.open(path,'rb')
+    try:
+        crc = enstoreChecksum(f)
+    finally:
+        f.close()
+    return crc
+
+def poolEnstoreChecksum(path):
+    """Process pool worker.  Return CRC value, or None if error."""
+    try:
+        return localEnstoreChecksum(path)
+    except:
+        return None
+
+def srmDirChecksums(dir):
+    """Get dCache stored checksums of all files in a directory using a single
+    srmls command.  Return value is a dictionary {file name: crc}."""
+
+    result = {}
+    cmd = ['srmls', '-2', '-l', project_utilities.path_to_srm_url(dir)]
+    srmout = convert_str(subprocess.check_output(cmd))
+
+    # Each entry starts with a line containing size and path, followed by
+    # detail lines, including the checksum.  The directory itself is listed
+    # first (path ending in '/').
+
+    name = ''
+    size = 0
+    for line in srmout.split('\n'):
+        words = line.split()
+        if len(words) == 2 and words[0].isdigit() and words[1].startswith('/'):
+            size = int(words[0])
+            name = ''
+            if not words[1].endswith('/'):
+                name = os.path.basename(words[1])
+        elif name != '' and line.find("Checksum value:") > 0:
+            ssum = line[line.find(':') + 2:].strip()
+            crc1 = int( ssum , base = 16 )
+            crc0 = convert_1_adler32_to_0_adler32(crc1, size)
+            result[name] = {"crc_value": str(crc0), "crc_type": "adler 32 crc type"}
+            name = ''
+    return result
+
+def fileEnstoreChecksums(paths, max_parallel=0):
+    """Calculate enstore compatible CRC values of many files.
+
+    Stored checksums of dCache files are fetched using one srmls command per
+    directory (directories in parallel).  Local files are checksummed in a
+    process pool.  Files that aren't covered by a directory listing are
+    checksummed individually (see fileEnstoreChecksum).
+
+    Return value is a dictionary {path: crc}.  Files whose checksum could
+    not be calculated are omitted."""
+
+    if max_parallel <= 0:
+        max_parallel = checksum_max_parallel
+    result = {}
+    local = []
+    local_set = set()
+    dirs = {}
+    for path in paths:
+        if project_utilities.path_to_srm_url(path) == path:
+            if path not in local_set:
+                local.append(path)
+                local_set.add(path)
+        else:
+            dir = os.path.dirname(path)
+            if dir not in dirs:
+                dirs[dir] = []
+            dirs[dir].append(path)
+
+    # dCache files, one directory listing at a time.
+
+    if len(dirs) > 0:
+        project_utilities.test_proxy()
+        dirlist = sorted(dirs.keys())
+        results = larbatch_utilities.parallel_call(srmDirChecksums,
+                                                   [(dir,) for dir in dirlist],
+                                                   max_parallel)
+        others = []
+        others_set = set()
+        for dir, (sums, error) in zip(dirlist, results):
+            for path in dirs[dir]:
+                name = os.path.basename(path)
+                if error == None and name in sums:
+                    result[path] = sums[name]
+                elif path not in others_set:
+                    others.append(path)
+                    others_set.add(path)
+        if len(others) > 0:
+            results = larbatch_utilities.parallel_call(fileEnstoreChecksum,
+                                                       [(path,) for path in others],
+                                                       max_parallel)
+            for path, (crc, error) in zip(others, results):
+                if error == None:
+                    result[path] = crc
+
+    # Local files, in a process pool.
+
+    crcs = []
+    if len(local) > 1 and max_parallel > 1:
+        try:
+            pool = multiprocessing.Pool(min(max_parallel, len(local)))
+            try:
+                crcs = pool.map(poolEnstoreChecksum, local)
+            finally:
+                pool.close()
+                pool.join()
+        except:
+            crcs = []
+    if len(crcs) != len(local):
+        crcs = [poolEnstoreChecksum(path) for path in local]
+    for path, crc in zip(local, crcs):
+        if crc != None:
+            result[path] = crc
+
+    return result
+
 def fileEnstoreChecksum(path):
     """Calculate enstore compatible CRC value"""
 
@@ -68,12 +235,9 @@ def fileEnstoreChecksum(path):
 
     if srm_url == path:
         try:
-            f = larbatch_posix.open(path,'rb')
-            crc = enstoreChecksum(f)
+            crc = localEnstoreChecksum(path)
         except (IOError, OSError) as ex:
             raise Error(str(ex))
-        finally:
-            f.close()
     else:
         try:
             # Following commented commands are old way of calculating checksum by
@@ -0,0 +1,262 @@
+#! /usr/bin/env python
+######################################################################
+#
+# Name: stagedb.py
+#
+# Purpose: Python class StageDB (used by project.py script).
+#          This class manages an optional sqlite bookkeeping database
+#          for one project stage.  The database is stored in the stage
+#          bookkeeping directory (file stage.db), alongside the flat
+#          bookkeeping files (files.list, events.list, etc.), and holds
+#          the same information in indexed form.
+#
+#          The database is written by project.py --check (and
+#          --checkana) in a single transaction when option --bookdb is
+#          specified, and is read by status queries, sam declaration
+#          and location checks, and merging, in preference to the flat
+#          bookkeeping files.
+#
+#          Tables:
+#
+#          files     - Good output files (art and non-art), with name,
+#                      full path, directory (disk location), worker
+#                      subdirectory, process number, kind ('art' or
+#                      'ana'), stream, number of events, and sam
+#                      declaration state.
+#          processes - Worker subdirectories, with process number and
+#                      status ('good' or 'bad').
+#          missing   - Unprocessed input files.
+#          uris      - Input files processed successfully.
+#          info      - Key-value pairs (schema version).
+#
+#          Since sqlite does not work reliably on network file systems,
+#          the database is always created in a local temporary file and
+#          copied to the bookkeeping directory when it is published.
+#          Databases in dCache are copied to a local temporary file to
+#          be read.
+#
+# Created: 18-Oct-2026
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os, tempfile, sqlite3
+import larbatch_posix
+
+# Stage database class.
+
+class StageDB:
+
+    # Schema version.
+
+    version = 1
+
+    # Constructor.
+
+    def __init__(self, bookdir):
+
+        self.bookdir = bookdir                            # Bookkeeping directory.
+        self.path = os.path.join(bookdir, 'stage.db')     # Database path.
+        self.local = ''                                   # Local database path.
+        self.temp = False                                 # Is local path a temporary file?
+        self.conn = None                                  # Sqlite connection.
+
+    # Test whether database exists.
+
+    def exists(self):
+        return larbatch_posix.exists(self.path)
+
+    # Delete database (e.g. because it is stale).
+
+    def remove(self):
+        self.close()
+        if larbatch_posix.exists(self.path):
+            larbatch_posix.remove(self.path)
+
+    # Make a local temporary file for the database.
+
+    def make_temp(self):
+        fd, self.local = tempfile.mkstemp(prefix='stagedb_', suffix='.db')
+        os.close(fd)
+        self.temp = True
+
+    # Create a new, empty database in a local temporary file.
+    # The database is not visible in the bookkeeping directory until published.
+
+    def create(self):
+
+        self.close()
+        self.make_temp()
+        self.conn = sqlite3.connect(self.local)
+        c = self.conn.cursor()
+        c.execute('create table info (key text primary key, value text)')
+        c.execute('create table files (name text, path text, dir text, subdir text, '
+                  'process integer, kind text, stream text, events integer, '
+                  'declared integer default 0)')
+        c.execute('create table processes (subdir text primary key, process integer, '
+                  'status text)')
+        c.execute('create table missing (path text)')
+        c.execute('create table uris (uri text)')
+        c.execute('create index files_name on files(name)')
+        c.execute('create index files_process on files(process)')
+        c.execute('create index files_kind on files(kind, stream)')
+        c.execute('create index processes_process on processes(process)')
+        c.execute('insert into info values (?, ?)', ('version', str(StageDB.version)))
+
+    # Open existing database.
+    # Return True if successful, False if database doesn't exist or can't be
+    # read (in which case callers should fall back to flat bookkeeping files).
+
+    def open(self):
+
+        self.close()
+        if not self.exists():
+            return False
+        try:
+            if self.path[0:6] == '/pnfs/' or larbatch_posix.get_backend(self.path) != None:
+                self.make_temp()
+                os.remove(self.local)
+                larbatch_posix.copy(self.path, self.local)
+            else:
+                self.local = self.path
+            self.conn = sqlite3.connect(self.local)
+            rows = self.conn.execute('select value from info where key=?',
+                                     ('version',)).fetchall()
+            if len(rows) == 0 or rows[0][0] != str(StageDB.version):
+                self.close()
+                return False
+        except:
+            self.close()
+            return False
+        return True
+
+    # Commit changes and add database to a batch of bookkeeping files
+    # (argument writer is a BookkeepingWriter object for the bookkeeping
+    # directory).  The database must not be closed until the batch is
+    # committed.
+
+    def publish(self, writer):
+
+        self.conn.commit()
+        if self.local != self.path:
+            writer.add('stage.db', self.local)
+
+    # Close database, and delete local temporary file, if any.
+
+    def close(self):
+
+        if self.conn != None:
+            self.conn.close()
+            self.conn = None
+        if self.temp and os.path.exists(self.local):
+            os.remove(self.local)
+        self.local = ''
+        self.temp = False
+
+    # Add worker subdirectory.
+
+    def add_process(self, subdir, good):
+
+        process = None
+        subdir_split = subdir.split('_')
+        if len(subdir_split) > 1 and subdir_split[1].isdigit():
+            process = int(subdir_split[1])
+        status = 'bad'
+        if good:
+            status = 'good'
+        self.conn.execute('insert or replace into processes values (?, ?, ?)',
+                          (subdir, process, status))
+        return process
+
+    # Add good output file.
+    # Argument kind should be 'art' or 'ana'.
+
+    def add_file(self, path, subdir, process, kind, events=0, stream=''):
+        self.conn.execute('insert into files (name, path, dir, subdir, process, kind, '
+                          'stream, events) values (?, ?, ?, ?, ?, ?, ?, ?)',
+                          (os.path.basename(path), path, os.path.dirname(path),
+                           subdir, process, kind, stream, events))
+
+    # Add missing input file.
+
+    def add_missing(self, path):
+        self.conn.execute('insert into missing values (?)', (path,))
+
+    # Add processed input file.
+
+    def add_uri(self, uri):
+        self.conn.execute('insert into uris values (?)', (uri,))
+
+    # Return counts of good art files, good events, good non-art files,
+    # bad workers, and missing input files, as a 5-tuple.
+
+    def counts(self):
+
+        c = self.conn.cursor()
+        nfile, nev = c.execute('select count(*), sum(events) from files '
+                               'where kind=?', ('art',)).fetchone()
+        nana = c.execute('select count(*) from files where kind=?',
+                         ('ana',)).fetchone()[0]
+        nerror = c.execute('select count(*) from processes where status=?',
+                           ('bad',)).fetchone()[0]
+        nmiss = c.execute('select count(*) from missing').fetchone()[0]
+        if nev == None:
+            nev = 0
+        return nfile, nev, nana, nerror, nmiss
+
+    # Return list of good file paths of the specified kind ('art' or 'ana'),
+    # optionally restricted to one stream, in bookkeeping order.
+
+    def files(self, kind='art', stream=None):
+
+        if stream == None:
+            rows = self.conn.execute('select path from files where kind=? order by rowid',
+                                     (kind,))
+        else:
+            rows = self.conn.execute('select path from files where kind=? and stream=? '
+                                     'order by rowid', (kind, stream))
+        return [row[0] for row in rows]
+
+    # Return set of paths of files of the specified kind that are known to
+    # be declared to sam.
+
+    def declared_files(self, kind='art'):
+        rows = self.conn.execute('select path from files where kind=? and declared=1',
+                                 (kind,))
+        return set([row[0] for row in rows])
+
+    # Record that files (specified as a list of paths) are declared to sam.
+
+    def set_declared(self, paths):
+        self.conn.executemany('update files set declared=1 where path=?',
+                              [(path,) for path in paths])
+
+    # Return disk locations (directories) of the specified file names, as a
+    # dictionary {name: [dir, ...]}.  Names that are not in the database
+    # are not included in the result.
+
+    def locations(self, names):
+
+        result = {}
+        c = self.conn.cursor()
+        for name in names:
+            for row in c.execute('select dir from files where name=?', (name,)):
+                if name not in result:
+                    result[name] = []
+                if row[0] not in result[name]:
+                    result[name].append(row[0])
+        return result
+
+    # Return list of bad worker subdirectories.
+
+    def bad_subdirs(self):
+        rows = self.conn.execute('select subdir from processes where status=? '
+                                 'order by rowid', ('bad',))
+        return [row[0] for row in rows]
+
+    # Return list of missing input files.
+
+    def missing_files(self):
+        rows = self.conn.execute('select path from missing order by rowid')
+        return [row[0] for row in rows]
@@ -1732,14 +1732,12 @@ class StageDef:
     # Make output, log, work, and bookkeeping directory, if they don't exist.
 
     def makedirs(self):
-        if not larbatch_posix.exists(self.outdir):
-            larbatch_posix.makedirs(self.outdir)
-        if self.logdir != self.outdir and not larbatch_posix.exists(self.logdir):
-            larbatch_posix.makedirs(self.logdir)
-        if not larbatch_posix.exists(self.workdir):
-            larbatch_posix.makedirs(self.workdir)
-        if self.bookdir != self.logdir and not larbatch_posix.exists(self.bookdir):
-            larbatch_posix.makedirs(self.bookdir)
+
+        # Make all directories at once, so that existence checks can be
+        # answered by a few listings, and independent directories can be
+        # made in parallel.
+
+        larbatch_posix.makedirs_tree([self.outdir, self.logdir, self.workdir, self.bookdir])
 
         # If output is on dcache, make output directory group-writable.
 
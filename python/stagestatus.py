@@ -15,6 +15,8 @@ from __future__ import print_function
 import os
 import project_utilities
 import larbatch_posix
+from project_modules.stagedb import StageDB
+from project_modules.bookkeepingwriter import BookkeepingWriter
 
 # Project status class.
 
@@ -44,6 +46,10 @@ class StageStatus:
 
         bookdir = self.stage.bookdir
 
+        # Discard any cached directory listings, so that we see current contents.
+
+        larbatch_posix.invalidate_cache(bookdir, recursive=True)
+
         # Test whether output directory exists.
 
         if larbatch_posix.exists(bookdir):
@@ -57,12 +63,25 @@ class StageStatus:
             self.nerror = 0
             self.nmiss = 0
 
+            # If this stage has a bookkeeping database, get counts from there.
+
+            db = StageDB(bookdir)
+            if db.open():
+                self.nfile, self.nev, self.nana, self.nerror, self.nmiss = db.counts()
+                db.close()
+                return
+
+            # Read bookkeeping files of the last check (all from the same check).
+
+            lists = BookkeepingWriter.read_batch(bookdir, ['events.list', 'filesana.list',
+                                                           'bad.list', 'missing_files.list'])
+            if lists == None:
+                return
+
             # Count good files and events.
 
-            eventsfile = os.path.join(bookdir, 'events.list')
-            if larbatch_posix.exists(eventsfile):
-                lines = larbatch_posix.readlines(eventsfile)
-                for line in lines:
+            if lists['events.list'] != None:
+                for line in lists['events.list']:
                     words = line.split()
                     if len(words) >= 2:
                         self.nfile = self.nfile + 1
@@ -70,27 +89,21 @@ class StageStatus:
 
             # Count good files analysis root files.
 
-            filesana = os.path.join(bookdir, 'filesana.list')
-            if larbatch_posix.exists(filesana):
-                lines = larbatch_posix.readlines(filesana)
-                for line in lines:
+            if lists['filesana.list'] != None:
+                for line in lists['filesana.list']:
                     self.nana = self.nana + 1
 
             # Count errors.
 
-            badfile = os.path.join(bookdir, 'bad.list')
-            if larbatch_posix.exists(badfile):
-                lines = larbatch_posix.readlines(badfile)
-                for line in lines:
+            if lists['bad.list'] != None:
+                for line in lists['bad.list']:
                     if line.strip():
                         self.nerror += 1
 
             # Count missing files.
 
-            missingfile = os.path.join(bookdir, 'missing_files.list')
-            if larbatch_posix.exists(missingfile):
-                lines = larbatch_posix.readlines(missingfile)
-                for line in lines:
+            if lists['missing_files.list'] != None:
+                for line in lists['missing_files.list']:
                     if line.strip():
                         self.nmiss += 1
 
@@ -0,0 +1,285 @@
+#! /usr/bin/env python
+######################################################################
+#
+# Name: stagewatch.py
+#
+# Purpose: Python class StageWatch (used by project.py script).
+#          This class contains the check state of one project stage in
+#          continuous check mode (project.py --watch).
+#
+#          The state consists of the saved check results of each worker
+#          (leaf) subdirectory (same format as the check manifest, or the
+#          result of quickcheck_subdir for quick check stages), in
+#          subdirectory order (function subdir_key), so that results are
+#          combined in the same order as in a full check, regardless of
+#          the order in which subdirectories arrived.  To keep the memory
+#          footprint bounded for large stages, check results are kept in
+#          a local on-disk store (module shelve), and are read on demand.
+#          Only the list of known subdirectories, a listing signature of
+#          each failed subdirectory, and the messages about conflicts
+#          between subdirectories (e.g. duplicate file names) of the latest
+#          check, are kept in memory.
+#
+#          Between checks, the stage directories are polled by listing
+#          the parent directories of the known worker subdirectories
+#          (the top level log and bookkeeping directories, and e.g. run
+#          directories for nested <run>/<subrun> layouts).  New entries
+#          (new arrivals) are scheduled to be checked.  Subdirectories
+#          whose previous check failed are scheduled to be checked again
+#          only if the listing of the subdirectory (log, bookkeeping, or
+#          output) has changed.
+#
+#          Directory listings are compared instead of modification times
+#          (which are not available when dCache is accessed using ifdh),
+#          or inotify, so that polling works the same way for local disks
+#          and for dCache.
+#
+# Created: 18-Oct-2026
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os, json, hashlib, shelve, shutil, tempfile
+import larbatch_posix
+from larbatch_utilities import convert_bytes
+
+# Sort key of worker subdirectories (relative paths).  Paths are compared
+# component by component, which is the order of a sorted directory walk.
+
+def subdir_key(subdir):
+    return subdir.split('/')
+
+# Stage watch class.
+
+class StageWatch:
+
+    # Constructor.
+
+    def __init__(self, stage):
+
+        self.stage = stage             # Stage object.
+        self.initialized = False       # Has first (full) check been done?
+        self.subdirs = []              # Known subdirectories, in subdirectory order.
+        self.known = set()             # Set of known subdirectories.
+        self.parents = set([''])       # Parent directories of known subdirectories.
+        self.failed = {}               # failed[subdir] = listing signature of failed subdirectory.
+        self.conflicts = {}            # conflicts[subdir] = conflict messages of latest check.
+        self.store_dir = ''            # Directory of local check result store.
+        self.store = None              # store[subdir] = check manifest entry.
+        self.ignored = set()           # Paths of files in stage directories.
+        self.pending = set()           # Subdirectories (or new parents) to check.
+        self.dirty = False             # Have subdirectories been removed?
+        self.rc = 0                    # Status of latest check.
+        self.nfile = 0                 # Number of good files after latest check.
+        self.nfile_done = 0            # Number of good files at latest follow-on actions.
+
+    # Close and delete local check result store.
+
+    def close(self):
+
+        if self.store != None:
+            self.store.close()
+            self.store = None
+        if self.store_dir != '':
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+            self.store_dir = ''
+
+    # Return list of directories that are watched.
+
+    def dirs(self):
+
+        result = []
+        for dir in (self.stage.logdir, self.stage.bookdir, self.stage.outdir):
+            if dir != '' and not dir in result:
+                result.append(dir)
+        return result
+
+    # Poll stage directories.
+    # Return True if stage needs to be checked.
+
+    def poll(self):
+
+        # Discard cached listings, so that we see current contents (and so
+        # that the listing cache doesn't grow from one check to the next).
+
+        for dir in self.dirs():
+            larbatch_posix.invalidate_cache(dir, recursive=True)
+        if not self.initialized:
+            return True
+        self.scan()
+
+        # Recheck failed subdirectories whose listing has changed.
+
+        for subdir in list(self.failed.keys()):
+            if not subdir in self.pending and self.signature(subdir) != self.failed[subdir]:
+                self.pending.add(subdir)
+        return len(self.pending) > 0 or self.dirty
+
+    # List a directory (relative path) in the log and bookkeeping directories.
+    # Return value is a set of names, or None if the directory couldn't be listed.
+
+    def list_parent(self, parent):
+
+        result = set()
+        listed = False
+        for dir in (self.stage.logdir, self.stage.bookdir):
+            path = os.path.join(dir, parent)
+            try:
+                if larbatch_posix.isdir(path):
+                    result.update(larbatch_posix.listdir(path))
+                listed = True
+            except:
+                pass
+        if not listed:
+            return None
+        return result
+
+    # Scan parent directories of known subdirectories for new and removed
+    # subdirectories.
+
+    def scan(self):
+
+        listings = {}
+        for parent in sorted(self.parents):
+            names = self.list_parent(parent)
+            listings[parent] = names
+            if names == None:
+                continue
+            for name in sorted(names):
+                path = os.path.join(parent, name)
+                if path in self.known or path in self.parents or path in self.ignored or \
+                   path in self.pending:
+                    continue
+                if larbatch_posix.isdir(os.path.join(self.stage.bookdir, path)) or \
+                   larbatch_posix.isdir(os.path.join(self.stage.logdir, path)):
+                    self.pending.add(path)
+                else:
+                    self.ignored.add(path)
+
+        # Forget subdirectories that no longer exist.  Parents that couldn't
+        # be listed are assumed to be unchanged.
+
+        removed = []
+        for subdir in self.subdirs:
+            path = subdir
+            while path != '':
+                parent = os.path.dirname(path)
+                names = listings.get(parent)
+                if names != None and not os.path.basename(path) in names:
+                    removed.append(subdir)
+                    break
+                path = parent
+        if len(removed) > 0:
+            for subdir in removed:
+                self.known.discard(subdir)
+                self.failed.pop(subdir, None)
+                self.conflicts.pop(subdir, None)
+                if subdir in self.store:
+                    del self.store[subdir]
+            self.subdirs = [subdir for subdir in self.subdirs if subdir in self.known]
+            self.parents = set([''])
+            for subdir in self.subdirs:
+                self.add_parents(subdir)
+            self.dirty = True
+        self.pending = set([path for path in self.pending
+                            if listings.get(os.path.dirname(path)) == None or
+                            os.path.basename(path) in listings[os.path.dirname(path)]])
+
+    # Add parent directories of a subdirectory to set parents.
+
+    def add_parents(self, subdir):
+
+        parent = os.path.dirname(subdir)
+        while parent != '' and not parent in self.parents:
+            self.parents.add(parent)
+            parent = os.path.dirname(parent)
+
+    # Return listing signature of a subdirectory.  The signature is a hash
+    # of the names in the log, bookkeeping, and output subdirectories.
+
+    def signature(self, subdir):
+
+        listings = []
+        for dir in self.dirs():
+            path = os.path.join(dir, subdir)
+            try:
+                if larbatch_posix.isdir(path):
+                    listings.append(sorted(larbatch_posix.listdir(path)))
+                else:
+                    listings.append(None)
+            except:
+                listings.append(None)
+        return hashlib.md5(convert_bytes(json.dumps(listings))).hexdigest()
+
+    # Test whether a check result is a failure, which should be checked
+    # again if the subdirectory changes.
+    # Full checks fail for subdirectories that were bad or incomplete
+    # (kind 'other', except for sam stop project jobs and the "log"
+    # directory).  Quick checks fail for subdirectories with errors.
+
+    def is_failed(self, subdir, result):
+
+        if 'nerrors' in result:
+            return result['nerrors'] > 0
+        return result['bad'] or (result['kind'] == 'other' and subdir[-5:] != '_stop' and
+                                 subdir != 'log')
+
+    # Update check results.
+    # Argument manifest is a dictionary {subdir: check manifest entry}.
+    # Argument order is the list of subdirectories in manifest, in order.
+
+    def update(self, manifest, order):
+
+        if self.store == None:
+            self.store_dir = tempfile.mkdtemp(prefix='stagewatch_')
+            self.store = shelve.open(os.path.join(self.store_dir, 'results'))
+        nknown = len(self.subdirs)
+        for subdir in order:
+            if not subdir in self.known:
+                self.subdirs.append(subdir)
+                self.known.add(subdir)
+                self.add_parents(subdir)
+            entry = manifest[subdir]
+            self.store[subdir] = entry
+            if self.is_failed(subdir, entry['result']):
+                self.failed[subdir] = self.signature(subdir)
+            else:
+                self.failed.pop(subdir, None)
+        if len(self.subdirs) > nknown:
+            self.subdirs.sort(key=subdir_key)
+
+    # Return saved check manifest entries of the specified subdirectories,
+    # as a dictionary {subdir: check manifest entry}.
+
+    def entries(self, subdirs):
+
+        result = {}
+        if self.store != None:
+            for subdir in subdirs:
+                if subdir in self.store:
+                    result[subdir] = self.store[subdir]
+        return result
+
+    # Generate (subdir, check manifest entry) of all known subdirectories,
+    # in subdirectory order.
+
+    def items(self):
+        for subdir in self.subdirs:
+            yield subdir, self.store[subdir]
+
+    # Generate check results of all known subdirectories, in subdirectory order.
+
+    def result_list(self):
+        for subdir in self.subdirs:
+            yield self.store[subdir]['result']
+
+    # Mark check as done.
+
+    def done(self, rc, nfile):
+
+        self.initialized = True
+        self.pending = set()
+        self.dirty = False
+        self.rc = rc
+        self.nfile = nfile
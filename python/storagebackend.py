@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+######################################################################
+#
+# Name: storagebackend.py
+#
+# Purpose: Python class StorageBackend.  This class defines the interface
+#          of storage backends that can be registered with module
+#          larbatch_posix (see larbatch_posix.register_backend).  Once
+#          registered for a path prefix, a backend handles all
+#          larbatch_posix calls for paths that start with that prefix,
+#          in place of the built-in posix and ifdh methods.
+#
+#          Backends should inherit from this class and override the
+#          following methods.  Methods that are not overridden raise
+#          NotImplementedError.  Methods should raise OSError (or
+#          IFDHError) if the operation fails.
+#
+#          listdir(path)        - Return contents of a directory as a
+#                                 list of 2-tuples (name, isdir).
+#          stat(path)           - Return os.stat_result (at least mode
+#                                 and size should be filled).
+#          open(path, mode, buf) - Return a file-like object.
+#          copy(src, dest)      - Copy file (both paths in this backend).
+#          remove(path)         - Delete file.
+#          rename(src, dest)    - Rename file or directory.
+#          mkdir(path, mode)    - Make directory (parent must exist).
+#          rmdir(path)          - Delete empty directory.
+#          chmod(path, mode)    - Change mode.
+#          symlink(src, dest)   - Make symbolic link dest pointing to src.
+#
+# Created: 18-Oct-2026
+#
+######################################################################
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+# Storage backend interface class.
+
+class StorageBackend:
+
+    # Constructor.
+
+    def __init__(self):
+        self.name = self.__class__.__name__
+
+    # Raise exception for unsupported operation.
+
+    def unsupported(self, op):
+        raise NotImplementedError('Operation %s is not supported by %s.' % (op, self.name))
+
+    # List directory.
+
+    def listdir(self, path):
+        self.unsupported('listdir')
+
+    # File status.
+
+    def stat(self, path):
+        self.unsupported('stat')
+
+    # Open file.
+
+    def open(self, path, mode='r', buf=-1):
+        self.unsupported('open')
+
+    # Copy file.
+
+    def copy(self, src, dest):
+        self.unsupported('copy')
+
+    # Delete file.
+
+    def remove(self, path):
+        self.unsupported('remove')
+
+    # Rename file or directory.
+
+    def rename(self, src, dest):
+        self.unsupported('rename')
+
+    # Make directory.
+
+    def mkdir(self, path, mode=0o777):
+        self.unsupported('mkdir')
+
+    # Delete empty directory.
+
+    def rmdir(self, path):
+        self.unsupported('rmdir')
+
+    # Change mode.
+
+    def chmod(self, path, mode):
+        self.unsupported('chmod')
+
+    # Make symbolic link.
+
+    def symlink(self, src, dest):
+        self.unsupported('symlink')
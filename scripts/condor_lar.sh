@@ -200,6 +200,10 @@
 #
 #------------------------------------------------------------------
 
+# Record job start time (for job summary).
+
+JOB_START_TIME=`date +%s`
+
 # Parse arguments.
 
 FCL=""
@@ -1992,6 +1996,21 @@ if [ $VALIDATE_IN_JOB -eq 1 ]; then
 
 fi
 
+# Make a consolidated job summary (job_summary.json) in the log directory.
+# Helper script job_summary.py was moved into the log directory above.
+
+if [ -f log/job_summary.py ]; then
+  sumopt="--nstages $nfcls --start_time $JOB_START_TIME"
+  if [ $VALIDATE_IN_JOB -eq 1 ]; then
+    sumopt="$sumopt --validate_status $valstat"
+  fi
+  for ftype in ${DATAFILETYPES[*]}; do
+    sumopt="$sumopt --data_file_type $ftype"
+  done
+  echo "./log/job_summary.py --outdir out --logdir log $sumopt"
+  ./log/job_summary.py --outdir out --logdir log $sumopt
+fi
+
 # Make a tarball of the log directory contents, and save the tarball in the log directory.
 
 rm -f log.tar
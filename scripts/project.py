@@ -21,6 +21,8 @@
 # --tmpdir <tempdir>  - Override TMPDIR internally.  If TMPDIR is set
 #                       use ifdh cp instead of xrootd for accessing
 #                       content of root files in dCache.
+# --metrics           - Collect call counts and latencies of file and ifdh
+#                       operations, and print a summary at exit.
 #
 # XML stage configuration overrides.  Note that most of these options, except --inputdef,
 # are passed directly to jobsub_submit.  Refer to jobsub_submit documentation for
@@ -50,6 +52,27 @@
 #                Also forces a new snapshot in case of input from sam.
 # --check      - Check results for specified stage and print message.
 # --checkana   - Check analysis results for specified stage and print message.
+# --recheck   - Used in conjunction with --check or --checkana, ignore check
+#               results saved by previous checks (check_manifest.json), and
+#               check all worker subdirectories.
+# --jobs <n>  - Used in conjunction with --check or --checkana, check up to
+#               <n> worker subdirectories in parallel (default 1).
+# --bookdb    - Used in conjunction with --check or --checkana, also save
+#               bookkeeping information in an sqlite database (stage.db).
+# --noextract - Used in conjunction with --check or --checkana, don't extract
+#               log tarballs into the log directory.  Instead, make an index
+#               of each tarball (log*.tar.index), and read log files from
+#               tarballs as needed.
+# --watch     - Continuous check mode.  Check the specified stage(s) (as
+#               --check, or --checkana if specified), then keep polling the
+#               log directory and check new worker subdirectories as they
+#               arrive, until interrupted (SIGINT or SIGTERM).  May be
+#               combined with --declare, --add_locations, and --define,
+#               which are then run on batches of new good files.
+# --watch_interval <sec> - Used in conjunction with --watch, seconds between
+#               polls (default 300).
+# --watch_batch <n> - Used in conjunction with --watch, number of new good
+#               files that triggers follow-on actions (default 100).
 # --shorten    - Shorten root filenames to have fewer than than 200 characters.
 # --fetchlog   - Fetch jobsub logfiles (jobsub_fetchlog).
 # --mergehist  - merge histogram files using hadd -T
@@ -411,6 +434,9 @@
 # of project jobs.  These bookkeeping files are stored in the log
 # directoroy of each project stage (XML element <logdir>).  Most of these
 # files are gnerated or updated after a "check" operation (project.py --check).
+# The files generated by --check and --checkana are published together
+# at the end of the check (copied under temporary names <file>.<id>.tmp,
+# then renamed), so that the set of files is always consistent.
 #
 # Here is a list of all bookkeeping files used by project.py:
 #
@@ -441,11 +467,22 @@
 #
 # jobids.list - A list of all submitted jobsub jobids.
 #
+# log*.tar.index - Index of a worker log tarball, stored in the process
+#                  subdirectory instead of the extracted log files
+#                  (generated by --check or --checkana with option
+#                  --noextract).
+#
+# stage.db - Optional sqlite database containing the same information as
+#            the above list files, plus sam declaration state (generated
+#            by --check or --checkana with option --bookdb).  If present,
+#            this database is used in preference to the list files.
+#
 ######################################################################
 
 from __future__ import absolute_import
 from __future__ import print_function
-import sys, os, stat, subprocess, shutil, json, getpass, uuid, tempfile, hashlib
+import sys, os, stat, subprocess, shutil, json, getpass, uuid, tempfile, hashlib, atexit
+import tarfile, fnmatch, time, signal
 try:
     import urllib.request as urlrequest
 except ImportError:
@@ -460,6 +497,12 @@ from xml.dom.minidom import parse
 import project_utilities, root_metadata
 from project_modules.projectdef import ProjectDef
 from project_modules.projectstatus import ProjectStatus
+from project_modules.stagestatus import StageStatus
+from project_modules.stagewatch import StageWatch, subdir_key
+from project_modules.stagedb import StageDB
+from project_modules.bookkeepingwriter import BookkeepingWriter
+from project_modules.logtarball import LogTarball
+from project_modules.logreader import LogReader
 from project_modules.batchstatus import BatchStatus
 from project_modules.jobsuberror import JobsubError
 from project_modules.ifdherror import IFDHError
@@ -469,6 +512,17 @@ from larbatch_utilities import convert_bytes
 import samweb_cli
 
 samweb = None           # Initialized SAMWebClient object
+recheck = False         # Ignore saved check results (--recheck)
+check_jobs = 1          # Number of subdirectories to check in parallel (--jobs)
+bookdb = False          # Save bookkeeping database (--bookdb)
+check_manifest_version = 4  # Version of check manifest format
+check_listing_suffixes = ['lar.stat', '.txt', '.json', '.list', '.index']  # Files in check listing fingerprint
+untar_members = ['lar.stat', '*.json', '*.list', '*.txt']  # Log tarball members to extract
+untar_max_parallel = 8  # Number of log tarballs to extract in parallel
+untar_index = False     # Index log tarballs instead of extracting them (--noextract)
+watch_interval = 300    # Seconds between polls in continuous check mode (--watch_interval)
+watch_batch = 100       # Good files per batch of follow-on actions (--watch_batch)
+watch_stop = False      # Stop continuous check mode (set by signal handler)
 extractor_dict = None   # Metadata extractor
 proxy_ok = False
 
@@ -810,7 +864,7 @@ def get_pubs_stage(xmlfile, projectname, stagename, run, subruns, version=None):
 # 2.  -1 if root file does not contain an Events TTree, but is otherwise valid (openable).
 # 3.  -2 for error (root file does not exist or is not openable).
 
-def check_root_file(path, logdir):
+def check_root_file(path, logdir, reader=None):
 
     global proxy_ok
     result = (-2, '')
@@ -824,13 +878,15 @@ def check_root_file(path, logdir):
 
     # See if we have precalculated metadata for this root file.
 
-    json_path = os.path.join(logdir, os.path.basename(path) + '.json')
-    if larbatch_posix.exists(json_path):
+    if reader == None:
+        reader = LogReader(logdir)
+    json_name = os.path.basename(path) + '.json'
+    if reader.exists(json_name):
 
         # Get number of events from precalculated metadata.
 
         try:
-            lines = larbatch_posix.readlines(json_path)
+            lines = reader.readlines(json_name)
             s = ''
             for line in lines:
                 s = s + line
@@ -861,12 +917,15 @@ def check_root_file(path, logdir):
 
 # Check data files in the specified directory.
 
-def check_root(outdir, logdir, data_file_types):
+def check_root(outdir, logdir, data_file_types, messages=None, reader=None):
 
     # This method looks for files with file types matching data_file_types.
     # If such files are found, it also checks for the existence of
     # an Events TTree.
     #
+    # Messages are printed, or appended to list messages, if specified.
+    # Log files (json metadata) are read using LogReader reader, if specified.
+    #
     # Returns a 3-tuple containing the following information.
     # 1.  Total number of events in art root files.
     # 2.  A list of 3-tuples with an entry for each art root file.
@@ -880,13 +939,13 @@ def check_root(outdir, logdir, data_file_types):
     roots = []
     hists = []
 
-    print('Checking root files in directory %s.' % outdir)
+    report(messages, 'Checking root files in directory %s.' % outdir)
     filenames = larbatch_posix.listdir(outdir)
     for filename in filenames:
         name, ext = os.path.splitext(filename)
         if len(ext) > 0 and ext[1:] in data_file_types:
             path = os.path.join(outdir, filename)
-            nevroot, stream = check_root_file(path, logdir)
+            nevroot, stream = check_root_file(path, logdir, reader)
             if nevroot >= 0:
                 if nev < 0:
                     nev = 0
@@ -904,7 +963,8 @@ def check_root(outdir, logdir, data_file_types):
                 # Found a .root file that is not openable.
                 # Print a warning, but don't trigger any other error.
 
-                print('Warning: File %s in directory %s is not a valid root file.' % (filename, outdir))
+                report(messages, 'Warning: File %s in directory %s is not a valid root file.' % (
+                    filename, outdir))
 
     # Done.
 
@@ -950,7 +1010,7 @@ def doshorten(stage):
 
     # Loop over .root files in outdir.
 
-    for out_subpath, subdirs, files in larbatch_posix.walk(stage.outdir):
+    for out_subpath, subdirs, files in larbatch_posix.walk(stage.outdir, ordered=False):
 
         # Only examine files in leaf directories.
 
@@ -959,6 +1019,7 @@ def doshorten(stage):
 
         subdir = os.path.relpath(out_subpath, stage.outdir)
         log_subpath = os.path.join(stage.bookdir, subdir)
+        reader = None
 
         for file in files:
             if file[-5:] == '.root':
@@ -974,22 +1035,50 @@ def doshorten(stage):
 
                     # Also rename corresponding json file, if it exists.
 
-                    json_path = os.path.join(log_subpath, file + '.json')
-                    if larbatch_posix.exists(json_path):
+                    if reader == None:
+                        reader = LogReader(log_subpath)
+                    if reader.exists(file + '.json'):
                         shortjson = shortfile + '.json'
+                        json_path = os.path.join(log_subpath, file + '.json')
                         shortjson_path = os.path.join(log_subpath, shortjson)
                         print('%s\n->%s\n' % (json_path, shortjson_path))
-                        larbatch_posix.rename(json_path, shortjson_path)
+                        reader.rename(file + '.json', shortjson)
 
     return
 
 # Untar tarred up log files in logtir into bookdir.
+#
+# For each log tarball (log*.tar) in logdir, the members that are needed
+# for checking (see untar_members) are extracted into the corresponding
+# subdirectory of bookdir.  Tarballs are read directly from logdir (no
+# copy), and several tarballs are extracted in parallel.  Tarballs that
+# have already been extracted (flag file <tarball>.done exists in bookdir)
+# are skipped.
+#
+# If untar_index is true (option --noextract), tarballs are not extracted.
+# Instead, a sidecar index (<tarball>.index, see class LogTarball) is made
+# in bookdir, from which single members can be read (see class LogReader).
+# Tarballs that have already been extracted or indexed are skipped.
+#
+# If argument select is specified, only the specified (top level)
+# subdirectories of logdir are examined, instead of walking all of logdir.
 
-def untarlog(stage):
+def untarlog(stage, select=None):
 
     # Walk over logdir to look for log files.
+    # Make a list of tarballs that need to be extracted.
 
-    for log_subpath, subdirs, files in larbatch_posix.walk(stage.logdir):
+    if select == None:
+        entries = larbatch_posix.walk(stage.logdir, ordered=False)
+    else:
+        entries = []
+        for subdir in select:
+            log_subpath = os.path.join(stage.logdir, subdir)
+            if larbatch_posix.isdir(log_subpath):
+                entries.extend(larbatch_posix.walk(log_subpath, ordered=False))
+    tarballs = []       # List of (src, book_subpath, flag or index path)
+    book_subpaths = []  # Subdirectories of bookdir that may need to be made.
+    for log_subpath, subdirs, files in entries:
 
         # Only examine leaf directories.
 
@@ -1002,64 +1091,425 @@ def untarlog(stage):
         for file in files:
             if file.startswith('log') and file.endswith('.tar'):
                 src = '%s/%s' % (log_subpath, file)
-                dst = '%s/%s' % (book_subpath, file)
-                flag = '%s.done' % dst
-
-                # Decide if we need to copy this tarball to bookdir.
-
-                if dst != src and not larbatch_posix.exists(flag):
-
-                    # Copy tarball to bookdir.
-
-                    print('Copying tarball %s into %s' % (src, book_subpath))
-                    if not larbatch_posix.isdir(book_subpath):
-                        larbatch_posix.makedirs(book_subpath)
-                    larbatch_posix.copy(src, dst)
-
-                # Decide if we need to extract this tarball into bookdir.
-
-                if not larbatch_posix.exists(flag):
-
-                    # Extract tarball.
-
-                    print('Extracting tarball %s' % dst)
-                    jobinfo = subprocess.Popen(['tar','-xf', dst, '-C', book_subpath,
-                                                '--exclude=beam*.dat',
-                                                '--exclude=beam*.info',
-                                                '--exclude=core*',
-                                                '--exclude=*.db',
-                                                '--exclude=*.sh',
-                                                '--exclude=*.py*',
-                                                '--exclude=*.tar'],
-                                               stdout=subprocess.PIPE,
-                                               stderr=subprocess.PIPE)
-                    jobout, joberr = jobinfo.communicate()
-                    jobout = convert_str(jobout)
-                    joberr = convert_str(joberr)
-                    rc = jobinfo.poll()
-                    if rc != 0:
-                        print(jobout)
-                        print(joberr)
-                        print('Failed to extract log tarball in %s' % dst)
+                flag = '%s/%s.done' % (book_subpath, file)
+                index_path = '%s/%s.index' % (book_subpath, file)
+
+                # Decide if we need to extract (or index) this tarball into bookdir.
 
+                if not larbatch_posix.exists(flag) and not larbatch_posix.exists(index_path):
+                    if untar_index:
+                        tarballs.append((src, book_subpath, index_path))
                     else:
+                        tarballs.append((src, book_subpath, flag))
+                    if book_subpath != log_subpath:
+                        book_subpaths.append(book_subpath)
 
-                        # Create flag file.
+    # Make bookdir subdirectories.
 
-                        f = larbatch_posix.open(flag, 'w')
-                        f.write('\n')         # Don't want zero size file.
-                        f.close()
+    if len(book_subpaths) > 0:
+        larbatch_posix.makedirs_tree(book_subpaths)
 
-                        # Delete copy of tarball.
+    # Extract or index tarballs (in parallel).
 
-                        if dst != src:
-                            larbatch_posix.remove(dst)
+    func = extract_tarball
+    if untar_index:
+        func = index_tarball
+    for src, book_subpath, flag in tarballs:
+        if untar_index:
+            print('Indexing tarball %s' % src)
+        else:
+            print('Extracting tarball %s' % src)
+    for result, error in larbatch_utilities.parallel_call(func, tarballs,
+                                                          untar_max_parallel):
+        if error != None:
+            print(str(error))
+        elif result != None:
+            print(result)
 
     return
 
+# Extract members of one log tarball that match untar_members into
+# directory book_subpath, streaming from the source tarball.  Create flag
+# file if the tarball was read successfully, even if no member matched, so
+# that each tarball is streamed at most once.
+# Return None if successful, or a message.
+
+def extract_tarball(src, book_subpath, flag):
+
+    book_subpath = os.path.normpath(book_subpath)
+    nextracted = 0
+    try:
+        f = larbatch_posix.open(src, 'rb')
+        tf = tarfile.open(fileobj=f, mode='r|*')
+        for member in tf:
+            if not member.isfile():
+                continue
+            name = os.path.basename(member.name)
+            matched = False
+            for pattern in untar_members:
+                if fnmatch.fnmatch(name, pattern):
+                    matched = True
+                    break
+            if not matched:
+                continue
+
+            # Never write outside of book_subpath.
+
+            dest = os.path.normpath(os.path.join(book_subpath, member.name))
+            if not dest.startswith(book_subpath + '/'):
+                continue
+            destdir = os.path.dirname(dest)
+            if destdir != book_subpath and not larbatch_posix.isdir(destdir):
+                larbatch_posix.makedirs(destdir)
+            member_file = tf.extractfile(member)
+            out = larbatch_posix.open(dest, 'wb')
+            while True:
+                data = member_file.read(1048576)
+                if not data:
+                    break
+                out.write(data)
+            out.close()
+            nextracted = nextracted + 1
+        tf.close()
+        f.close()
+    except Exception as e:
+        larbatch_posix.invalidate_cache(book_subpath, recursive=True)
+        return '%s\nFailed to extract log tarball %s' % (str(e), src)
+    larbatch_posix.invalidate_cache(book_subpath, recursive=True)
+
+    # Create flag file.
+
+    f = larbatch_posix.open(flag, 'w')
+    f.write('\n')         # Don't want zero size file.
+    f.close()
+    if nextracted == 0:
+        return 'No files extracted from log tarball %s' % src
+    return None
+
+# Make sidecar index index_path of log tarball src (in directory book_subpath).
+# Members that match untar_members are saved in the index, if the tarball
+# is compressed.
+# Return None if successful, or an error message.
+
+def index_tarball(src, book_subpath, index_path):
+
+    try:
+        tarball = LogTarball(index_path)
+        tarball.build(src, untar_members)
+        tarball.save()
+    except Exception as e:
+        larbatch_posix.invalidate_cache(book_subpath, recursive=True)
+        return '%s\nFailed to index log tarball %s' % (str(e), src)
+    larbatch_posix.invalidate_cache(book_subpath, recursive=True)
+    return None
+
+# Report a message about a conflict between subdirectory subdir and another
+# subdirectory (e.g. duplicate file name).  The message is saved in
+# conflicts[subdir].  It is printed, unless it was already reported for
+# the same subdirectory by the previous check (argument old_conflicts, in
+# continuous check mode).
+
+def report_conflict(conflicts, old_conflicts, subdir, message):
+    if not subdir in conflicts:
+        conflicts[subdir] = []
+    conflicts[subdir].append(message)
+    if old_conflicts == None or not message in old_conflicts.get(subdir, []):
+        print(message)
+
+# Print a message, or append it to list messages, if specified.
+
+def report(messages, message):
+    if messages == None:
+        print(message)
+    else:
+        messages.append(message)
+
+# Return a key describing the stage configuration that affects the results
+# of checking worker subdirectories.  Saved check results are only reused
+# if the configuration hasn't changed.
+
+def check_config_key(stage, ana, has_metadata):
+    return json.dumps([check_manifest_version,
+                       stage.outdir, stage.bookdir,
+                       int(ana), int(has_metadata),
+                       stage.inputdef != '',
+                       stage.inputlist != '' or stage.inputfile != '',
+                       sorted(stage.datafiletypes)])
+
+# Read saved results of previous checks from the check manifest in bookdir.
+# Return value is a dictionary {subdir: {'fingerprint': ..., 'result': ...}}.
+# Return an empty dictionary if there is no manifest, the manifest is
+# unreadable, or the manifest was made for a different configuration.
+
+def load_check_manifest(bookdir, config_key):
+    result = {}
+    manifest_path = os.path.join(bookdir, 'check_manifest.json')
+    if not larbatch_posix.exists(manifest_path):
+        return result
+    try:
+        manifest = json.loads(''.join(larbatch_posix.readlines(manifest_path)))
+        if manifest['config'] == config_key:
+            result = manifest['subdirs']
+    except:
+        print('Ignoring unreadable check manifest %s.' % manifest_path)
+        result = {}
+    return result
+
+# Save results of checks to the check manifest (argument writer is the
+# BookkeepingWriter of the bookkeeping directory).  Argument entries is an
+# iterable of (subdir, check manifest entry) pairs, which are written one
+# at a time.
+
+def save_check_manifest(writer, config_key, entries):
+    f = writer.open('check_manifest.json')
+    f.write('{"config": %s, "subdirs": {' % json.dumps(config_key))
+    sep = ''
+    for subdir, entry in entries:
+        f.write('%s%s: %s' % (sep, json.dumps(subdir), json.dumps(entry, sort_keys=True)))
+        sep = ', '
+    f.write('}}\n')
+    f.close()
+
+# Return a listing fingerprint of the inputs of the checks of one worker
+# subdirectory.  The listing fingerprint includes the names, sizes, and
+# modification times of the small files that are read in the log
+# subdirectory (argument reader is a LogReader object for the log
+# subdirectory), including job summaries and log tarball indexes, and the
+# names and sizes of the data files in the output subdirectory.  It is made
+# from directory information only (no file contents are read).
+
+def check_listing(reader, out_subpath, data_file_types):
+    items = reader.entry_stats(check_listing_suffixes)
+    outputs = check_outputs(out_subpath, data_file_types)
+    return hashlib.md5(convert_bytes(json.dumps([items, outputs]))).hexdigest()
+
+# Return the names and sizes of the data files in an output subdirectory,
+# as a sorted list, or None if the output subdirectory doesn't exist.
+
+def check_outputs(out_subpath, data_file_types):
+    outputs = None
+    if project_utilities.fast_isdir(out_subpath):
+        outputs = []
+        for name in larbatch_posix.listdir(out_subpath):
+            ext = os.path.splitext(name)[1]
+            if len(ext) > 0 and ext[1:] in data_file_types:
+                try:
+                    size = larbatch_posix.stat(os.path.join(out_subpath, name)).st_size
+                except:
+                    size = -1
+                outputs.append([name, size])
+        outputs.sort()
+    return outputs
+
+# Return a content fingerprint of the inputs of the checks of one worker
+# subdirectory.  The content fingerprint includes the sizes and contents
+# (md5 hash) of the small control files that are read in the log
+# subdirectory, and the names and sizes of the data files in the output
+# subdirectory, plus their checksums from the job summary, if any.
+# The content fingerprint is only calculated for subdirectories whose
+# listing fingerprint has changed (modification times are not known in
+# ifdh mode, so a changed file may have the same listing).
+
+def check_fingerprint(reader, out_subpath, data_file_types):
+    items = []
+    for name in reader.listdir():
+        if name in ('lar.stat', 'sam_project.txt', 'cpid.txt') or \
+           name.endswith('.json') or name.endswith('.list'):
+            try:
+                size, mtime = reader.stat(name)
+                digest = hashlib.md5(convert_bytes(''.join(reader.readlines(name)))).hexdigest()
+                items.append([name, size, digest])
+            except:
+                items.append([name, -1, ''])
+    outputs = check_outputs(out_subpath, data_file_types)
+    if outputs != None:
+        for output in outputs:
+            output.append(reader.checksum(output[0]))
+    return hashlib.md5(convert_bytes(json.dumps([items, outputs], sort_keys=True))).hexdigest()
+
+# Check one subdirectory of bookdir.
+# This function performs the checks that only depend on the contents of
+# this subdirectory (see docheck).  Checks that compare different
+# subdirectories are done by the caller.  Log files are read using
+# LogReader reader, so log tarballs may be extracted or only indexed.
+#
+# Return value is a dictionary containing the following keys.
+#
+# subdir       - Subdirectory (relative to bookdir).
+# kind         - 'worker', 'start' (sam start project job), or 'other'.
+# bad          - 1 if any check failed, otherwise 0.
+# messages     - List of messages.
+# deferred_bad - 1 if any deferred check failed, otherwise 0.
+# deferred_messages - List of messages of deferred checks.
+# nev          - Number of events.
+# roots        - List of art root files as 3-tuples (path, nev, stream).
+# hists        - List of non-art root files.
+# sam_projects - List of sam projects.
+# cpids        - List of consumer process ids.
+# uris         - List of processed input files.
+#
+# The checks that docheck does after the duplicate filename check (file
+# name length, sam_project.txt and cpid.txt, transferred_uris.list) are
+# deferred checks.  Their messages are only reported, and their failure
+# only counts, if the duplicate filename check passes, so that messages
+# are the same as when checks are done in order.
+
+def check_subdir(stage, ana, has_metadata, log_subpath, subdir, reader):
+
+    result = {'subdir': subdir, 'kind': 'other', 'bad': 0, 'messages': [],
+              'deferred_bad': 0, 'deferred_messages': [],
+              'nev': 0, 'roots': [], 'hists': [],
+              'sam_projects': [], 'cpids': [], 'uris': []}
+    messages = result['messages']
+    out_subpath = os.path.join(stage.outdir, subdir)
+    dirok = project_utilities.fast_isdir(log_subpath)
+
+    # Get sam project from start job.
+
+    if dirok and log_subpath[-6:] == '_start':
+        result['kind'] = 'start'
+        if reader.exists('sam_project.txt'):
+            sam_project = reader.readlines('sam_project.txt')[0].strip()
+            if sam_project != '':
+                result['sam_projects'].append(sam_project)
+
+    # Regular worker jobs checked here.
+
+    if dirok and not subdir[-6:] == '_start' and not subdir[-5:] == '_stop' \
+            and not subdir == 'log':
+
+        result['kind'] = 'worker'
+        bad = 0
+
+        # Make sure that corresponding output directory exists.
+
+        if not project_utilities.fast_isdir(out_subpath):
+            messages.append('No output directory corresponding to subdirectory %s.' % subdir)
+            bad = 1
+
+        # Check lar exit status (if any).
+
+        if not bad:
+            if reader.exists('lar.stat'):
+                status = 0
+                try:
+                    status = int(reader.readlines('lar.stat')[0].strip())
+                    if status != 0:
+                        messages.append('Job in subdirectory %s ended with non-zero exit status %d.' % (
+                            subdir, status))
+                        bad = 1
+                except:
+                    messages.append('Bad file lar.stat in subdirectory %s.' % subdir)
+                    bad = 1
+
+        # Now check root files in this subdirectory.
+
+        if not bad:
+            nev = 0
+            roots = []
+            nev, roots, subhists = check_root(out_subpath, log_subpath, stage.datafiletypes,
+                                              messages, reader)
+            if not ana:
+                if len(roots) == 0 or nev < 0:
+                    messages.append('Problem with root file(s) in subdirectory %s.' % subdir)
+                    bad = 1
+            elif nev < -1 or len(subhists) == 0:
+                messages.append('Problem with analysis root file(s) in subdirectory %s.' % subdir)
+                bad = 1
+            result['nev'] = nev
+            result['roots'] = roots
+            result['hists'] = subhists
+
+        # Remaining checks are deferred (see above).
+
+        deferred = not bad
+        if deferred:
+            messages = result['deferred_messages']
+
+        # Make sure root file names do not exceed 200 characters.
+
+        if not bad and has_metadata:
+            for root in result['roots']:
+                rootname = os.path.basename(root[0])
+                if len(rootname) >= 200:
+                    messages.append('Filename %s in subdirectory %s is longer than 200 characters.' % (
+                        rootname, subdir))
+                    bad = 1
+
+        # Check existence of sam_project.txt and cpid.txt.
+
+        if not bad and stage.inputdef != '':
+            if not reader.exists('sam_project.txt'):
+                messages.append('Could not find file sam_project.txt')
+                bad = 1
+            if not reader.exists('cpid.txt'):
+                messages.append('Could not find file cpid.txt')
+                bad = 1
+            if not bad:
+                result['sam_projects'].append(reader.readlines('sam_project.txt')[0].strip())
+                result['cpids'].append(reader.readlines('cpid.txt')[0].strip())
+
+        # Check existence of transferred_uris.list.
+
+        if not bad and (stage.inputlist !='' or stage.inputfile != ''):
+            if not reader.exists('transferred_uris.list'):
+                messages.append('Could not find file transferred_uris.list')
+                bad = 1
+            if not bad:
+                lines = reader.readlines('transferred_uris.list')
+                for line in lines:
+                    uri = line.strip()
+                    if uri != '':
+                        result['uris'].append(uri)
+
+        result['bad'] = bad
+        if bad and deferred:
+            result['deferred_bad'] = 1
+
+    # Done.
+
+    return result
+
+# Check one subdirectory of bookdir, or reuse the saved result from
+# manifest, if the subdirectory hasn't changed.  A subdirectory is
+# unchanged if its listing fingerprint is the same as the saved one, or
+# else if its content fingerprint is the same as the saved one.  Contents
+# of files are only read if the listing fingerprint has changed.
+# Return value is a 2-tuple (entry, reused), where entry is the new
+# manifest entry {'listing': ..., 'fingerprint': ..., 'result': ...}.
+
+def check_subdir_saved(stage, ana, has_metadata, manifest, log_subpath, subdir, files):
+    out_subpath = os.path.join(stage.outdir, subdir)
+    reader = LogReader(log_subpath, files)
+    listing = check_listing(reader, out_subpath, stage.datafiletypes)
+    saved = manifest.get(subdir)
+    if saved != None and saved.get('listing') == listing:
+        return {'listing': listing, 'fingerprint': saved['fingerprint'],
+                'result': saved['result']}, True
+    fingerprint = check_fingerprint(reader, out_subpath, stage.datafiletypes)
+    if saved != None and saved.get('fingerprint') == fingerprint:
+        return {'listing': listing, 'fingerprint': fingerprint,
+                'result': saved['result']}, True
+    result = check_subdir(stage, ana, has_metadata, log_subpath, subdir, reader)
+    return {'listing': listing, 'fingerprint': fingerprint, 'result': result}, False
+
+# Call func for each argument tuple in arglist, using up to check_jobs
+# threads (option --jobs).  Return value is the list of return values,
+# in the same order as arglist.  Any exception is raised again here.
+
+def check_map(func, arglist):
+    if check_jobs <= 1 or len(arglist) <= 1:
+        return [func(*args) for args in arglist]
+    results = []
+    for result, error in larbatch_utilities.parallel_call(func, arglist, check_jobs):
+        if error != None:
+            raise error
+        results.append(result)
+    return results
+
 # Check project results in the specified directory.
 
-def docheck(project, stage, ana, quick=False):
+def docheck(project, stage, ana, quick=False, watch=None):
 
     # This method performs various checks on worker subdirectories, named
     # as <cluster>_<process>, where <cluster> and <process> are integers.
@@ -1107,15 +1557,33 @@ def docheck(project, stage, ana, quick=False):
     # For projects with no input (i.e. generator jobs), if there are fewer than
     # the requisite number of good generator jobs, a "missing_files.list" will be
     # generated with lines containing /dev/null.
+    #
+    # The results of checking each worker subdirectory are saved, together with
+    # a fingerprint of the files that were read, in file check_manifest.json in
+    # the specified directory.  Subsequent checks only check subdirectories that
+    # are new, or whose fingerprint has changed (unless option --recheck was
+    # specified).  Checks that compare different subdirectories (duplicate file
+    # names and process numbers) are always redone.
+    #
+    # In continuous check mode (option --watch), argument watch is the
+    # StageWatch object of this stage, which holds the results of previous
+    # checks (in a local on-disk store).  After the first check, only the
+    # subdirectories that are pending in watch are checked, and nothing is
+    # written if none of their results has changed.
+
+    incremental = watch != None and watch.initialized
 
     # Untar log files into bookdir.
 
-    untarlog(stage)
+    if incremental:
+        untarlog(stage, sorted(watch.pending))
+    else:
+        untarlog(stage)
 
     # Quick check?
 
     if quick == 1 and not ana:
-        return doquickcheck(project, stage, ana)
+        return doquickcheck(project, stage, ana, watch=watch)
 
     stage.checkinput()
 
@@ -1140,182 +1608,76 @@ def docheck(project, stage, ana, quick=False):
 
     # Loop over subdirectories (ignore files and directories named *_start and *_stop).
 
-    procmap = {}      # procmap[subdir] = <list of art root files and event counts>
-    processes = []    # Integer process numbers derived from subdirectory names.
-    filesana = []     # List of non-art root files.
-    sam_projects = [] # List of sam projects.
-    cpids = []        # List of successful sam consumer process ids.
-    uris = []         # List of input files processed successfully.
-    bad_workers = []  # List of bad worker subdirectories.
-
-
-    for log_subpath, subdirs, files in larbatch_posix.walk(stage.bookdir):
-
-        # Only examine files in leaf directories.
-
-        if len(subdirs) != 0:
-            continue
-
-        subdir = os.path.relpath(log_subpath, stage.bookdir)
-        if subdir == '.':
+    # Load results of previous checks.
+
+    config_key = check_config_key(stage, ana, has_metadata)
+    manifest = {}
+    if not incremental and not recheck:
+        manifest = load_check_manifest(stage.bookdir, config_key)
+    new_manifest = {}
+    nreused = 0
+
+    # Find subdirectories to check.
+    # In continuous check mode, only the leaf subdirectories of pending
+    # subdirectories are checked, and their saved results are fetched
+    # from watch.
+
+    tops = [stage.bookdir]
+    if incremental:
+        tops = [os.path.join(stage.bookdir, subdir) for subdir in sorted(watch.pending)]
+    leaves = []
+    for top in tops:
+        if incremental and not larbatch_posix.isdir(top):
             continue
-        out_subpath = os.path.join(stage.outdir, subdir)
-        dirok = project_utilities.fast_isdir(log_subpath)
-
-        # Update list of sam projects from start job.
-
-        if dirok and log_subpath[-6:] == '_start':
-            filename = os.path.join(log_subpath, 'sam_project.txt')
-            if larbatch_posix.exists(filename):
-                sam_project = larbatch_posix.readlines(filename)[0].strip()
-                if sam_project != '' and not sam_project in sam_projects:
-                    sam_projects.append(sam_project)
-
-        # Regular worker jobs checked here.
-
-        if dirok and not subdir[-6:] == '_start' and not subdir[-5:] == '_stop' \
-                and not subdir == 'log':
-
-            bad = 0
-
-            # Make sure that corresponding output directory exists.
-
-            if not project_utilities.fast_isdir(out_subpath):
-                print('No output directory corresponding to subdirectory %s.' % subdir)
-                bad = 1
-
-            # Check lar exit status (if any).
-
-            if not bad:
-                stat_filename = os.path.join(log_subpath, 'lar.stat')
-                if larbatch_posix.exists(stat_filename):
-                    status = 0
-                    try:
-                        status = int(larbatch_posix.readlines(stat_filename)[0].strip())
-                        if status != 0:
-                            print('Job in subdirectory %s ended with non-zero exit status %d.' % (
-                                subdir, status))
-                            bad = 1
-                    except:
-                        print('Bad file lar.stat in subdirectory %s.' % subdir)
-                        bad = 1
-
-            # Now check root files in this subdirectory.
-
-            if not bad:
-                nev = 0
-                roots = []
-                nev, roots, subhists = check_root(out_subpath, log_subpath, stage.datafiletypes)
-                if not ana:
-                    if len(roots) == 0 or nev < 0:
-                        print('Problem with root file(s) in subdirectory %s.' % subdir)
-                        bad = 1
-                elif nev < -1 or len(subhists) == 0:
-                    print('Problem with analysis root file(s) in subdirectory %s.' % subdir)
-                    bad = 1
-
-
-            # Check for duplicate filenames (only if metadata is being generated).
-
-            if not bad and has_metadata:
-                for root in roots:
-                    rootname = os.path.basename(root[0])
-                    for s in list(procmap.keys()):
-                        oldroots = procmap[s]
-                        for oldroot in oldroots:
-                            oldrootname = os.path.basename(oldroot[0])
-                            if rootname == oldrootname:
-                                print('Duplicate filename %s in subdirectory %s' % (rootname,
-                                                                                    subdir))
-                                olddir = os.path.basename(os.path.dirname(oldroot[0]))
-                                print('Previous subdirectory %s' % olddir)
-                                bad = 1
-
-            # Make sure root file names do not exceed 200 characters.
-
-            if not bad and has_metadata:
-                for root in roots:
-                    rootname = os.path.basename(root[0])
-                    if len(rootname) >= 200:
-                        print('Filename %s in subdirectory %s is longer than 200 characters.' % (
-                            rootname, subdir))
-                        bad = 1
-
-            # Check existence of sam_project.txt and cpid.txt.
-            # Update sam_projects and cpids.
-
-            if not bad and stage.inputdef != '':
-                filename1 = os.path.join(log_subpath, 'sam_project.txt')
-                if not larbatch_posix.exists(filename1):
-                    print('Could not find file sam_project.txt')
-                    bad = 1
-                filename2 = os.path.join(log_subpath, 'cpid.txt')
-                if not larbatch_posix.exists(filename2):
-                    print('Could not find file cpid.txt')
-                    bad = 1
-                if not bad:
-                    sam_project = larbatch_posix.readlines(filename1)[0].strip()
-                    if not sam_project in sam_projects:
-                        sam_projects.append(sam_project)
-                    cpid = larbatch_posix.readlines(filename2)[0].strip()
-                    if not cpid in cpids:
-                        cpids.append(cpid)
-
-            # Check existence of transferred_uris.list.
-            # Update list of uris.
-
-            if not bad and (stage.inputlist !='' or stage.inputfile != ''):
-                filename = os.path.join(log_subpath, 'transferred_uris.list')
-                if not larbatch_posix.exists(filename):
-                    print('Could not find file transferred_uris.list')
-                    bad = 1
-                if not bad:
-                    lines = larbatch_posix.readlines(filename)
-                    for line in lines:
-                        uri = line.strip()
-                        if uri != '':
-                            uris.append(uri)
-
-            # Save process number, and check for duplicate process numbers
-            # (only if no input).
-
-            if not has_input:
-                subdir_split = subdir.split('_')
-                if len(subdir_split) > 1:
-                    process = int(subdir_split[1])
-                    if process in processes:
-                        print('Duplicate process number')
-                        bad = 1
-                    else:
-                        processes.append(process)
-
-            # Save information about good root files.
-
-            if not bad:
-                procmap[subdir] = roots
-
-                # Save good histogram files.
-
-                filesana.extend(subhists)
-
-                # Count good events and root files.
-
-                nev_tot = nev_tot + nev
-                nroot_tot = nroot_tot + len(roots)
+        for log_subpath, subdirs, files in larbatch_posix.walk(top):
 
-            # Update list of bad workers.
+            # Only examine files in leaf directories.
 
-            if bad:
-                bad_workers.append(subdir)
-
-            # Print/save result of checks for one subdirectory.
-
-            if bad:
-                print('Bad subdirectory %s.' % subdir)
+            if len(subdirs) != 0:
+                continue
 
-    # Done looping over subdirectoryes.
-    # Dictionary procmap now contains a list of good processes
-    # and root files.
+            subdir = os.path.relpath(log_subpath, stage.bookdir)
+            if subdir == '.':
+                continue
+            leaves.append((log_subpath, subdir, files))
+    if incremental:
+        manifest = watch.entries([subdir for log_subpath, subdir, files in leaves])
+    tasks = [(stage, ana, has_metadata, manifest, log_subpath, subdir, files)
+             for log_subpath, subdir, files in leaves]
+
+    # Check subdirectories (in parallel, if requested), reusing saved results
+    # of unchanged subdirectories.  Results are combined in subdirectory order
+    # (also in continuous check mode), so that bookkeeping files don't depend
+    # on directory listing order or on the order that subdirectories arrived.
+
+    results = []
+    checked = set()      # Subdirectories that were checked (not reused).
+    for entry, reused in check_map(check_subdir_saved, tasks):
+        result = entry['result']
+        new_manifest[result['subdir']] = entry
+        results.append(result)
+        if reused:
+            nreused = nreused + 1
+        else:
+            checked.add(result['subdir'])
+
+    # In continuous check mode, combine new results with results of previous checks.
+    # Results of all subdirectories are read back from watch as they are needed.
+
+    if incremental:
+        print('Checked %d new or changed subdirectories.' % len(checked))
+    elif nreused > 0:
+        print('Reused saved check results for %d of %d subdirectories.' % (nreused, len(results)))
+    if watch != None:
+        watch.update(new_manifest, [result['subdir'] for result in results])
+        if incremental and len(checked) == 0 and not watch.dirty:
+            watch.done(watch.rc, watch.nfile)
+            return watch.rc
+        new_manifest = watch.items()
+        results = watch.result_list()
+    else:
+        new_manifest = sorted(new_manifest.items())
+        results.sort(key=lambda result: subdir_key(result['subdir']))
 
     # Before attempting to create bookkeeping files in stage.bookdir, check
     # whether this directory is readable.  If not readable, return error
@@ -1329,50 +1691,174 @@ def docheck(project, stage, ana, quick=False):
         return 1
 
     # Open files.
+    # Bookkeeping files are written into a local staging area, and are
+    # published in the bookkeeping directory together at the end.
+
+    writer = BookkeepingWriter(stage.bookdir)
+    filelist = writer.open('files.list')
+    eventslist = writer.open('events.list')
+    badfile = writer.open('bad.list')
+    missingfiles = writer.open('missing_files.list')
+    filesanalist = writer.open('filesana.list')
+    urislist = writer.open('transferred_uris.list')
+
+    # Create bookkeeping database (option --bookdb).  Otherwise, delete any
+    # existing database, which would be stale after this check.
+
+    db = StageDB(stage.bookdir)
+    if bookdb:
+        db.create()
+    elif 'stage.db' in contents:
+        db.remove()
+
+    # Combine results of subdirectories.
+    # Bookkeeping files are written as results are combined.
+
+    rootnames = {}       # rootnames[root file name] = path of good root file.
+    processes = set()    # Integer process numbers derived from subdirectory names.
+    sam_projects = []    # List of sam projects.
+    sam_project_set = set()
+    cpids = []           # List of successful sam consumer process ids.
+    cpid_set = set()
+    uris = set()         # Set of input files processed successfully.
+    streams = {}         # {stream: file}
+    nproc = 0            # Number of good processes.
+    nfile = 0            # Number of good art root files.
+    nhist = 0            # Number of good non-art root files.
+    nuri = 0             # Number of processed input files.
+    nerror = 0           # Number of bad worker subdirectories.
+    conflicts = {}       # conflicts[subdir] = messages about conflicts with other subdirectories.
+    old_conflicts = None # Conflict messages that were already printed (continuous check mode).
+    if incremental:
+        old_conflicts = watch.conflicts
+
+    for result in results:
+        subdir = result['subdir']
+        verbose = not incremental or subdir in checked
+        if verbose:
+            for message in result['messages']:
+                print(message)
 
-    filelistname = os.path.join(stage.bookdir, 'files.list')
-    filelist = safeopen(filelistname)
-
-    eventslistname = os.path.join(stage.bookdir, 'events.list')
-    eventslist = safeopen(eventslistname)
-
-    badfilename = os.path.join(stage.bookdir, 'bad.list')
-    badfile = safeopen(badfilename)
+        # Update list of sam projects from start job.
 
-    missingfilesname = os.path.join(stage.bookdir, 'missing_files.list')
-    missingfiles = safeopen(missingfilesname)
+        if result['kind'] == 'start':
+            for sam_project in result['sam_projects']:
+                if not sam_project in sam_project_set:
+                    sam_projects.append(sam_project)
+                    sam_project_set.add(sam_project)
 
-    filesanalistname = os.path.join(stage.bookdir, 'filesana.list')
-    filesanalist = safeopen(filesanalistname)
+        # Remaining checks are for regular worker jobs.
 
-    urislistname = os.path.join(stage.bookdir, 'transferred_uris.list')
-    urislist = safeopen(urislistname)
+        if result['kind'] != 'worker':
+            continue
+        bad = result['bad'] and not result['deferred_bad']
+        nev = result['nev']
+        roots = [tuple(root) for root in result['roots']]
+
+        # Check for duplicate filenames (only if metadata is being generated).
+
+        if not bad and has_metadata:
+            for root in roots:
+                rootname = os.path.basename(root[0])
+                if rootname in rootnames:
+                    report_conflict(conflicts, old_conflicts, subdir,
+                                    'Duplicate filename %s in subdirectory %s' % (rootname,
+                                                                                  subdir))
+                    olddir = os.path.basename(os.path.dirname(rootnames[rootname]))
+                    report_conflict(conflicts, old_conflicts, subdir,
+                                    'Previous subdirectory %s' % olddir)
+                    bad = 1
 
-    # Generate "files.list" and "events.list."
-    # Also fill stream-specific file list.
+        # Results of deferred checks.
 
-    nproc = 0
-    streams = {}    # {stream: file}
-    nfile = 0
-    for s in list(procmap.keys()):
-        nproc = nproc + 1
-        for root in procmap[s]:
-            nfile = nfile + 1
-            filelist.write('%s\n' % root[0])
-            eventslist.write('%s %d\n' % root[:2])
-            stream = root[2]
-            if stream != '':
-                if stream not in streams:
-                    streamlistname = os.path.join(stage.bookdir, 'files_%s.list' % stream)
-                    streams[stream] = safeopen(streamlistname)
-                streams[stream].write('%s\n' % root[0])
+        if not bad:
+            if verbose:
+                for message in result['deferred_messages']:
+                    print(message)
+            bad = result['deferred_bad']
 
-    # Generate "bad.list"
+        # Update sam_projects, cpids, and uris.
+        # Generate "transferred_uris.list."
 
-    nerror = 0
-    for bad_worker in bad_workers:
-        badfile.write('%s\n' % bad_worker)
-        nerror = nerror + 1
+        if not bad:
+            for sam_project in result['sam_projects']:
+                if not sam_project in sam_project_set:
+                    sam_projects.append(sam_project)
+                    sam_project_set.add(sam_project)
+            for cpid in result['cpids']:
+                if not cpid in cpid_set:
+                    cpids.append(cpid)
+                    cpid_set.add(cpid)
+            for uri in result['uris']:
+                urislist.write('%s\n' % uri)
+                uris.add(uri)
+                nuri = nuri + 1
+                if bookdb:
+                    db.add_uri(uri)
+
+        # Save process number, and check for duplicate process numbers
+        # (only if no input).
+
+        if not has_input:
+            subdir_split = subdir.split('_')
+            if len(subdir_split) > 1:
+                process = int(subdir_split[1])
+                if process in processes:
+                    report_conflict(conflicts, old_conflicts, subdir,
+                                    'Duplicate process number')
+                    bad = 1
+                else:
+                    processes.add(process)
+
+        # Save information about good root files.
+        # Generate "files.list," "events.list," and "filesana.list."
+        # Also fill stream-specific file list.
+
+        if not bad:
+            nproc = nproc + 1
+            if bookdb:
+                process_id = db.add_process(subdir, True)
+            for root in roots:
+                rootnames[os.path.basename(root[0])] = root[0]
+                nfile = nfile + 1
+                filelist.write('%s\n' % root[0])
+                eventslist.write('%s %d\n' % root[:2])
+                if bookdb:
+                    db.add_file(root[0], subdir, process_id, 'art', root[1], root[2])
+                stream = root[2]
+                if stream != '':
+                    if stream not in streams:
+                        streams[stream] = writer.open('files_%s.list' % stream)
+                    streams[stream].write('%s\n' % root[0])
+
+            # Save good histogram files.
+
+            for hist in result['hists']:
+                filesanalist.write('%s\n' % hist)
+                nhist = nhist + 1
+                if bookdb:
+                    db.add_file(hist, subdir, process_id, 'ana')
+
+            # Count good events and root files.
+
+            nev_tot = nev_tot + nev
+            nroot_tot = nroot_tot + len(roots)
+
+        # Update list of bad workers (generate "bad.list").
+
+        if bad:
+            badfile.write('%s\n' % subdir)
+            nerror = nerror + 1
+            if bookdb:
+                db.add_process(subdir, False)
+
+        # Print/save result of checks for one subdirectory.
+
+        if bad and (verbose or conflicts.get(subdir) != old_conflicts.get(subdir)):
+            print('Bad subdirectory %s.' % subdir)
+
+    if watch != None:
+        watch.conflicts = conflicts
 
     # Generate "missing_files.list."
 
@@ -1380,58 +1866,42 @@ def docheck(project, stage, ana, quick=False):
     if stage.inputdef == '' and not stage.pubs_output:
         input_files = get_input_files(stage)
         if len(input_files) > 0:
-            missing_files = list(set(input_files) - set(uris))
+            missing_files = list(set(input_files) - uris)
             for missing_file in missing_files:
                 missingfiles.write('%s\n' % missing_file)
                 nmiss = nmiss + 1
+                if bookdb:
+                    db.add_missing(missing_file)
         else:
-            nmiss = stage.num_jobs - len(procmap)
+            nmiss = stage.num_jobs - nproc
             for n in range(nmiss):
                 missingfiles.write('/dev/null\n')
-
-
-    # Generate "filesana.list."
-
-    for hist in filesana:
-        filesanalist.write('%s\n' % hist)
-
-    # Generate "transferred_uris.list."
-
-    for uri in uris:
-        urislist.write('%s\n' % uri)
+                if bookdb:
+                    db.add_missing('/dev/null')
 
     # Print summary.
 
     if ana:
         print("%d processes completed successfully." % nproc)
-        print("%d total good histogram files." % len(filesana))
+        print("%d total good histogram files." % nhist)
     else:
         print("%d total good events." % nev_tot)
         print("%d total good root files." % nroot_tot)
-        print("%d total good histogram files." % len(filesana))
+        print("%d total good histogram files." % nhist)
 
-    # Close files.
+    # Finish files.
 
-    filelist.close()
-    if nfile == 0:
-        project_utilities.addLayerTwo(filelistname)
-    eventslist.close()
-    if nfile == 0:
-        project_utilities.addLayerTwo(eventslistname)
     if nerror == 0:
         badfile.write('\n')
-    badfile.close()
     if nmiss == 0:
         missingfiles.write('\n')
-    missingfiles.close()
-    filesanalist.close()
-    if len(filesana) == 0:
-        project_utilities.addLayerTwo(filesanalistname)
-    if len(uris) == 0:
+    if nuri == 0:
         urislist.write('\n')
-    urislist.close()
-    for stream in list(streams.keys()):
-        streams[stream].close()
+
+    # Add bookkeeping database (single transaction) to bookkeeping files.
+
+    if bookdb:
+        db.publish(writer)
 
     # Make sam files.
 
@@ -1439,31 +1909,19 @@ def docheck(project, stage, ana, quick=False):
 
         # List of successful sam projects.
 
-        sam_projects_filename = os.path.join(stage.bookdir, 'sam_projects.list')
-        sam_projects_file = safeopen(sam_projects_filename)
+        sam_projects_file = writer.open('sam_projects.list')
         for sam_project in sam_projects:
             sam_projects_file.write('%s\n' % sam_project)
-        sam_projects_file.close()
-        if len(sam_projects) == 0:
-            project_utilities.addLayerTwo(sam_projects_filename)
 
         # List of successfull consumer process ids.
 
-        cpids_filename = os.path.join(stage.bookdir, 'cpids.list')
-        cpids_file = safeopen(cpids_filename)
+        cpids_file = writer.open('cpids.list')
         for cpid in cpids:
             cpids_file.write('%s\n' % cpid)
-        cpids_file.close()
-        if len(cpids) == 0:
-            project_utilities.addLayerTwo(cpids_filename)
 
         # Get number of consumed files.
 
-        cpids_list = ''
-        sep = ''
-        for cpid in cpids:
-            cpids_list = cpids_list + '%s%s' % (sep, cpid)
-            sep = ','
+        cpids_list = ','.join(cpids)
         if cpids_list != '':
             dim = 'consumer_process_id %s and consumed_status consumed' % cpids_list
             import_samweb()
@@ -1524,13 +1982,20 @@ def docheck(project, stage, ana, quick=False):
                 print('%d files failed' % nf)
                 print()
 
+    # Save check results.
+
+    save_check_manifest(writer, config_key, new_manifest)
+
     # Done
 
-    checkfilename = os.path.join(stage.bookdir, 'checked')
-    checkfile = safeopen(checkfilename)
+    checkfile = writer.open('checked')
     checkfile.write('\n')
-    checkfile.close()
-    project_utilities.addLayerTwo(checkfilename)
+
+    # Publish bookkeeping files ("checked" is published last).
+
+    writer.commit()
+    if bookdb:
+        db.close()
 
     if stage.inputdef == '' or stage.pubs_input:
         print('%d processes with errors.' % nerror)
@@ -1546,213 +2011,262 @@ def docheck(project, stage, ana, quick=False):
         result = 1
     if not ana and nroot_tot == 0:
         result = 1
-    if len(procmap) == 0:
+    if nproc == 0:
         result = 1
+    if watch != None:
+        watch.done(result, nroot_tot + nhist)
     return result
 
-def doquickcheck(project, stage, ana):
-
-    # Check that output and log directories exist. Dirs could be lost due to ifdhcp failures
-    if not larbatch_posix.isdir(stage.outdir):
-        print('Output directory %s does not exist.' % stage.outdir)
-        return 1
-
-    if not larbatch_posix.isdir(stage.bookdir):
-        print('Log directory %s does not exist.' % stage.bookdir)
-        return 1
-
-    print('Checking directory %s' % stage.bookdir)
-
-    #Aggregate the .list files form the bookdir up one dir. This is where the old docheck would put them, and it double-checks that the files made it back from the worker node.
-
-    goodFiles        = []       # list of art root files
-    goodAnaFiles     = []       # list of analysis root files
-    eventLists       = []       # list of art root files and number of events
-    badLists         = []       # list of bad root files
-    anaFiles         = []       # list of ana files
-    transferredFiles = []       # list of transferred files
-    streamLists      = {}       # dictionary which keeps track of files per stream
-
-    sam_projects     = []      # list of sam projects
-    cpids            = []      # list of consumer process ids
+# Quick check of one subdirectory of bookdir (see doquickcheck).
+# Return value is a dictionary containing the following keys.
+#
+# log_subpath - Subdirectory path.
+# messages    - List of messages.
+# nerrors     - Number of errors.
+# ok          - True if subdirectory was validated.
+# sam_projects, cpids, files, anafiles, events, bad, uris - Lists of lines
+#               read from the corresponding files in this subdirectory.
+# streams     - List of 2-tuples (stream list name, list of lines).
+
+def quickcheck_subdir(stage, log_subpath):
+
+    result = {'log_subpath': log_subpath, 'messages': [], 'nerrors': 0, 'ok': False,
+              'sam_projects': [], 'cpids': [], 'files': [], 'anafiles': [], 'events': [],
+              'bad': [], 'uris': [], 'streams': []}
+    messages = result['messages']
+    reader = LogReader(log_subpath)
+
+    #skip start and stop project jobs for now
+    if log_subpath[-6:] == '_start' or log_subpath[-5:] == '_stop':
+        if reader.exists('sam_project.txt'):
+            sam_project = reader.readlines('sam_project.txt')[0].strip()
+            if sam_project != '':
+                result['sam_projects'].append(sam_project)
+        return result
 
-    goodLogDirs      = set()   # Set of log directories.
-    nErrors = 0                # Number of erors uncovered
 
-    for log_subpath, subdirs, files in larbatch_posix.walk(stage.bookdir):
+    messages.append('Doing quick check of directory %s.' % log_subpath)
 
-        # Only examine files in leaf directories.
+    #first check the missing_file.list
 
-        if len(subdirs) != 0:
-            continue
 
-        #skip start and stop project jobs for now
-        if log_subpath[-6:] == '_start' or log_subpath[-5:] == '_stop':
-            filename = os.path.join(log_subpath, 'sam_project.txt')
-            if larbatch_posix.exists(filename):
-                sam_project = larbatch_posix.readlines(filename)[0].strip()
-                if sam_project != '' and not sam_project in sam_projects:
-                    sam_projects.append(sam_project)
-            continue
+    validateOK = 1
 
+    missingfilesname = os.path.join(log_subpath, 'missing_files.list')
 
-        print('Doing quick check of directory %s.' % log_subpath)
+    try:
+        missingfiles = []
+        if reader.exists('missing_files.list'):
+            missingfiles = reader.readlines('missing_files.list')
+    #if we can't find missing_files the check will not work
+    except:
+        messages.append('Cannot open file: %s' % missingfilesname)
+        validateOK = 0
 
-        subdir = os.path.relpath(log_subpath, stage.bookdir)
 
-        out_subpath = os.path.join(stage.outdir, subdir)
-        dirok = project_utilities.fast_isdir(log_subpath)
+    if validateOK == 1 and len(missingfiles) == 0:
+        messages.append('%s exists, but is empty' % missingfilesname)
+        validateOK = 0
 
-        #first check the missing_file.list
 
+    if validateOK == 1:
+        line = missingfiles[0]
+        line = line.strip('\n')
+        if( int(line) != 0 ):
+            validateOK = 0
 
-        validateOK = 1
 
-        missingfilesname = os.path.join(log_subpath, 'missing_files.list')
+    #If the validation failed, quit.
+    if validateOK != 1:
+        result['nerrors'] += 1
+        return result
 
-        #print missingfilesname
+    # Check existence of sam_project.txt and cpid.txt.
+    # Update sam_projects and cpids.
 
-        try:
-            #print 'Reading %s' % missingfilesname
-            missingfiles = project_utilities.saferead(missingfilesname)
-        #if we can't find missing_files the check will not work
-        except:
-            print('Cannot open file: %s' % missingfilesname)
-            validateOK = 0
+    if stage.inputdef != '':
 
+        if not reader.exists('sam_project.txt'):
+            messages.append('Could not find file sam_project.txt')
+            result['nerrors'] += 1
+        else:
+            result['sam_projects'].append(reader.readlines('sam_project.txt')[0].strip())
 
-        if validateOK == 1 and len(missingfiles) == 0:
-            print('%s exists, but is empty' % missingfilesname)
-            validateOK = 0
+        if not reader.exists('cpid.txt'):
+            messages.append('Could not find file cpid.txt')
+            result['nerrors'] += 1
+        else:
+            result['cpids'].append(reader.readlines('cpid.txt')[0].strip())
 
+    filelistsrc = os.path.join(log_subpath, 'files.list')
+    tmpArray = scan_file(filelistsrc, reader)
 
-        if validateOK == 1:
-            line = missingfiles[0]
-            line = line.strip('\n')
-            if( int(line) != 0 ):
-                validateOK = 0
+    if( tmpArray == [ -1 ] ):
+        result['nerrors'] += 1
+    else:
+        result['files'] = tmpArray
 
+    fileanalistsrc = os.path.join(log_subpath, 'filesana.list')
+    tmpArray = scan_file(fileanalistsrc, reader)
 
-        #If the validation failed, continue.
-        if validateOK != 1:
-            nErrors += 1
-            continue
+    if( not tmpArray == [ -1 ] ):
+        result['anafiles'] = tmpArray
 
-        #Copy files.
-        #print 'Appending Files'
+    eventlistsrc = os.path.join(log_subpath, 'events.list')
 
-        # Check existence of sam_project.txt and cpid.txt.
-        # Update sam_projects and cpids.
+    tmpArray = scan_file(eventlistsrc, reader)
 
-        if stage.inputdef != '':
+    if( tmpArray == [ -1 ] ):
+        result['nerrors'] += 1
+    else:
+        result['events'] = tmpArray
 
-            filename1 = os.path.join(log_subpath, 'sam_project.txt')
-            if not larbatch_posix.exists(filename1):
-                print('Could not find file sam_project.txt')
-                nErrors += 1
-            else:
-                sam_project = larbatch_posix.readlines(filename1)[0].strip()
-                if not sam_project in sam_projects:
-                    sam_projects.append(sam_project)
 
-            filename2 = os.path.join(log_subpath, 'cpid.txt')
-            if not larbatch_posix.exists(filename2):
-                print('Could not find file cpid.txt')
-                nErrors += 1
-            else:
-                cpid = larbatch_posix.readlines(filename2)[0].strip()
-                if not cpid in cpids:
-                    cpids.append(cpid)
+    badfilesrc = os.path.join(log_subpath, 'bad.list')
 
-        filelistsrc = os.path.join(log_subpath, 'files.list')
-        tmpArray = scan_file(filelistsrc)
 
-        if( tmpArray == [ -1 ] ):
-            nErrors += 1
-        else:
-            goodFiles.extend(tmpArray)
+    tmpArray = scan_file(badfilesrc, reader)
 
-        fileanalistsrc = os.path.join(log_subpath, 'filesana.list')
-        tmpArray = scan_file(fileanalistsrc)
+    #bad list begin empty is okay
+    if( tmpArray == [ -1 ] ):
+        pass
+    else:
+        result['bad'] = tmpArray
 
-        if( not tmpArray == [ -1 ] ):
-            goodAnaFiles.extend(tmpArray)
+    urislistsrc = os.path.join(log_subpath, 'transferred_uris.list')
 
-        eventlistsrc = os.path.join(log_subpath, 'events.list')
+    tmpArray = scan_file(urislistsrc, reader)
 
-        tmpArray = scan_file(eventlistsrc)
+    #empty uri file is not nessecary an error
+    if( tmpArray == [ -1 ] ):
+        pass
+    else:
+        result['uris'] = tmpArray
+    #create a list of files_*.list files. These are outputs from specific streams
+    streamList = reader.listdir()
 
+    for stream in streamList:
+        if( stream[:6] != "files_" ):
+            continue
+        streamfilesrc = os.path.join(log_subpath, stream)
+        tmpArray = scan_file(streamfilesrc, reader)
         if( tmpArray == [ -1 ] ):
-            nErrors += 1
+            result['nerrors'] += 1
         else:
-            eventLists.extend(tmpArray)
-
+            result['streams'].append((stream, tmpArray))
 
-        badfilesrc = os.path.join(log_subpath, 'bad.list')
+    result['ok'] = True
+    return result
 
+def doquickcheck(project, stage, ana, watch=None):
 
-        tmpArray = scan_file(badfilesrc)
+    # Check that output and log directories exist. Dirs could be lost due to ifdhcp failures
+    if not larbatch_posix.isdir(stage.outdir):
+        print('Output directory %s does not exist.' % stage.outdir)
+        return 1
 
-        #bad list begin empty is okay
-        if( tmpArray == [ -1 ] ):
-            pass
-        else:
-            badLists.extend(tmpArray)
+    if not larbatch_posix.isdir(stage.bookdir):
+        print('Log directory %s does not exist.' % stage.bookdir)
+        return 1
 
-        '''
-        missingfilesrc  = os.path.join(log_subpath, 'missing_files.list')
+    print('Checking directory %s' % stage.bookdir)
 
-        tmpArray = scan_file(missingfilesrc)
+    # Quick check does not maintain the bookkeeping database.  Delete any
+    # existing database, which would be stale after this check.
 
-        if( tmpArray == [ -1 ] ):
-            nErrors += 1
-        else:
-            missingLists.extend(tmpArray)
-        '''
+    StageDB(stage.bookdir).remove()
 
-        #if ana:
-        #    filesanalistsrc = os.path.join(log_subpath, 'filesana.list')
+    #Aggregate the .list files form the bookdir up one dir. This is where the old docheck would put them, and it double-checks that the files made it back from the worker node.
 
-        #    tmpArray = scan_file(filesanalistsrc)
+    goodFiles        = []       # list of art root files
+    goodAnaFiles     = []       # list of analysis root files
+    eventLists       = []       # list of art root files and number of events
+    badLists         = []       # list of bad root files
+    anaFiles         = []       # list of ana files
+    transferredFiles = []       # list of transferred files
+    streamLists      = {}       # dictionary which keeps track of files per stream
 
-        #    if( tmpArray == [ -1 ] ):
-        #        nErrors += 1
-        #    else:
-        #        anaFiles.extend(tmpArray)
+    sam_projects     = []      # list of sam projects
+    cpids            = []      # list of consumer process ids
 
-        urislistsrc = os.path.join(log_subpath, 'transferred_uris.list')
+    goodLogDirs      = set()   # Set of log directories.
+    nErrors = 0                # Number of erors uncovered
 
-        tmpArray = scan_file(urislistsrc)
+    # Find subdirectories to check.
+    # In continuous check mode (argument watch is the StageWatch object of
+    # this stage), only pending subdirectories are checked after the first
+    # check, and the results of other subdirectories are reused.
+
+    incremental = watch != None and watch.initialized
+    tops = [stage.bookdir]
+    if incremental:
+        tops = [os.path.join(stage.bookdir, subdir) for subdir in sorted(watch.pending)]
+    tasks = []
+    for top in tops:
+        if not larbatch_posix.isdir(top):
+            continue
+        for log_subpath, subdirs, files in larbatch_posix.walk(top):
 
-        #empty uri file is not nessecary an error
-        if( tmpArray == [ -1 ] ):
-            pass
-        else:
-            transferredFiles.extend(tmpArray)
-        #create a list of files_*.list files. These are outputs from specific streams
-        streamList = larbatch_posix.listdir(log_subpath)
+            # Only examine files in leaf directories.
 
-        for stream in streamList:
-            if( stream[:6] != "files_" ):
+            if len(subdirs) != 0:
                 continue
-            streamfilesrc = os.path.join(log_subpath, stream)
-            #print stream
-            tmpArray = scan_file(streamfilesrc)
-            if( tmpArray == [ -1 ] ):
-                nErrors += 1
+            tasks.append((stage, log_subpath))
+
+    # Check subdirectories (in parallel, if requested), and combine results
+    # in subdirectory order.
+
+    results = check_map(quickcheck_subdir, tasks)
+    results.sort(key=lambda result: subdir_key(os.path.relpath(result['log_subpath'],
+                                                               stage.bookdir)))
+    checked = set([result['log_subpath'] for result in results])
+    if incremental:
+        print('Checked %d new or changed subdirectories.' % len(results))
+        if len(results) == 0 and not watch.dirty:
+            watch.done(watch.rc, watch.nfile)
+            return watch.rc
+
+    # In continuous check mode, combine new results with results of previous checks.
+
+    if watch != None:
+        manifest = {}
+        order = []
+        for result in results:
+            subdir = os.path.relpath(result['log_subpath'], stage.bookdir)
+            manifest[subdir] = {'result': result}
+            order.append(subdir)
+        watch.update(manifest, order)
+        results = watch.result_list()
+
+    for result in results:
+        if not incremental or result['log_subpath'] in checked:
+            for message in result['messages']:
+                print(message)
+        nErrors += result['nerrors']
+        for sam_project in result['sam_projects']:
+            if not sam_project in sam_projects:
+                sam_projects.append(sam_project)
+        for cpid in result['cpids']:
+            if not cpid in cpids:
+                cpids.append(cpid)
+        goodFiles.extend(result['files'])
+        goodAnaFiles.extend(result['anafiles'])
+        eventLists.extend(result['events'])
+        badLists.extend(result['bad'])
+        transferredFiles.extend(result['uris'])
+        for stream, tmpArray in result['streams']:
+            if(streamLists.get(stream, "empty") == "empty" ):
+                streamLists[stream] = tmpArray
             else:
-                if(streamLists.get(stream, "empty") == "empty" ):
-                    streamLists[stream] = tmpArray
-                else:
-                    streamLists[stream].extend(tmpArray)
+                streamLists[stream].extend(tmpArray)
+        if result['ok']:
+            goodLogDirs.add(result['log_subpath'])
 
-        if validateOK == 1:
-            goodLogDirs.add(log_subpath)
+    # Remove the "checked" marker while bookkeeping files are updated
+    # (see BookkeepingWriter.read_batch).
 
     checkfilename = os.path.join(stage.bookdir, 'checked')
-    checkfile = safeopen(checkfilename)
-    checkfile.write('\n')
-    checkfile.close()
+    larbatch_posix.remove_if_exists(checkfilename)
 
     #create the input files.list for the next stage
     filelistdest = os.path.join(stage.bookdir, 'files.list')
@@ -1908,11 +2422,15 @@ def doquickcheck(project, stage, ana):
             if len(streamLists[stream]) == 0:
                 project_utilities.addLayerTwo(streamdest)
 
+    # Create the "checked" marker last, with a unique batch token.
 
-
-
+    checkfile = safeopen(checkfilename)
+    checkfile.write('\n%s\n' % uuid.uuid4().hex)
+    checkfile.close()
 
     print('Number of errors = %d' % nErrors)
+    if watch != None:
+        watch.done(nErrors, len(goodFiles) + len(goodAnaFiles))
 
     return nErrors
 
@@ -1937,8 +2455,9 @@ def dofetchlog(project, stage):
     # stage.bookdir.
 
     logids = []
-    for dirpath, dirnames, filenames in larbatch_posix.walk(stage.bookdir):
-        for filename in filenames:
+    for dirpath, dirnames, filenames in larbatch_posix.walk(stage.bookdir, ordered=False):
+        reader = LogReader(dirpath, filenames)
+        for filename in reader.listdir():
             if filename == 'env.txt':
 
                 # Look for either environment variable:
@@ -1950,8 +2469,7 @@ def dofetchlog(project, stage):
                 # changing the process number to zero.
 
                 logid = ''
-                envpath = os.path.join(dirpath, filename)
-                vars = larbatch_posix.readlines(envpath)
+                vars = reader.readlines(filename)
 
                 # JOBSUBPARENTJOBID
 
@@ -2022,6 +2540,7 @@ def dofetchlog(project, stage):
             jobout = convert_str(jobout)
             joberr = convert_str(joberr)
             rc = jobinfo.poll()
+            larbatch_posix.invalidate_cache(logdir, recursive=True)
             if rc != 0:
                 raise JobsubError(command, rc, jobout, joberr)
 
@@ -2039,6 +2558,100 @@ def dofetchlog(project, stage):
         return 1
 
 
+# Signal handler for continuous check mode.  Stop after the current check.
+
+def watch_signal(signum, frame):
+    global watch_stop
+    if not watch_stop:
+        print('Received signal %d, stopping after current check.' % signum)
+    watch_stop = True
+
+# Continuous check mode (option --watch).
+#
+# Check the specified stages (list of stage objects), then keep polling
+# the stage directories every watch_interval seconds, and check again
+# whenever new worker subdirectories arrive (see class StageWatch).
+# Parsed project definitions are kept in memory, and the results of
+# previous checks are kept by StageWatch, so each check only checks new
+# arrivals.
+#
+# Argument followon is a list of follow-on actions ('declare',
+# 'add_locations', 'define'), which are run whenever watch_batch new good
+# files have accumulated, or when new good files are waiting and no new
+# subdirectories have arrived since the last poll.
+#
+# Stop cleanly (after the current check) on SIGINT or SIGTERM.
+
+def dowatch(project, stages, ana, followon):
+
+    global watch_stop
+    watch_stop = False
+    watches = [StageWatch(stage) for stage in stages]
+    old_handlers = {}
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        old_handlers[signum] = signal.signal(signum, watch_signal)
+    print('Watching %d stage(s), polling every %d seconds.' % (len(watches), watch_interval))
+
+    try:
+        while not watch_stop:
+            for watch in watches:
+                if watch_stop:
+                    break
+                stage = watch.stage
+                try:
+                    arrived = watch.poll()
+                    if arrived:
+                        print('Stage %s:' % stage.name)
+                        docheck(project, stage, ana or stage.ana, stage.validate_on_worker,
+                                watch=watch)
+
+                    # Follow-on actions.
+
+                    nnew = watch.nfile - watch.nfile_done
+                    if len(followon) > 0 and nnew > 0 and \
+                       (nnew >= watch_batch or not arrived) and not watch_stop:
+                        print('Stage %s: %d new good files.' % (stage.name, nnew))
+                        dofollowon(project, stage, followon)
+                        watch.nfile_done = watch.nfile
+                except Exception as e:
+                    print('Error checking stage %s:' % stage.name)
+                    print(str(e))
+            larbatch_posix.flush_all()
+
+            # Wait for next poll.
+
+            t = 0
+            while t < watch_interval and not watch_stop:
+                time.sleep(1)
+                t = t + 1
+    finally:
+        for signum in old_handlers:
+            signal.signal(signum, old_handlers[signum])
+        for watch in watches:
+            watch.close()
+
+    print('Stopped watching.')
+    return 0
+
+# Run follow-on actions of continuous check mode for one stage (see dowatch).
+
+def dofollowon(project, stage, followon):
+
+    dim = project_utilities.dimensions_datastream(project, stage, ana=stage.ana)
+    if 'declare' in followon:
+        docheck_declarations(stage.bookdir, stage.outdir, True, ana=stage.ana)
+    if 'add_locations' in followon:
+        docheck_locations(dim, stage.outdir, True, False, False, False,
+                          bookdir=stage.bookdir)
+    if 'define' in followon:
+        defname = stage.defname
+        if stage.ana:
+            defname = stage.ana_defname
+        if defname == '':
+            print('No sam dataset definition name specified for this stage.')
+        else:
+            docheck_definition(defname, dim, True)
+
 # Check sam declarations.
 # Return 0 if all files are declared or don't have internal metadata.
 # Return nonzero if some files have metadata but are are not declared.
@@ -2053,44 +2666,55 @@ def docheck_declarations(logdir, outdir, declare, ana=False):
 
     import_samweb()
 
-    # Loop over root files listed in files.list or filesana.list.
+    # Loop over root files listed in bookkeeping database, or in files.list
+    # or filesana.list.  Files that the bookkeeping database records as
+    # declared are not looked up in sam again.
 
     roots = []
+    declared = set()
+    kind = 'art'
     listname = 'files.list'
     if ana:
+        kind = 'ana'
         listname = 'filesana.list'
-    fnlist = os.path.join(logdir, listname)
-    if larbatch_posix.exists(fnlist):
-        roots = larbatch_posix.readlines(fnlist)
+    db = StageDB(logdir)
+    have_db = db.open()
+    if have_db:
+        roots = db.files(kind)
+        declared = db.declared_files(kind)
     else:
-        raise RuntimeError('No %s file found %s, run project.py --check' % (listname, fnlist))
+        fnlist = os.path.join(logdir, listname)
+        lists = BookkeepingWriter.read_batch(logdir, [listname])
+        if lists != None and lists[listname] != None:
+            roots = lists[listname]
+        else:
+            raise RuntimeError('No %s file found %s, run project.py --check' % (listname, fnlist))
+
+    # Check metadata of all files.
+    # For files to be declared, read json metadata.
 
+    undeclared = set()
+    mdjsons = {}
+    readers = {}      # readers[log subdirectory] = LogReader
     for root in roots:
         path = root.strip()
+        if path in declared:
+            continue
         fn = os.path.basename(path)
         dirpath = os.path.dirname(path)
         dirname = os.path.relpath(dirpath, outdir)
-
-        # Check metadata
-
-        has_metadata = False
         try:
             md = samweb.getMetadata(filenameorid=fn)
-            has_metadata = True
         except samweb_cli.exceptions.FileNotFound:
-            pass
-
-        # Report or declare file.
-
-        if has_metadata:
-            print('Metadata OK: %s' % fn)
-        else:
+            undeclared.add(path)
             if declare:
-                print('Declaring: %s' % fn)
-                jsonfile = os.path.join(logdir, os.path.join(dirname, fn)) + '.json'
+                log_subpath = os.path.join(logdir, dirname)
+                if log_subpath not in readers:
+                    readers[log_subpath] = LogReader(log_subpath)
+                reader = readers[log_subpath]
                 mdjson = {}
-                if larbatch_posix.exists(jsonfile):
-                    mdlines = larbatch_posix.readlines(jsonfile)
+                if reader.exists(fn + '.json'):
+                    mdlines = reader.readlines(fn + '.json')
                     mdtext = ''
                     for line in mdlines:
                         mdtext = mdtext + line
@@ -2099,10 +2723,46 @@ def docheck_declarations(logdir, outdir, declare, ana=False):
                         mdjson = md
                     except:
                         pass
+
+                # Use checksum calculated by worker, if known.
+
+                if 'crc' not in mdjson and reader.checksum(fn) != None:
+                    mdjson['crc'] = reader.checksum(fn)
+                mdjsons[path] = mdjson
+
+    # Calculate checksums of all files to be declared that don't have a
+    # checksum in their json metadata, all at once.
+
+    crcs = {}
+    if declare and not ana:
+        crc_paths = []
+        for path in sorted(undeclared):
+            if 'crc' not in mdjsons[path]:
+                crc_paths.append(path)
+        if len(crc_paths) > 0:
+            crcs = root_metadata.fileEnstoreChecksums(crc_paths)
+
+    newly_declared = []
+    for root in roots:
+        path = root.strip()
+        fn = os.path.basename(path)
+
+        # Report or declare file.
+
+        if path not in undeclared:
+            print('Metadata OK: %s' % fn)
+            if path not in declared:
+                newly_declared.append(path)
+        else:
+            if declare:
+                print('Declaring: %s' % fn)
+                mdjson = mdjsons[path]
                 md = {}
                 if ana:
                     md = mdjson
                 else:
+                    if 'crc' not in mdjson and path in crcs:
+                        mdjson['crc'] = crcs[path]
                     expSpecificMetaData = expMetaData(os.environ['SAM_EXPERIMENT'],larbatch_posix.root_stream(path))
                     md = expSpecificMetaData.getmetadata(mdjson)
                 if len(md) > 0:
@@ -2113,6 +2773,7 @@ def docheck_declarations(logdir, outdir, declare, ana=False):
 
                     try:
                         samweb.declareFile(md=md)
+                        newly_declared.append(path)
                     except:
                         #if md.has_key('parents'):
                         #    del md['parents']
@@ -2126,6 +2787,16 @@ def docheck_declarations(logdir, outdir, declare, ana=False):
                 print('Not declared: %s' % fn)
                 result = 1
 
+    # Update sam declaration state in bookkeeping database.
+
+    if have_db:
+        if len(newly_declared) > 0:
+            db.set_declared(newly_declared)
+            writer = BookkeepingWriter(logdir)
+            db.publish(writer)
+            writer.commit()
+        db.close()
+
     return result
 
 # Print summary of files returned by sam query.
@@ -2237,7 +2908,7 @@ def doundefine(defname):
 # Check disk locations.  Maybe add or remove locations.
 # This method only generates output and returns zero.
 
-def docheck_locations(dim, outdir, add, clean, remove, upload):
+def docheck_locations(dim, outdir, add, clean, remove, upload, bookdir=''):
 
     if add:
         print('Adding disk locations.')
@@ -2258,24 +2929,50 @@ def docheck_locations(dim, outdir, add, clean, remove, upload):
 
     filelist = samweb.listFiles(dimensions=dim, stream=False)
 
-    # Look for listed files on disk under outdir.
+    # Look up disk locations of listed files in the bookkeeping database,
+    # if there is one.
 
     disk_dict = {}
     for filename in filelist:
         disk_dict[filename] = []
-    for out_subpath, subdirs, files in larbatch_posix.walk(outdir):
-
-        # Only examine files in leaf directories.
-
-        if len(subdirs) != 0:
-            continue
+    db_locs = {}
+    if bookdir != '':
+        db = StageDB(bookdir)
+        if db.open():
+            db_locs = db.locations(filelist)
+            db.close()
+
+    # The database may be stale, so only use database locations that
+    # exist on disk.
+
+    db_paths = []
+    for filename in db_locs:
+        for loc in db_locs[filename]:
+            db_paths.append((filename, loc))
+    found = check_map(larbatch_posix.exists,
+                      [(os.path.join(loc, filename),) for filename, loc in db_paths])
+    for db_path, ok in zip(db_paths, found):
+        if ok:
+            disk_dict[db_path[0]].append(db_path[1])
+
+    # Look for the remaining listed files on disk under outdir.
+
+    unverified = set([filename for filename in filelist if len(disk_dict[filename]) == 0])
+    if len(unverified) > 0:
+        for out_subpath, subdirs, files in larbatch_posix.walk(outdir):
+
+            # Only examine files in leaf directories.
+
+            if len(subdirs) != 0:
+                continue
 
-        for fn in files:
-            if fn in filelist:
-                disk_dict[fn].append(out_subpath)
+            for fn in files:
+                if fn in unverified:
+                    disk_dict[fn].append(out_subpath)
 
     # Check sam locations.
 
+    uploads = []      # Files to copy to dropbox, as (source, destination).
     for filename in filelist:
         disk_locs = disk_dict[filename]
         sam_locs = samweb.locateFile(filenameorid=filename)
@@ -2396,7 +3093,14 @@ def docheck_locations(dim, outdir, add, clean, remove, upload):
 
                     else:
                         print('Copying %s to dropbox directory %s.' % (filename, dropbox))
-                        larbatch_posix.copy(loc_filename, dropbox_filename)
+                        uploads.append((loc_filename, dropbox_filename))
+
+    # Copy files to dropbox (in parallel).
+
+    for src, dst, error in larbatch_posix.copy_many(uploads):
+        if error != None:
+            print(str(error))
+            print('Failed to copy %s to dropbox.' % src)
 
     return 0
 
@@ -2472,6 +3176,12 @@ def dojobsub(project, stage, makeup, recur):
 
     tmpworkdir = tempfile.mkdtemp()
 
+    # Files to be copied into the above directories (or stage.workdir),
+    # as a list of (source, destination) pairs.  The copies are done
+    # together (in parallel) after the list is complete.
+
+    workdir_copies = []
+
     #we're going to let jobsub_submit copy the workdir contents for us
     #each file that would go into the workdir is going to be added with
     # '-f <input_file>' with the full path, it can be either BlueArc or /pnfs/uboone
@@ -2503,7 +3213,7 @@ def dojobsub(project, stage, makeup, recur):
     for fcl in fcls:
       workfcl = os.path.join(tmpworkdir, os.path.basename(fcl))
       if os.path.abspath(fcl) != os.path.abspath(workfcl):
-        larbatch_posix.copy(fcl, workfcl)
+        workdir_copies.append((fcl, workfcl))
 
 
     # Construct a wrapper fcl file (called "wrapper.fcl") that will include
@@ -2587,7 +3297,7 @@ def dojobsub(project, stage, makeup, recur):
     setupscript = ''
     if not abssetupscript.startswith('/cvmfs/'):
         setupscript = os.path.join(stage.workdir,'setup_experiment.sh')
-        larbatch_posix.copy(abssetupscript, setupscript)
+        workdir_copies.append((abssetupscript, setupscript))
         jobsub_workdir_files_args.extend(['-f', setupscript])
         abssetupscript = ''
 
@@ -2601,7 +3311,7 @@ def dojobsub(project, stage, makeup, recur):
     #workscript = os.path.join(tmpworkdir, workname)
     workscript = os.path.join(tmpdir, workname)
     if stage.script != workscript:
-        larbatch_posix.copy(stage.script, workscript)
+        workdir_copies.append((stage.script, workscript))
 
     # Copy and rename sam start project script to work directory.
 
@@ -2612,7 +3322,7 @@ def dojobsub(project, stage, makeup, recur):
         #workstartscript = os.path.join(tmpworkdir, workstartname)
         workstartscript = os.path.join(tmpdir, workstartname)
         if stage.start_script != workstartscript:
-            larbatch_posix.copy(stage.start_script, workstartscript)
+            workdir_copies.append((stage.start_script, workstartscript))
 
     # Copy and rename sam stop project script to work directory.
 
@@ -2623,7 +3333,7 @@ def dojobsub(project, stage, makeup, recur):
         #workstopscript = os.path.join(tmpworkdir, workstopname)
         workstopscript = os.path.join(tmpdir, workstopname)
         if stage.stop_script != workstopscript:
-            larbatch_posix.copy(stage.stop_script, workstopscript)
+            workdir_copies.append((stage.stop_script, workstopscript))
 
     # Copy worker initialization scripts to work directory.
 
@@ -2634,7 +3344,7 @@ def dojobsub(project, stage, makeup, recur):
                     init_script)
             work_init_script = os.path.join(tmpworkdir, os.path.basename(init_script))
             if init_script != work_init_script:
-                larbatch_posix.copy(init_script, work_init_script)
+                workdir_copies.append((init_script, work_init_script))
 
     # Update stage.init_script from list to single script.
 
@@ -2673,7 +3383,7 @@ def dojobsub(project, stage, makeup, recur):
                     init_source)
         work_init_source = os.path.join(tmpworkdir, os.path.basename(init_source))
         if init_source != work_init_source:
-            larbatch_posix.copy(init_source, work_init_source)
+            workdir_copies.append((init_source, work_init_source))
 
     # Update stage.init_source from list to single script.
 
@@ -2706,7 +3416,7 @@ def dojobsub(project, stage, makeup, recur):
                 raise RuntimeError('Worker end-of-job script %s does not exist.\n' % end_script)
             work_end_script = os.path.join(tmpworkdir, os.path.basename(end_script))
             if end_script != work_end_script:
-                larbatch_posix.copy(end_script, work_end_script)
+                workdir_copies.append((end_script, work_end_script))
 
     # Update stage.end_script from list to single script.
 
@@ -2745,7 +3455,7 @@ def dojobsub(project, stage, makeup, recur):
                     raise RuntimeError('Worker midstage initialization source script %s does not exist.\n' % mid_source)
                 work_mid_source = os.path.join(tmpworkdir, os.path.basename(mid_source))
                 if mid_source != work_mid_source:
-                    larbatch_posix.copy(mid_source, work_mid_source)
+                    workdir_copies.append((mid_source, work_mid_source))
 
     # Generate midstage source initialization wrapper script mid_source_wrapper.sh 
     # and update stage.mid_script to point to wrapper.
@@ -2777,7 +3487,7 @@ def dojobsub(project, stage, makeup, recur):
                     raise RuntimeError('Worker midstage finalization script %s does not exist.\n' % mid_script)
                 work_mid_script = os.path.join(tmpworkdir, os.path.basename(mid_script))
                 if mid_script != work_mid_script:
-                    larbatch_posix.copy(mid_script, work_mid_script)
+                    workdir_copies.append((mid_script, work_mid_script))
 
     # Generate midstage finalization wrapper script mid_wrapper.sh and update stage.mid_script 
     # to point to wrapper.
@@ -2810,6 +3520,7 @@ def dojobsub(project, stage, makeup, recur):
 
     helpers = ('root_metadata.py',
                'merge_json.py',
+               'job_summary.py',
                'subruns.py',
                'validate_in_job.py',
                'mkdir.py',
@@ -2831,7 +3542,7 @@ def dojobsub(project, stage, makeup, recur):
         if rc == 0:
             work_helper = os.path.join(tmpworkdir, helper)
             if helper_path != work_helper:
-                larbatch_posix.copy(helper_path, work_helper)
+                workdir_copies.append((helper_path, work_helper))
         else:
             print('Helper script %s not found.' % helper)
 
@@ -2863,26 +3574,38 @@ def dojobsub(project, stage, makeup, recur):
             #print 'helper_path = %s' % helper_path
             work_helper = os.path.join(tmpworkdir, os.path.basename(helper_path))
             if helper_path != work_helper:
-                larbatch_posix.copy(helper_path, work_helper)
+                workdir_copies.append((helper_path, work_helper))
         else:
             print('Helper python module %s not found.' % helper_module)
 
+    # Do all of the above copies.
+
+    copy_errors = 0
+    for src, dst, error in larbatch_posix.copy_many(workdir_copies):
+        if error != None:
+            print('Error copying %s to %s:' % (src, dst))
+            print(str(error))
+            copy_errors += 1
+    if copy_errors > 0:
+        raise RuntimeError('%d files could not be copied to work directory.' % copy_errors)
+
     # If this is a makeup action, find list of missing files.
     # If sam information is present (cpids.list), create a makeup dataset.
 
     if makeup:
 
-        checked_file = os.path.join(stage.bookdir, 'checked')
-        if not larbatch_posix.exists(checked_file):
+        # Read bookkeeping files of the last check (all from the same check).
+
+        lists = BookkeepingWriter.read_batch(stage.bookdir, ['bad.list', 'missing_files.list',
+                                                             'files.list', 'cpids.list'])
+        if lists == None:
             raise RuntimeError('Wait for any running jobs to finish and run project.py --check')
         makeup_count = 0
 
         # First delete bad worker subdirectories.
 
-        bad_filename = os.path.join(stage.bookdir, 'bad.list')
-        if larbatch_posix.exists(bad_filename):
-            lines = larbatch_posix.readlines(bad_filename)
-            for line in lines:
+        if lists['bad.list'] != None:
+            for line in lists['bad.list']:
                 bad_subdir = line.strip()
                 if bad_subdir != '':
                     bad_path = os.path.join(stage.outdir, bad_subdir)
@@ -2904,10 +3627,8 @@ def dojobsub(project, stage, makeup, recur):
 
         missing_files = []
         if stage.inputdef == '':
-            missing_filename = os.path.join(stage.bookdir, 'missing_files.list')
-            if larbatch_posix.exists(missing_filename):
-                lines = larbatch_posix.readlines(missing_filename)
-                for line in lines:
+            if lists['missing_files.list'] != None:
+                for line in lists['missing_files.list']:
                     words = line.split()
                     if len(words) > 0:
                         missing_files.append(words[0])
@@ -2933,10 +3654,8 @@ def dojobsub(project, stage, makeup, recur):
             # Loop over good output files to extract existing
             # process numbers and determine missing process numbers.
 
-            output_files = os.path.join(stage.bookdir, 'files.list')
-            if larbatch_posix.exists(output_files):
-                lines = larbatch_posix.readlines(output_files)
-                for line in lines:
+            if lists['files.list'] != None:
+                for line in lists['files.list']:
                     dir = os.path.basename(os.path.dirname(line))
                     dir_parts = dir.split('_')
                     if len(dir_parts) > 1:
@@ -2963,10 +3682,8 @@ def dojobsub(project, stage, makeup, recur):
         # Get list of successful consumer process ids.
 
         cpids = []
-        cpids_filename = os.path.join(stage.bookdir, 'cpids.list')
-        if larbatch_posix.exists(cpids_filename):
-            cpids_files = larbatch_posix.readlines(cpids_filename)
-            for line in cpids_files:
+        if lists['cpids.list'] != None:
+            for line in lists['cpids.list']:
                 cpids.append(line.strip())
 
         # Create makeup dataset definition.
@@ -3648,10 +4365,15 @@ def domerge(stage, mergehist, mergentuple):
 
     hlist = []
     hnlist = os.path.join(stage.bookdir, 'filesana.list')
-    if larbatch_posix.exists(hnlist):
-        hlist = larbatch_posix.readlines(hnlist)
+    db = StageDB(stage.bookdir)
+    if db.open():
+        hlist = db.files('ana')
+        db.close()
     else:
-        raise RuntimeError('No filesana.list file found %s, run project.py --checkana' % hnlist)
+        lists = BookkeepingWriter.read_batch(stage.bookdir, ['filesana.list'])
+        if lists == None or lists['filesana.list'] == None:
+            raise RuntimeError('No filesana.list file found %s, run project.py --checkana' % hnlist)
+        hlist = [line.strip() for line in lists['filesana.list']]
 
     histurlsname_temp = 'histurls.list'
     histurls = safeopen(histurlsname_temp)
@@ -3686,6 +4408,7 @@ def domerge(stage, mergehist, mergentuple):
         comlist = mergecom.split()
         comlist.extend(["-f", "-k", name_temp, '@' + histurlsname_temp])
         rc = subprocess.call(comlist, stdout=sys.stdout, stderr=sys.stderr)
+        larbatch_posix.invalidate_cache(name_temp)
         if rc != 0:
             print("%s exit status %d" % (mergecom, rc))
         if name != name_temp:
@@ -3758,8 +4481,9 @@ def doaudit(stage):
             if me ==1:
                 flist = []
                 fnlist = os.path.join(stage.bookdir, 'files.list')
-                if larbatch_posix.exists(fnlist):
-                    flist = larbatch_posix.readlines(fnlist)
+                lists = BookkeepingWriter.read_batch(stage.bookdir, ['files.list'])
+                if lists != None and lists['files.list'] != None:
+                    flist = lists['files.list']
                     slist = []
                     for line in flist:
                         slist.append(line.split()[0])
@@ -3890,6 +4614,13 @@ def xmlhelp():
 
 def main(argv):
 
+    global recheck
+    global check_jobs
+    global bookdb
+    global untar_index
+    global watch_interval
+    global watch_batch
+
     # Parse arguments.
 
     xmlfile = ''
@@ -3910,6 +4641,7 @@ def main(argv):
     pubs_version = None
     check = 0
     checkana = 0
+    watch = 0
     shorten = 0
     fetchlog = 0
     mergehist = 0
@@ -3977,6 +4709,10 @@ def main(argv):
         elif args[0] == '--tmpdir' and len(args) > 1:
             os.environ['TMPDIR'] = args[1]
             del args[0:2]
+        elif args[0] == '--metrics':
+            larbatch_utilities.enable_metrics()
+            atexit.register(larbatch_utilities.print_metrics)
+            del args[0]
         elif args[0] == '--lines' and len(args) > 1:
             lines = args[1]
             del args[0:2]
@@ -4015,6 +4751,27 @@ def main(argv):
         elif args[0] == '--checkana':
             checkana = 1
             del args[0]
+        elif args[0] == '--recheck':
+            recheck = True
+            del args[0]
+        elif args[0] == '--jobs' and len(args) > 1:
+            check_jobs = int(args[1])
+            del args[0:2]
+        elif args[0] == '--bookdb':
+            bookdb = True
+            del args[0]
+        elif args[0] == '--noextract':
+            untar_index = True
+            del args[0]
+        elif args[0] == '--watch':
+            watch = 1
+            del args[0]
+        elif args[0] == '--watch_interval' and len(args) > 1:
+            watch_interval = int(args[1])
+            del args[0:2]
+        elif args[0] == '--watch_batch' and len(args) > 1:
+            watch_batch = int(args[1])
+            del args[0:2]
         elif args[0] == '--shorten':
             shorten = 1
             del args[0]
@@ -4174,6 +4931,23 @@ def main(argv):
     # options).
 
     num_action = submit + check + checkana + fetchlog + merge + mergehist + mergentuple + audit + stage_status + makeup + define + define_ana + undefine + declare + declare_ana
+
+    # In continuous check mode, declare, add_locations, and define are
+    # follow-on actions of the check.
+
+    followon = []
+    if watch:
+        if declare:
+            followon.append('declare')
+        if add_locations:
+            followon.append('add_locations')
+        if define:
+            followon.append('define')
+        if num_action - check - checkana - declare - define > 0 or (check and checkana):
+            print('Option --watch can only be combined with --check or --checkana, and with --declare, --add_locations, and --define.')
+            return 1
+        num_action = 0
+
     if num_action > 1:
         print('More than one action was specified.')
         return 1
@@ -4444,6 +5218,15 @@ def main(argv):
 
     rc = 0
 
+    if watch:
+
+        # Continuous check (does not return until stopped).
+
+        rc = dowatch(project, [stages[stagename] for stagename in stagenames], checkana,
+                     followon)
+        larbatch_posix.flush_all()
+        return rc
+
     if submit or makeup:
 
         # Submit jobs.
@@ -4617,7 +5400,7 @@ def main(argv):
             dim = project_utilities.dimensions_datastream(project, stage, ana=stage.ana)
             docheck_locations(dim, stage.outdir,
                               add_locations, clean_locations, remove_locations,
-                              upload)
+                              upload, bookdir=stage.bookdir)
 
     if check_locations_ana or add_locations_ana or clean_locations_ana or \
        remove_locations_ana or upload_ana:
@@ -4630,7 +5413,7 @@ def main(argv):
             dim = project_utilities.dimensions_datastream(project, stage, ana=True)
             docheck_locations(dim, stage.outdir,
                               add_locations_ana, clean_locations_ana, remove_locations_ana,
-                              upload_ana)
+                              upload_ana, bookdir=stage.bookdir)
 
     if check_tape:
 
@@ -4652,6 +5435,10 @@ def main(argv):
             dim = project_utilities.dimensions_datastream(project, stage, ana=True)
             docheck_tape(dim)
 
+    # Wait for any background (write-behind) uploads to finish.
+
+    larbatch_posix.flush_all()
+
     # Done.
 
     return rc
@@ -4667,12 +5454,18 @@ def safeopen(destination):
 # Invoke main program.
 
 #Utility funciton to scan a file and return its contents as a list
-def scan_file(fileName):
+def scan_file(fileName, reader=None):
     #openable = 1
     returnArray = []
     try:
         #print 'Reading %s' % fileName
-        fileList = project_utilities.saferead(fileName)
+        if reader == None:
+            fileList = project_utilities.saferead(fileName)
+        else:
+            fileList = []
+            name = os.path.basename(fileName)
+            if reader.exists(name):
+                fileList = reader.readlines(name)
     #if we can't find missing_files the check will not work
     except:
         #print 'Cannot open file: %s' % fileName